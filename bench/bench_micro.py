@@ -0,0 +1,460 @@
+"""Микробенчмарки методов хранилища (SqliteDatabase) и функций форматирования.
+
+Для каждого размера набора данных создаётся (и кэшируется в --data-dir)
+база с N заявок, N/5 пользователей, N/5 отзывов и N/2 архивных заявок.
+Каждый кейс калибруется как timeit.autorange и повторяется --repeat раз;
+результаты сохраняются в JSON, который можно сравнить с прошлым прогоном.
+
+    python bench/bench_micro.py --sizes 1000 100000 1000000 --json after.json --compare before.json
+    python bench/bench_micro.py --filter format_       # только форматтеры
+
+В конце печатаются публичные методы Storage, для которых нет кейса, —
+при добавлении метода в Storage добавьте и кейс сюда.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# импорт main не должен трогать рабочую базу
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.gettempdir(), "tourbot-bench-import.db"))
+
+import main  # noqa: E402
+
+STATUSES = ["new", "in_progress", "approved", "rejected"]
+BUDGETS = ["до 150 000 ₽", "до 1500$ на двоих", "200-300 тыс", "от 100к на человека", "не знаю"]
+DESTINATIONS = ["Турция", "Египет", "ОАЭ", "Таиланд", "Вьетнам", "Сочи", "Мальдивы", "Шри‑Ланка"]
+# время в сиде (now = "2025-06-01T12:00:00") в epoch-секундах
+SEED_TS = 1748779200
+BUNDLED = [(name, country, "|".join(aliases), "bundled") for name, country, aliases in main.BUNDLED_DESTINATIONS]
+TEXT = "Отличный отдых, всё понравилось! Отель <5*> & питание — супер. " * 2
+
+
+# ------------------------- данные -------------------------
+
+
+def seed(path: str, n: int) -> None:
+    db = main.SqliteDatabase(path)
+    cur = db.conn.cursor()
+    now = "2025-06-01T12:00:00"
+    old = "2024-01-01T12:00:00"
+    users = max(n // 5, 1)
+    chunk = 50_000
+
+    def insert(sql: str, rows) -> None:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk:
+                cur.executemany(sql, batch)
+                batch.clear()
+        if batch:
+            cur.executemany(sql, batch)
+        db.conn.commit()
+
+    insert(
+        "INSERT INTO users (id, tg_id, username, first_name, created_at, last_seen_at) VALUES (?,?,?,?,?,?)",
+        ((i, 1_000_000 + i, f"user{i}", f"Имя {i}", now, now) for i in range(1, users + 1)),
+    )
+
+    def app_row(i: int, archived: bool):
+        uid = 1 + i % users
+        phone = f"79{i % (n // 10 + 1):09d}"
+        status = STATUSES[2 + i % 2] if archived else STATUSES[i % 4]
+        return (
+            i, uid, 1_000_000 + uid, f"user{uid}", status, old if archived else now, old if archived else now,
+            DESTINATIONS[i % len(DESTINATIONS)], "июль", 2, i % 3, BUDGETS[i % len(BUDGETS)], "без пожеланий",
+            "+" + phone, phone,
+        )
+
+    cols = (
+        "id, user_id, tg_id, username, status, created_at, updated_at, destination, dates, "
+        "adults, children, budget, wishes, contact, contact_phone"
+    )
+    insert(f"INSERT INTO applications ({cols}) VALUES ({','.join('?' * 15)})", (app_row(i, False) for i in range(1, n + 1)))
+    insert(
+        f"INSERT INTO applications_archive ({cols}) VALUES ({','.join('?' * 15)})",
+        (app_row(i, True) for i in range(n + 1, n + n // 2 + 1)),
+    )
+    insert(
+        "INSERT INTO reviews (id, application_id, tg_id, username, first_name, stars, body, created_at, updated_at, photos) "
+        "VALUES (?,?,?,?,?,?,?,?,?,?)",
+        (
+            (i, i, 1_000_000 + i % users, f"user{i}", f"Имя {i}", 1 + i % 5, TEXT if i % 3 else None, now, now,
+             3 if i % 4 == 0 else 0)
+            for i in range(1, n // 5 + 1)
+        ),
+    )
+    # у каждого четвёртого отзыва три фото
+    insert(
+        "INSERT INTO review_photos (review_id, position, file_id) VALUES (?,?,?)",
+        ((i, k, f"AgACAgIAAxkBAAI{i:08d}_{k}") for i in range(4, n // 5 + 1, 4) for k in range(3)),
+    )
+    db.conn.execute("ANALYZE")
+    db.conn.close()
+
+
+def prepare_db(data_dir: str, n: int) -> str:
+    """Копия эталонной базы размера n: кейсы меняют данные, эталон остаётся чистым."""
+    os.makedirs(data_dir, exist_ok=True)
+    pristine = os.path.join(data_dir, f"seed_{n}.db")
+    if not os.path.exists(pristine):
+        print(f"seeding {n} rows…", flush=True)
+        seed(pristine + ".tmp", n)
+        os.replace(pristine + ".tmp", pristine)
+    work = os.path.join(data_dir, f"work_{n}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(pristine, work)
+    return work
+
+
+# ------------------------- кейсы --------------------------
+
+
+@dataclass
+class Ctx:
+    db: main.SqliteDatabase
+    n: int
+    users: int
+    reviews: int
+    rnd: random.Random = field(default_factory=lambda: random.Random(1))
+    created_reviews: List[int] = field(default_factory=list)
+
+    def app_id(self) -> int:
+        return self.rnd.randint(1, self.n)
+
+    def archived_id(self) -> int:
+        return self.rnd.randint(self.n + 1, self.n + max(self.n // 2, 1))
+
+    def user_id(self) -> int:
+        return self.rnd.randint(1, self.users)
+
+    def review_id(self) -> int:
+        return self.rnd.randint(1, max(self.reviews, 1))
+
+    def phone(self) -> str:
+        return f"79{self.rnd.randint(0, self.n // 10):09d}"
+
+
+@dataclass
+class Case:
+    group: str
+    name: str
+    make: Callable[[Ctx], Callable[[int], object]]
+    # сколько вызовов кейс выдержит (для удаляющих операций)
+    budget: Optional[Callable[[Ctx], int]] = None
+
+
+def app_data() -> dict:
+    return {
+        "destination": "Турция",
+        "dates": "июль",
+        "adults": 2,
+        "children": 1,
+        "budget": "до 150 000 ₽",
+        "wishes": "первая линия",
+        "contact": "+7 999 123-45-67",
+    }
+
+
+def _create_review(c: Ctx, photos: List[str] = ()):
+    def run(i):
+        c.created_reviews.append(
+            c.db.create_review(10_000_000 + len(c.created_reviews), 1, "u", "Имя", 5, TEXT, photos)
+        )
+    return run
+
+
+def _broadcast(c: Ctx) -> int:
+    if not hasattr(c, "broadcast_id"):
+        c.broadcast_id = c.db.create_broadcast(1, "Горящие туры!")
+    return c.broadcast_id
+
+
+DB_CASES = [
+    Case("db", "review_for_application_exists", lambda c: lambda i: c.db.review_for_application_exists(c.app_id())),
+    Case("db", "get_application_tg_id", lambda c: lambda i: c.db.get_application_tg_id(c.app_id())),
+    Case("db", "get_application_tg_id[archive]", lambda c: lambda i: c.db.get_application_tg_id(c.archived_id())),
+    Case("db", "create_review", _create_review),
+    Case("db", "create_review[3 photos]", lambda c: _create_review(c, ["AgACAgIAAxkBAAI_a", "AgACAgIAAxkBAAI_b", "AgACAgIAAxkBAAI_c"])),
+    Case("db", "list_review_photos", lambda c: lambda i: c.db.list_review_photos(c.review_id())),
+    Case("db", "latest_review_photos[10]", lambda c: lambda i: c.db.latest_review_photos(10, 3)),
+    Case("db", "delete_review_photos", lambda c: lambda i: c.db.delete_review_photos(c.review_id())),
+    Case("db", "list_reviews_newest_first[200]", lambda c: lambda i: c.db.list_reviews_newest_first(limit=200)),
+    Case("db", "list_reviews_newest_first[25]", lambda c: lambda i: c.db.list_reviews_newest_first(limit=25)),
+    Case("db", "list_reviews_newest_first[26, keyset]", lambda c: lambda i: c.db.list_reviews_newest_first(limit=26, before_id=c.review_id())),
+    Case("db", "get_review", lambda c: lambda i: c.db.get_review(c.review_id())),
+    Case("db", "update_review_body", lambda c: lambda i: c.db.update_review_body(c.review_id(), TEXT)),
+    Case("db", "update_review_stars", lambda c: lambda i: c.db.update_review_stars(c.review_id(), 1 + i % 5)),
+    Case(
+        "db",
+        "delete_review",
+        lambda c: lambda i: c.db.delete_review(c.created_reviews.pop()),
+        budget=lambda c: len(c.created_reviews),
+    ),
+    Case("db", "get_or_create_user[existing]", lambda c: lambda i: c.db.get_or_create_user(1_000_000 + c.user_id(), "u", "Имя")),
+    Case("db", "get_or_create_user[new]", lambda c: lambda i: c.db.get_or_create_user(50_000_000 + i, "u", "Имя")),
+    Case("db", "get_user_by_tg", lambda c: lambda i: c.db.get_user_by_tg(1_000_000 + c.user_id())),
+    Case("db", "create_application", lambda c: (lambda u: lambda i: c.db.create_application(u, app_data()))(c.db.get_user_by_tg(1_000_001))),
+    Case("db", "get_application", lambda c: lambda i: c.db.get_application(c.app_id())),
+    Case("db", "get_application[archive]", lambda c: lambda i: c.db.get_application(c.archived_id())),
+    Case("db", "get_user_applications", lambda c: lambda i: c.db.get_user_applications(c.user_id(), limit=20)),
+    Case("db", "get_applications_by_status[new]", lambda c: lambda i: c.db.get_applications_by_status(["new"], limit=20)),
+    Case("db", "get_applications_by_status[all]", lambda c: lambda i: c.db.get_applications_by_status(STATUSES, limit=20)),
+    Case("db", "get_applications_by_budget[all, 150–300k, cheapest]", lambda c: lambda i: c.db.get_applications_by_budget(STATUSES, 150_000, 300_000, "asc", limit=20)),
+    Case("db", "get_applications_by_budget[new, any, priciest]", lambda c: lambda i: c.db.get_applications_by_budget(["new"], None, None, "desc", limit=20)),
+    Case("db", "get_applications_by_phone", lambda c: lambda i: c.db.get_applications_by_phone(c.phone(), limit=20)),
+    Case("db", "count_applications_by_phone", lambda c: lambda i: c.db.count_applications_by_phone(c.phone(), before_id=c.n)),
+    Case(
+        "db",
+        "update_application_status",
+        lambda c: lambda i: c.db.update_application_status(c.app_id(), STATUSES[i % 2], 1, "ok"),
+    ),
+    Case(
+        "db",
+        "update_application_status[stale]",
+        lambda c: lambda i: c.db.update_application_status(c.app_id(), "approved", 1, "ok", expected_version=-1),
+    ),
+    Case("db", "claim_application", lambda c: lambda i: c.db.claim_application(c.app_id(), 1, "Админ")),
+    Case(
+        "db",
+        "bulk_update_status[20]",
+        lambda c: lambda i: c.db.bulk_update_status(
+            [c.app_id() for _ in range(20)], ("approved", "rejected", "closed")[i % 3], 1, "Админ", "ok"
+        ),
+    ),
+    Case("db", "add_admin_notifications[3]", lambda c: lambda i: c.db.add_admin_notifications(c.app_id(), [(1, i), (2, i), (3, i)])),
+    Case("db", "list_admin_notifications", lambda c: lambda i: c.db.list_admin_notifications(c.app_id())),
+    Case("db", "delete_admin_notifications", lambda c: lambda i: c.db.delete_admin_notifications(c.app_id())),
+    Case("db", "list_sla_pending", lambda c: lambda i: c.db.list_sla_pending()),
+    Case("db", "list_sla_pending[1 of 4 workers]", lambda c: lambda i: c.db.list_sla_pending(4, i % 4)),
+    Case("db", "set_application_sla_level", lambda c: lambda i: c.db.set_application_sla_level(c.app_id(), i % 3)),
+    Case(
+        "db",
+        "add_funnel_counts[20]",
+        lambda c: lambda i: c.db.add_funnel_counts(
+            [(f"2025-06-01T{i % 24:02d}:00:00", f"event{k}", 1) for k in range(20)]
+        ),
+    ),
+    Case("db", "funnel_totals[30 days]", lambda c: lambda i: c.db.funnel_totals("2025-05-01T00:00:00")),
+    Case("db", "count_applications_created[30 days]", lambda c: lambda i: c.db.count_applications_created(SEED_TS - 30 * 86400, SEED_TS + 1)),
+    Case("db", "count_users_created_since[30 days]", lambda c: lambda i: c.db.count_users_created_since(SEED_TS - 30 * 86400)),
+    Case("db", "count_users_active_since[30 days]", lambda c: lambda i: c.db.count_users_active_since(SEED_TS - 30 * 86400)),
+    Case("db", "top_destinations[30 days]", lambda c: lambda i: c.db.top_destinations(SEED_TS - 30 * 86400, SEED_TS + 1, 5)),
+    Case("db", "add_destinations[bundled]", lambda c: lambda i: c.db.add_destinations(BUNDLED)),
+    Case("db", "list_destinations", lambda c: lambda i: c.db.list_destinations()),
+    Case("db", "unmatched_destinations[first start]", lambda c: lambda i: c.db.unmatched_destinations()),
+    Case(
+        "db",
+        "set_destination_ids[all applications]",
+        lambda c: (lambda m: lambda i: c.db.set_destination_ids(m, c.n + c.n // 2))(
+            {d: k for k, d in enumerate(DESTINATIONS, 1)}
+        ),
+    ),
+    Case("db", "archive_closed_batch[nothing due]", lambda c: lambda i: c.db.archive_closed_batch(36500, 500)),
+    Case("db", "create_broadcast", lambda c: lambda i: c.db.create_broadcast(1, "Горящие туры!")),
+    Case("db", "get_broadcast", lambda c: (lambda b: lambda i: c.db.get_broadcast(b))(_broadcast(c))),
+    Case("db", "list_running_broadcasts", lambda c: lambda i: c.db.list_running_broadcasts()),
+    Case("db", "set_broadcast_progress_message", lambda c: (lambda b: lambda i: c.db.set_broadcast_progress_message(b, 1, i))(_broadcast(c))),
+    Case("db", "set_broadcast_status", lambda c: (lambda b: lambda i: c.db.set_broadcast_status(b, "running"))(_broadcast(c))),
+    Case(
+        "db",
+        "get_broadcast_recipients[100]",
+        lambda c: (lambda b: lambda i: c.db.get_broadcast_recipients(b, c.user_id(), 100))(_broadcast(c)),
+    ),
+    Case(
+        "db",
+        "record_broadcast_batch[100]",
+        lambda c: (lambda b: lambda i: c.db.record_broadcast_batch(
+            b, i, [(c.user_id(), "sent", None) for _ in range(100)]
+        ))(_broadcast(c)),
+    ),
+    Case("db", "acquire_lease[renew]", lambda c: lambda i: c.db.acquire_lease("poller:bench", "bench:1", 10)),
+    Case("db", "acquire_lease[held by other]", lambda c: lambda i: c.db.acquire_lease("poller:bench", "bench:2", 10)),
+    Case("db", "commit_update_offset", lambda c: lambda i: c.db.commit_update_offset("poller:bench", "bench:1", i, 10)),
+    Case("db", "get_update_offset", lambda c: lambda i: c.db.get_update_offset("poller:bench")),
+    Case("db", "release_lease", lambda c: lambda i: c.db.release_lease("poller:bench", "bench:0")),
+    Case("db", "backfill_contact_phones[nothing due]", lambda c: lambda i: c.db.backfill_contact_phones()),
+    Case("db", "backfill_timestamps[nothing due]", lambda c: lambda i: c.db.backfill_timestamps()),
+    Case("db", "backfill_budgets[nothing due]", lambda c: lambda i: c.db.backfill_budgets()),
+    Case("db", "init_schema", lambda c: lambda i: c.db.init_schema()),
+    Case("db", "export_chunks[reviews, first 1000]", lambda c: lambda i: next(c.db.export_chunks("reviews", 1000)[1], None)),
+]
+
+
+def complete(coro):
+    """Результат корутины, которая не ждёт (SQLite через db.aio, кэш), — без цикла событий."""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("coroutine suspended")
+
+
+def _rows(c: Ctx, limit: int):
+    if not hasattr(c, "_review_rows"):
+        c._review_rows = c.db.list_reviews_newest_first(limit=200)
+    return c._review_rows[:limit]
+
+
+FORMAT_CASES = [
+    Case("format", "format_public_reviews_block[200]", lambda c: (lambda rows: lambda i: main.format_public_reviews_block(rows))(_rows(c, 200))),
+    Case("format", "ReviewFeed.get[cached]", lambda c: (lambda feed: lambda i: complete(feed.get()))(main.ReviewFeed(c.db, 3600))),
+    Case("format", "format_admin_review_caption", lambda c: (lambda r: lambda i: main.format_admin_review_caption(r))(_rows(c, 1)[0])),
+    Case("format", "format_app_full", lambda c: (lambda a: lambda i: main.format_app_full(a))(c.db.get_application(1))),
+    Case("format", "format_app_short", lambda c: (lambda a: lambda i: main.format_app_short(a))(c.db.get_application(1))),
+    Case("format", "admin_reviews_list_kb[25]", lambda c: (lambda rows: lambda i: main.admin_reviews_list_kb(rows))(_rows(c, 25))),
+    Case("format", "admin_review_manage_kb", lambda c: lambda i: main.admin_review_manage_kb(i)),
+    Case("format", "main_menu_kb", lambda c: lambda i: main.main_menu_kb(is_admin=True)),
+    Case("format", "admin_panel_kb", lambda c: lambda i: main.admin_panel_kb()),
+    Case("format", "stars_row", lambda c: lambda i: main.stars_row(1 + i % 5)),
+    Case("format", "human_status", lambda c: lambda i: main.human_status(STATUSES[i % 4])),
+    Case("format", "parse_budget[cached]", lambda c: lambda i: main.parse_budget("от 100 до 150 тыс ₽ на человека")),
+    Case("format", "parse_budget[uncached]", lambda c: lambda i: main.parse_budget.__wrapped__("от 100 до 150 тыс ₽ на человека")),
+    Case("format", "budget_columns", lambda c: lambda i: main.budget_columns("до 1500$ на двоих", 2, 0)),
+    Case("format", "admin_list_filter_kb", lambda c: lambda i: main.admin_list_filter_kb("all", "150_300", "asc")),
+    Case("format", "app_item_kb", lambda c: lambda i: main.app_item_kb(i, selected=i % 2 == 0)),
+    Case("format", "normalize_phone", lambda c: lambda i: main.normalize_phone("+7 (999) 123-45-67")),
+    Case("format", "returning_client_note", lambda c: lambda i: complete(main.returning_client_note(c.n, "+" + c.phone()))),
+    Case("format", "FunnelCounters.hit", lambda c: (lambda f: lambda i: f.hit("destination"))(main.FunnelCounters(3600))),
+    Case("format", "format_period_report", lambda c: lambda i: main.format_period_report({s: 100 for s in STATUSES}, 50, 900, 30)),
+    Case("format", "DestinationIndex.exact", lambda c: lambda i: main.destinations.exact("Turkey")),
+    Case("format", "DestinationIndex.match[country, resort]", lambda c: lambda i: main.destinations.match("Турция, Анталья")),
+    Case("format", "DestinationIndex.suggest[prefix]", lambda c: lambda i: main.destinations.suggest("анта")),
+    Case("format", "DestinationIndex.suggest[typo]", lambda c: lambda i: main.destinations.suggest("Турцыя")),
+    Case("format", "destination_suggest_kb[5]", lambda c: (lambda ids: lambda i: main.destination_suggest_kb(ids))(main.destinations.suggest("к"))),
+    Case("format", "format_funnel_report", lambda c: lambda i: main.format_funnel_report({e: 100 - k for k, (e, _) in enumerate(main.FUNNEL_STEPS)}, 24)),
+    Case("format", "FormInactivity.touch", lambda c: (lambda f: lambda i: f.touch((i % c.n, i % c.n), "AppForm:dates"))(main.FormInactivity(3600, 86400, 60))),
+    Case("format", "SlaScheduler.schedule", lambda c: (lambda q: lambda i: q.schedule(i % c.n, 0.0, i % 3))(main.SlaScheduler((30, 120, 480)))),
+    Case("format", "format_broadcast_progress", lambda c: (lambda b: lambda i: main.format_broadcast_progress(b, 25.0))(c.db.get_broadcast(_broadcast(c)))),
+]
+
+CASES = DB_CASES + FORMAT_CASES
+
+
+# ------------------------- прогон -------------------------
+
+
+def measure(fn: Callable[[int], object], repeat: int, min_time: float, budget: Optional[int]) -> dict:
+    counter = iter(range(10**12))
+    loops = 1
+    # калибровка: как timeit.autorange, но с учётом бюджета вызовов
+    while True:
+        if budget is not None and loops * (repeat + 1) > budget:
+            loops = max(1, budget // (repeat + 1))
+            break
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn(next(counter))
+        if time.perf_counter() - t0 >= min_time or loops >= 1_000_000:
+            break
+        loops *= 2 if loops < 10 else 5
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn(next(counter))
+        times.append((time.perf_counter() - t0) / loops)
+    return {
+        "loops": loops,
+        "min_us": round(min(times) * 1e6, 3),
+        "median_us": round(statistics.median(times) * 1e6, 3),
+        "mean_us": round(statistics.fmean(times) * 1e6, 3),
+        "ops_per_second": round(1 / min(times), 1),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def uncovered_methods() -> List[str]:
+    covered = {case.name.split("[")[0] for case in DB_CASES}
+    public = {
+        name for name, value in vars(main.Storage).items()
+        if callable(value) and not isinstance(value, type) and not name.startswith("_") and name != "close"
+    }
+    return sorted(public - covered)
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    print(f"\ncompared with {baseline_path} (min time, >1 — slower now):")
+    for r in results:
+        old = baseline.get((r["name"], r["size"]))
+        if old and old["min_us"]:
+            ratio = r["min_us"] / old["min_us"]
+            mark = "  !!" if ratio > 1.2 else ("  ++" if ratio < 0.8 else "")
+            print(f"  {r['name']:<44} {r['size']:>8}  {old['min_us']:>10.2f} → {r['min_us']:>10.2f} us  x{ratio:.2f}{mark}")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="секунд на одну серию при калибровке")
+    parser.add_argument("--filter", help="запускать только кейсы, содержащие подстроку")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "tourbot-bench"))
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        path = prepare_db(args.data_dir, n)
+        db = main.SqliteDatabase(path)
+        ctx = Ctx(db=db, n=n, users=max(n // 5, 1), reviews=n // 5)
+        print(f"\n== {n} rows ==")
+        for case in CASES:
+            if args.filter and args.filter not in case.name:
+                continue
+            fn = case.make(ctx)
+            budget = case.budget(ctx) if case.budget else None
+            if budget == 0:
+                continue
+            stats = measure(fn, args.repeat, args.min_time, budget)
+            results.append({"group": case.group, "name": case.name, "size": n, **stats})
+            print(f"  {case.name:<44} {stats['min_us']:>12.2f} us  (median {stats['median_us']:.2f}, loops {stats['loops']})", flush=True)
+        db.conn.close()
+
+    missing = uncovered_methods()
+    if missing:
+        print("\nStorage methods without a benchmark case: " + ", ".join(missing))
+
+    if args.json:
+        meta = {
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": main.sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,175 @@
+"""Шаблоны сообщений: стоимость рендера и проверка экранирования.
+
+  python bench/bench_templates.py            # замеры + проверка
+  python bench/bench_templates.py --check    # только проверка (код выхода 1 при утечке)
+
+Проверка прогоняет через Dispatcher реальные сценарии (заявка, повтор, мои заявки,
+поддержка, отзыв с фото, лента отзывов, админ‑панель, одобрение/отклонение, поиск по
+телефону, массовое закрытие), подставляя во все пользовательские поля и в имя
+профиля HTML‑разметку, и убеждается, что ни в одном исходящем тексте она не
+появилась в сыром виде.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI, callback_update, message_update, photo_update  # noqa: E402
+
+PAYLOAD = "<u>x&y</u>"
+SAMPLE = {
+    "destination": "Турция, Анталия",
+    "dates": "10–20 июля",
+    "adults": 2,
+    "children": 1,
+    "budget": "до 150 000 ₽",
+    "wishes": "5*, всё включено, первая линия",
+    "contact": "+7 999 123-45-67",
+}
+
+
+def bench_rendering(main) -> None:
+    cases = {
+        "T_APP_CONFIRM": lambda: main.T_APP_CONFIRM.render(**SAMPLE),
+        "T_ADMIN_NEW_APP": lambda: main.T_ADMIN_NEW_APP.render(
+            app_id=123, username="client", tg_id=42, returning=main.Markup(), **SAMPLE
+        ),
+        "T_APP_FULL": lambda: main.T_APP_FULL.render(
+            app_id=123, status="🆕 Новая", username="client", tg_id=42, first_name="Иван",
+            created_at="2025-06-01T12:00:00", updated_at="2025-06-01T12:00:00",
+            admin_comment="—", **SAMPLE
+        ),
+        "T_MY_APPS_LINE": lambda: main.T_MY_APPS_LINE.render(
+            app_id=1, status="🆕 Новая", destination="Турция", dates="июль", updated_at="2025-06-01"
+        ),
+        "T_APPROVED_WITH_COMMENT": lambda: main.T_APPROVED_WITH_COMMENT.render(
+            app_id=1, destination="Турция", dates="июль", comment="Отель забронирован"
+        ),
+        "T_APP_CONFIRM[hostile]": lambda: main.T_APP_CONFIRM.render(**{k: PAYLOAD for k in SAMPLE}),
+        "f-string (без экранирования, для сравнения)": lambda: (
+            "📝 <b>Проверьте заявку:</b>\n\n"
+            f"<b>Направление:</b> {SAMPLE['destination']}\n"
+            f"<b>Даты:</b> {SAMPLE['dates']}\n"
+            f"<b>Взрослых:</b> {SAMPLE['adults']}\n"
+            f"<b>Детей:</b> {SAMPLE['children']}\n"
+            f"<b>Бюджет:</b> {SAMPLE['budget']}\n"
+            f"<b>Пожелания:</b> {SAMPLE['wishes']}\n"
+            f"<b>Контакт:</b> {SAMPLE['contact']}\n\n"
+            "Если всё верно — отправьте заявку менеджеру."
+        ),
+        "main_menu_kb (кэш)": lambda: main.main_menu_kb(is_admin=False),
+        "main_menu_kb (без кэша)": lambda: main.main_menu_kb.__wrapped__(is_admin=False),
+    }
+    print("rendering cost:")
+    for name, fn in cases.items():
+        loops, total = timeit.Timer(fn).autorange()
+        best = min(timeit.repeat(fn, number=loops, repeat=5)) / loops
+        print(f"  {name:<46} {best * 1e6:>8.2f} us")
+
+
+async def check_escaping(main, api: FakeBotAPI) -> list:
+    main.setup_dispatcher()
+    admin = sorted(main.ADMINS)[0]
+    client = 777_001
+    update_ids = itertools.count(1)
+
+    async def send(raw: dict) -> None:
+        raw["update_id"] = next(update_ids)
+        await main.dp.feed_raw_update(main.bot, raw)
+        # запись заявки и уведомления идут фоновыми задачами
+        await asyncio.gather(*main.followup_tasks)
+
+    def msg(uid: int, text: str) -> dict:
+        return message_update(uid, text, first_name=PAYLOAD)
+
+    def cb(uid: int, data: str) -> dict:
+        return callback_update(uid, data, first_name=PAYLOAD)
+
+    # заявка с разметкой во всех полях
+    for text in ["/start", "🏖 Подобрать тур", PAYLOAD, PAYLOAD, "2", "0", PAYLOAD, PAYLOAD]:
+        await send(msg(client, text))
+    await send(msg(client, "+7 999 123-45-67"))
+    await send(cb(client, "app:send"))
+    app_id = main.db.get_user_applications(main.db.get_user_by_tg(client)["id"], limit=1)[0]["id"]
+
+    await send(msg(client, "📋 Мои заявки"))
+    await send(msg(client, "🔁 Повторить заявку"))
+    await send(cb(client, f"rep:send:{app_id}"))
+    await send(msg(client, "🆘 Связаться с менеджером"))
+    await send(msg(client, PAYLOAD))
+
+    await send(cb(client, f"rev:start:{app_id}"))
+    await send(cb(client, f"rev:rate:{app_id}:5"))
+    # альбом из двух фото с подписью-разметкой, затем текст
+    for n in range(2):
+        await send(photo_update(client, f"photo{n}", caption=PAYLOAD, media_group_id="album1", first_name=PAYLOAD))
+    await send(msg(client, PAYLOAD))
+    await send(msg(client, "⭐ Отзывы клиентов"))
+    review_id = main.db.list_reviews_newest_first(limit=1)[0]["id"]
+
+    await send(msg(admin, "/start"))
+    await send(cb(admin, "adm:list:all"))
+    await send(cb(admin, "adm:list:all:any:desc"))
+    await send(cb(admin, f"adm:open:{app_id}"))
+    await send(cb(admin, f"adm:approve:{app_id}"))
+    await send(msg(admin, PAYLOAD))
+    await send(cb(admin, f"adm:reject:{app_id + 1}"))
+    await send(msg(admin, PAYLOAD))
+    await send(cb(admin, f"adm:open:{app_id + 1}"))
+    await send(cb(admin, "adm:phone"))
+    await send(msg(admin, "89991234567"))
+    await send(cb(admin, f"admrev:open:{review_id}"))
+    await send(cb(admin, f"admrev:photos:{review_id}"))
+
+    # массовое закрытие: комментарий уходит всем выбранным клиентам
+    await send(cb(client, f"rep:send:{app_id + 1}"))
+    await send(cb(admin, "adm:list:new"))
+    await send(cb(admin, "adm:selall"))
+    await send(cb(admin, "adm:bulk:closed"))
+    await send(msg(admin, PAYLOAD))
+
+    leaks = []
+    texts = 0
+    for method, params in api.requests:
+        for key in ("text", "caption"):
+            value = params.get(key)
+            if isinstance(value, str):
+                texts += 1
+                if PAYLOAD in value or "<u>" in value:
+                    leaks.append((method, value))
+    print(f"escaping check: {texts} outgoing texts, {len(leaks)} with raw user markup")
+    return leaks
+
+
+async def amain(args) -> int:
+    api = FakeBotAPI(record=True)
+    os.environ["BOT_API_URL"] = api.start_in_thread()
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="tourbot-tpl-"), "tpl.db")
+    import main
+
+    if not args.check:
+        bench_rendering(main)
+    leaks = await check_escaping(main, api)
+    await main.bot.session.close()
+    api.stop_thread()
+    for method, text in leaks:
+        print(f"  LEAK in {method}: {text[:200]!r}")
+    return 1 if leaks else 0
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="только проверка экранирования")
+    sys.exit(asyncio.run(amain(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main_cli()
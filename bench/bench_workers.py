@@ -0,0 +1,128 @@
+"""Пропускная способность бота в одно‑ и многопроцессном режиме.
+
+Запускает main.py против локальной заглушки Bot API (bench/fake_bot_api.py)
+с BOT_WORKERS = 0 (один процесс), 1, 2, 4 и меряет, сколько апдейтов
+в секунду бот успевает обработать. Каждый апдейт даёт ровно один sendMessage.
+
+    python bench/bench_workers.py [--updates 5000] [--users 500] [--workers 0 1 2 4]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI, message_update  # noqa: E402
+
+# что пишут пользователи: регистрация, лента отзывов (HTML‑форматирование), FAQ
+TEXTS = ["/start", "⭐ Отзывы клиентов", "❓ FAQ", "ℹ️ О компании"]
+
+
+def seed_db(path: str, reviews: int) -> None:
+    os.environ["DB_PATH"] = path
+    import main
+
+    db = main.SqliteDatabase(path)
+    for i in range(1, reviews + 1):
+        db.get_or_create_user(i, f"user{i}", f"Клиент <{i}>")
+        user = db.get_user_by_tg(i)
+        app_id = db.create_application(
+            user,
+            {
+                "destination": "Турция",
+                "dates": "июль",
+                "adults": 2,
+                "children": 0,
+                "budget": "до 150 000 ₽",
+                "wishes": "первая линия",
+                "contact": "+79991234567",
+            },
+        )
+        db.create_review(app_id, i, f"user{i}", f"Клиент {i}", 1 + i % 5, "Всё отлично & спасибо! " * 3)
+    db.conn.close()
+
+
+def make_updates(count: int, users: int, offset: int = 0) -> list:
+    return [
+        message_update(10_000 + (offset + i) % users, TEXTS[(offset + i) % len(TEXTS)])
+        for i in range(count)
+    ]
+
+
+async def run_mode(workers: int, updates: int, users: int, warmup: int, perf_runtime: bool = False) -> dict:
+    loop = asyncio.get_running_loop()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        seed_db(db_path, reviews=200)
+
+        api = FakeBotAPI()
+        url = await api.start()
+        env = dict(os.environ, BOT_API_URL=url, DB_PATH=db_path, BOT_WORKERS=str(workers))
+        if perf_runtime:
+            env["BOT_PERF_RUNTIME"] = "1"
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "main.py")],
+            cwd=tmp,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            # прогрев: процессы запущены, импорты и соединения готовы
+            await api.push(make_updates(warmup, users))
+            await api.wait_calls("sendMessage", warmup)
+
+            await api.push(make_updates(updates, users, offset=warmup))
+            started = loop.time()
+            await api.wait_calls("sendMessage", warmup + updates)
+            elapsed = loop.time() - started
+        finally:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.to_thread(proc.wait, 15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            await api.stop()
+
+    return {
+        "workers": workers,
+        "updates": updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(updates / elapsed, 1),
+    }
+
+
+async def amain(args) -> None:
+    results = []
+    for workers in args.workers:
+        res = await run_mode(workers, args.updates, args.users, args.warmup, args.perf_runtime)
+        results.append(res)
+        mode = "single process" if workers == 0 else f"{workers} worker(s)"
+        print(f"{mode:>16}: {res['updates_per_second']:>8} updates/s ({res['seconds']} s)", flush=True)
+    print(f"cpu cores: {os.cpu_count()}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cpu_count": os.cpu_count(), "results": results}, f, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--perf-runtime", action="store_true", help="BOT_PERF_RUNTIME=1 (uvloop + orjson)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Локальная заглушка Telegram Bot API для бенчмарков.
+
+Отвечает на методы, которыми пользуется бот, отдаёт заранее подготовленные
+апдейты через getUpdates и считает все входящие вызовы. Сеть не нужна:
+бот направляется сюда переменной окружения BOT_API_URL.
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Fake Anex", "username": "fake_anex_bot"}
+
+
+def _user(user_id: int, first_name: Optional[str] = None) -> dict:
+    return {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": first_name or f"User{user_id}",
+        "username": f"user{user_id}",
+    }
+
+
+def _chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+
+
+def message_update(user_id: int, text: str, first_name: Optional[str] = None) -> dict:
+    """Входящее текстовое сообщение (update_id проставит FakeBotAPI.push)."""
+    msg = {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": _chat(user_id),
+        "from": _user(user_id, first_name),
+        "text": text,
+    }
+    if text.startswith("/"):
+        cmd = text.split()[0]
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(cmd)}]
+    return {"message": msg}
+
+
+def photo_update(
+    user_id: int,
+    file_id: str,
+    caption: Optional[str] = None,
+    media_group_id: Optional[str] = None,
+    first_name: Optional[str] = None,
+) -> dict:
+    """Входящее фото (элемент альбома, если задан media_group_id)."""
+    msg = {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": _chat(user_id),
+        "from": _user(user_id, first_name),
+        "photo": [
+            {"file_id": f"{file_id}_s", "file_unique_id": f"{file_id}_su", "width": 90, "height": 60},
+            {"file_id": file_id, "file_unique_id": f"{file_id}_u", "width": 1280, "height": 853},
+        ],
+    }
+    if caption is not None:
+        msg["caption"] = caption
+    if media_group_id is not None:
+        msg["media_group_id"] = media_group_id
+    return {"message": msg}
+
+
+def callback_update(
+    user_id: int, data: str, message_id: int = 1, first_name: Optional[str] = None
+) -> dict:
+    """Нажатие inline‑кнопки под сообщением бота."""
+    return {
+        "callback_query": {
+            "id": f"{user_id}-{time.monotonic_ns()}",
+            "from": _user(user_id, first_name),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": _chat(user_id),
+                "from": BOT_USER,
+                "text": "…",
+            },
+        }
+    }
+
+
+class FakeBotAPI:
+    def __init__(self, record: bool = False):
+        self.updates: List[dict] = []
+        self.calls: Counter = Counter()
+        # при record=True сохраняются все исходящие вызовы: (метод, параметры)
+        self.record = record
+        self.requests: List[tuple] = []
+        self.first_call_at: Dict[str, float] = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._changed = asyncio.Condition()
+        self._runner: Optional[web.AppRunner] = None
+
+    # --- управление из бенчмарка ---
+
+    async def push(self, updates: List[dict]) -> None:
+        for u in updates:
+            u["update_id"] = next(self._update_ids)
+        async with self._changed:
+            self.updates.extend(updates)
+            self._changed.notify_all()
+
+    async def wait_calls(self, method: str, count: int, timeout: float = 300) -> None:
+        """Ждёт, пока метод method будет вызван не меньше count раз."""
+        async def _wait():
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.calls[method] >= count)
+
+        await asyncio.wait_for(_wait(), timeout)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        real_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{real_port}"
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер в отдельном потоке со своим циклом событий,
+        чтобы заглушка не отнимала время у измеряемого бота."""
+        started = threading.Event()
+        box = {}
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self._loop = loop
+            box["url"] = loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        started.wait()
+        return box["url"]
+
+    def stop_thread(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    # --- Bot API ---
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        params = {}
+        for key, value in form.items():
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+            "from": BOT_USER,
+            "text": params.get("text") or "",
+        }
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        def pending() -> List[dict]:
+            # update_id идут подряд с 1, поэтому срез вместо перебора
+            start = max(offset - 1, 0)
+            return self.updates[start:start + limit]
+
+        async with self._changed:
+            if not pending() and timeout:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(pending), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return pending()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.first_call_at.setdefault(method, time.perf_counter())
+        if self.record:
+            self.requests.append((method, params))
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "sendDocument", "sendPhoto"):
+            result = self._message(params)
+        elif method in ("editMessageText", "editMessageReplyMarkup"):
+            result = self._message(params) if params.get("chat_id") else True
+        elif method == "sendMediaGroup":
+            media = params.get("media") or []
+            result = [self._message(params) for _ in media]
+        else:
+            # answerCallbackQuery, deleteMessage, deleteWebhook и т.п.
+            result = True
+
+        async with self._changed:
+            self.calls[method] += 1
+            self._changed.notify_all()
+        return web.json_response({"ok": True, "result": result})
@@ -0,0 +1,278 @@
+"""Нагрузочный тест бота без сети.
+
+Поднимает заглушку Bot API (bench/fake_bot_api.py) в отдельном потоке,
+направляет на неё бота через BOT_API_URL и подаёт в Dispatcher синтетические
+потоки апдейтов с заданной частотой (open loop):
+
+  * app    — /start → «🏖 Подобрать тур» → 7 шагов AppForm → app:send
+  * admin  — adm:open → adm:approve → комментарий (цикл одобрения админом)
+  * review — rev:start → rev:rate → текст отзыва
+
+Каждый «пользователь» шлёт следующий апдейт только после ответа на предыдущий.
+Отчёт: пропускная способность, p50/p95/p99 задержки, время в Database, вызовы API.
+
+    python bench/loadtest.py --rate 500 --duration 20 [--json out.json] [--max-p99-ms 250]
+
+С --max-p99-ms скрипт завершается с кодом 1, если p99 выше порога, —
+так его можно использовать как проверку регрессий перед релизом.
+"""
+
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI, callback_update, message_update  # noqa: E402
+
+APP_STEPS = [
+    "/start",
+    "🏖 Подобрать тур",
+    "Турция, Анталия",
+    "10–20 июля",
+    "2",
+    "1",
+    "до 150 000 ₽",
+    "5*, всё включено, первая линия",
+    "+7 999 123-45-67",
+]
+
+USER_BASE = 100_000
+REVIEWER_BASE = 500_000
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+class DbTimer:
+    """Оборачивает публичные методы объекта Database и копит время в них."""
+
+    def __init__(self, db):
+        self.total = 0.0
+        self.by_method: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        for name in dir(type(db)):
+            if name.startswith("_"):
+                continue
+            attr = getattr(db, name)
+            if callable(attr):
+                setattr(db, name, self._wrap(name, attr))
+
+    def _wrap(self, name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t0
+                self.total += dt
+                stat = self.by_method[name]
+                stat[0] += 1
+                stat[1] += dt
+
+        return timed
+
+
+def build_sessions(main, rate: float, duration: float, mix: Dict[str, float]) -> List[Tuple[str, int, List[dict]]]:
+    """Список сессий (вид, id пользователя, апдейты), достаточный на duration секунд."""
+    db = main.db
+    admins = sorted(main.ADMINS)
+    rnd = random.Random(42)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    sessions = []
+    planned = 0
+    n = 0
+    while planned < rate * duration:
+        kind = rnd.choices(kinds, weights)[0]
+        n += 1
+        if kind == "app":
+            uid = USER_BASE + n
+            updates = [message_update(uid, t) for t in APP_STEPS]
+            updates.append(callback_update(uid, "app:send"))
+        elif kind == "review":
+            uid = REVIEWER_BASE + n
+            db.get_or_create_user(uid, f"user{uid}", f"User{uid}")
+            app_id = db.create_application(db.get_user_by_tg(uid), seed_application())
+            updates = [
+                callback_update(uid, f"rev:start:{app_id}"),
+                callback_update(uid, f"rev:rate:{app_id}:{1 + n % 5}"),
+                message_update(uid, "Отличный сервис, всё быстро подобрали!"),
+            ]
+        else:
+            uid = admins[n % len(admins)]
+            client = REVIEWER_BASE + n
+            db.get_or_create_user(client, f"user{client}", f"User{client}")
+            app_id = db.create_application(db.get_user_by_tg(client), seed_application())
+            updates = [
+                callback_update(uid, f"adm:open:{app_id}"),
+                callback_update(uid, f"adm:approve:{app_id}"),
+                message_update(uid, "Подобрали отель, менеджер свяжется сегодня."),
+            ]
+        sessions.append((kind, uid, updates))
+        planned += len(updates)
+    return sessions
+
+
+def seed_application() -> dict:
+    return {
+        "destination": "Египет",
+        "dates": "август",
+        "adults": 2,
+        "children": 0,
+        "budget": "до 2000$",
+        "wishes": "без пожеланий",
+        "contact": "+79990000000",
+    }
+
+
+async def run(args, main, api: FakeBotAPI) -> dict:
+    main.setup_dispatcher()
+    mix = dict(app=args.app, review=args.review, admin=args.admin)
+    sessions = build_sessions(main, args.rate, args.duration, mix)
+    db_timer = DbTimer(main.db)
+
+    loop = asyncio.get_running_loop()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    # админы — одни и те же люди: их сессии выполняются строго друг за другом
+    admin_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+    update_ids = itertools.count(1)
+
+    async def run_session(kind: str, uid: int, updates: List[dict], start_at: float) -> None:
+        await asyncio.sleep(max(0.0, start_at - loop.time()))
+        lock = admin_locks[uid] if kind == "admin" else None
+        if lock:
+            await lock.acquire()
+        try:
+            for raw in updates:
+                raw["update_id"] = next(update_ids)
+                # perf_counter, а не loop.time(): у uvloop часы с шагом в 1 мс
+                sent_at = time.perf_counter()
+                await main.dp.feed_raw_update(main.bot, raw)
+                latencies[kind].append(time.perf_counter() - sent_at)
+        finally:
+            if lock:
+                lock.release()
+
+    t0 = loop.time() + 0.1
+    tasks = []
+    at = t0
+    for kind, uid, updates in sessions:
+        tasks.append(asyncio.create_task(run_session(kind, uid, updates, at)))
+        at += len(updates) / args.rate
+    db_before = db_timer.total
+    await asyncio.gather(*tasks)
+    # запись заявок и уведомления после записи — фоновые задачи: в отчёт они тоже входят
+    await asyncio.gather(*main.followup_tasks)
+    elapsed = loop.time() - t0
+
+    all_lat = sorted(x for v in latencies.values() for x in v)
+    total = len(all_lat)
+    report = {
+        "target_rate": args.rate,
+        "runtime": runtime_name(main),
+        "updates": total,
+        "seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(all_lat, 0.50) * 1000, 2),
+            "p95": round(percentile(all_lat, 0.95) * 1000, 2),
+            "p99": round(percentile(all_lat, 0.99) * 1000, 2),
+            "max": round(all_lat[-1] * 1000, 2) if all_lat else 0,
+        },
+        "by_funnel": {
+            kind: {
+                "updates": len(v),
+                "p50_ms": round(percentile(sorted(v), 0.50) * 1000, 2),
+                "p99_ms": round(percentile(sorted(v), 0.99) * 1000, 2),
+            }
+            for kind, v in latencies.items()
+        },
+        "db": {
+            "seconds": round(db_timer.total - db_before, 3),
+            "share": round((db_timer.total - db_before) / elapsed, 3),
+            "top": {
+                name: {"calls": stat[0], "ms": round(stat[1] * 1000, 1)}
+                for name, stat in sorted(db_timer.by_method.items(), key=lambda kv: -kv[1][1])[:8]
+            },
+        },
+        "api_calls": dict(api.calls),
+        "http": dict(main.bot.session.stats, reuse_ratio=round(main.bot.session.reuse_ratio(), 3)),
+    }
+    await main.bot.session.close()
+    api.stop_thread()
+    return report
+
+
+def runtime_name(main) -> str:
+    loop = type(asyncio.get_running_loop()).__module__.split(".")[0]
+    codec = main.bot.session.json_loads.__module__ or "json"
+    return f"{loop} + {codec.split('.')[0]}"
+
+
+def print_report(r: dict) -> None:
+    lat = r["latency_ms"]
+    print(f"runtime:    {r['runtime']}")
+    print(f"updates:    {r['updates']} in {r['seconds']} s (target {r['target_rate']}/s)")
+    print(f"throughput: {r['throughput']} updates/s")
+    print(f"latency:    p50 {lat['p50']} ms, p95 {lat['p95']} ms, p99 {lat['p99']} ms, max {lat['max']} ms")
+    for kind, f in r["by_funnel"].items():
+        print(f"  {kind:<7} {f['updates']:>7} updates, p50 {f['p50_ms']} ms, p99 {f['p99_ms']} ms")
+    print(f"db time:    {r['db']['seconds']} s ({r['db']['share'] * 100:.1f}% of wall time)")
+    for name, m in r["db"]["top"].items():
+        print(f"  {name:<32} {m['calls']:>7} calls {m['ms']:>10} ms")
+    print("api calls:  " + ", ".join(f"{k}={v}" for k, v in sorted(r["api_calls"].items())))
+    http = r["http"]
+    print(
+        f"http:       {http['requests']} requests, {http['connections_created']} new connections, "
+        f"reuse {http['reuse_ratio'] * 100:.1f}%, pool waits {http['pool_waits']}, "
+        f"semaphore waits {http['semaphore_waits']}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=500, help="апдейтов в секунду")
+    parser.add_argument("--duration", type=float, default=20, help="секунд нагрузки")
+    parser.add_argument("--app", type=float, default=0.6, help="доля сценария заявки")
+    parser.add_argument("--review", type=float, default=0.25, help="доля сценария отзыва")
+    parser.add_argument("--admin", type=float, default=0.15, help="доля сценария одобрения")
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    parser.add_argument("--max-p99-ms", type=float, help="порог p99 для проверки регрессий")
+    parser.add_argument("--perf-runtime", action="store_true", help="BOT_PERF_RUNTIME=1 (uvloop + orjson)")
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    os.environ["BOT_API_URL"] = api.start_in_thread()
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="tourbot-load-"), "load.db")
+    if args.perf_runtime:
+        os.environ["BOT_PERF_RUNTIME"] = "1"
+    import main as bot_main
+
+    report = bot_main.run_async(run(args, bot_main, api))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.max_p99_ms is not None and report["latency_ms"]["p99"] > args.max_p99_ms:
+        print(f"FAIL: p99 {report['latency_ms']['p99']} ms > {args.max_p99_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,66 @@
 import os
+import sys
+import argparse
 import asyncio
+import cProfile
+import csv
+import gzip
+import heapq
 import html
+import io
+import json
+import logging
+import multiprocessing
+import pstats
+import queue
 import sqlite3
 import re
-from datetime import datetime
-from typing import List, Optional
-
+import signal
+import socket
+import ssl
+import string
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional, Set, Tuple
+
+import aiogram
+import aiohttp
+import certifi
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import CommandStart, StateFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.types import (
     Message,
     CallbackQuery,
+    FSInputFile,
     ReplyKeyboardMarkup,
     KeyboardButton,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
+    InputMediaPhoto,
 )
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.dispatcher.flags import get_flag
 
 # ====================== НАСТРОЙКИ =========================
 # На Render токен задаём переменной окружения BOT_TOKEN
@@ -29,19 +69,822 @@ BOT_TOKEN = os.getenv("BOT_TOKEN") or "7974067391:AAHVchxLtfMVaknN5qHPyAoA2hOnSz
 # сюда впиши свои Telegram‑ID админов, например {111111111, 222222222}
 ADMINS = {5240248802, 553539259}
 
-DB_PATH = "tour_agency.db"
+DB_PATH = os.getenv("DB_PATH") or "tour_agency.db"
+
+# хранилище: sqlite — файл DB_PATH; postgres — общая база для нескольких экземпляров бота
+STORAGE_BACKEND = os.getenv("BOT_STORAGE") or "sqlite"
+POSTGRES_DSN = os.getenv("BOT_POSTGRES_DSN") or "postgresql://localhost/tour_bot"
+POSTGRES_POOL_MIN = 1
+POSTGRES_POOL_MAX = int(os.getenv("BOT_POSTGRES_POOL_MAX") or 10)
+# подготовленные запросы кэшируются на каждом соединении пула
+POSTGRES_STATEMENT_CACHE = 256
+
+# свой Bot API сервер (локальный telegram-bot-api или стенд для нагрузочных тестов)
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+# 0 — один процесс; N > 0 — приёмник апдейтов + N рабочих процессов
+WORKERS = int(os.getenv("BOT_WORKERS") or 0)
+# long polling короче срока аренды: каждый опрос её продлевает. POLLING_SLACK — запас
+# HTTP-таймаута getUpdates сверх timeout, на сеть и ответ сервера
+POLLING_TIMEOUT = 3
+POLLING_SLACK = 2
+
+# горячий резерв: getUpdates опрашивает только держатель аренды в базе (BOT_STORAGE=postgres
+# для нескольких серверов, sqlite — для экземпляров на одной машине). Резерв раз в
+# LEASE_RETRY_SECONDS пробует забрать аренду и получает её, когда держатель её отпустил
+# или не продлевал LEASE_TTL_SECONDS. Срок — два самых долгих опроса: зависший запрос
+# обрывается по таймауту раньше, чем аренда истечёт у живого держателя
+LEASE_TTL_SECONDS = 2 * (POLLING_TIMEOUT + POLLING_SLACK)
+LEASE_RETRY_SECONDS = 1
+
+# BOT_PERF_RUNTIME=1: uvloop вместо стандартного цикла и orjson для JSON Bot API
+# (если библиотеки установлены; иначе — обычный рантайм)
+PERF_RUNTIME = os.getenv("BOT_PERF_RUNTIME") == "1"
+
+# HTTP‑сессия к Bot API: пул соединений, keep‑alive, кэш DNS и таймауты
+HTTP_POOL_SIZE = int(os.getenv("BOT_HTTP_POOL_SIZE") or 100)
+HTTP_MAX_CONCURRENCY = int(os.getenv("BOT_HTTP_MAX_CONCURRENCY") or 50)
+HTTP_KEEPALIVE_SECONDS = 75
+HTTP_DNS_CACHE_SECONDS = 600
+HTTP_TIMEOUT_SECONDS = 15
+# методы, которым нужно больше времени (загрузка файлов)
+HTTP_METHOD_TIMEOUTS = {
+    "sendDocument": 120,
+    "sendPhoto": 60,
+    "sendMediaGroup": 120,
+}
+
+# закрытые заявки старше этого срока переносятся в архивную таблицу
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_INTERVAL_SECONDS = 6 * 60 * 60
+
+# выгрузка данных читает базу кусками по столько строк
+EXPORT_CHUNK_SIZE = 1000
+
+# общий бюджет исходящих сообщений для массовых отправок (лимит Telegram ~30/с)
+SEND_RATE_PER_SECOND = 25
+BROADCAST_BATCH_SIZE = 100
+BROADCAST_PROGRESS_SECONDS = 5
+
+# через сколько минут без ответа заявка в статусе «new» эскалируется всем админам
+SLA_ESCALATION_MINUTES = tuple(
+    int(m) for m in (os.getenv("BOT_SLA_MINUTES") or "30,120,480").split(",")
+)
+
+# незавершённые анкеты (AppForm, отзыв): напоминание и сброс состояния по бездействию
+FORM_REMIND_AFTER_HOURS = 3
+FORM_EXPIRE_AFTER_HOURS = 24
+FORM_TIMER_TICK_SECONDS = 60
+
+# сторож цикла событий: шаг замера задержки и порог, после которого логируется стек
+LOOP_LAG_INTERVAL_SECONDS = 0.1
+LOOP_BLOCK_THRESHOLD_SECONDS = 0.5
+
+# предельное время хэндлера: по истечении он отменяется, пользователь получает
+# «попробуйте ещё раз», счётчик виден в /stats. Ключ — имя функции хэндлера, None — без срока
+HANDLER_DEADLINE_SECONDS = float(os.getenv("BOT_HANDLER_DEADLINE_SECONDS") or 15)
+HANDLER_DEADLINES: Dict[str, Optional[float]] = {
+    # срок — до записи в базу; запись новой заявки и уведомления после записи идут
+    # фоновой задачей (run_followup)
+    "admin_approve_finish": 10,
+    "admin_reject_finish": 10,
+    "contact_manager_send": 10,
+    # выгрузка таблицы целиком идёт столько, сколько идёт
+    "admin_export": None,
+}
+# сколько ждём отправки «попробуйте ещё раз» после отмены
+HANDLER_TIMEOUT_NOTICE_SECONDS = 5
+
+# профилирование по команде админа: окно по умолчанию и максимум, строк в отчёте
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP = 40
+
+# воронка анкеты: счётчики копятся в памяти и раз в минуту сбрасываются в базу
+FUNNEL_BUCKET_SECONDS = 60 * 60
+FUNNEL_FLUSH_SECONDS = 60
+
+# подсказки направления на шаге 1 анкеты; незнакомое название из старых заявок
+# становится направлением справочника, если встретилось хотя бы столько раз
+DEST_SUGGESTIONS = 5
+DEST_HISTORY_MIN_USES = 3
+# как часто процессы перечитывают справочник (новые направления и популярность)
+DEST_RELOAD_SECONDS = 10 * 60
+
+# бюджет заявки: курсы для сравнения сумм в разных валютах (ориентир, не для расчётов)
+BUDGET_RUB_RATES = {"RUB": 1, "USD": 90, "EUR": 100}
+# суммы больше — не бюджет (опечатка, набор цифр) и не влезают в INTEGER/BIGINT;
+# рублёвый эквивалент с учётом числа туристов ограничиваем сверху
+BUDGET_MAX_AMOUNT = 10**12
+BUDGET_MAX_RUB = 10**15
+# фильтр списка заявок в админке: код → (подпись, от, до) в рублях на всю поездку
+BUDGET_BANDS = {
+    "any": ("Любой", None, None),
+    "lt150": ("до 150 тыс", None, 150_000),
+    "150_300": ("150–300 тыс", 150_000, 300_000),
+    "300_600": ("300–600 тыс", 300_000, 600_000),
+    "gt600": ("от 600 тыс", 600_000, None),
+}
+
+# массовые действия в списке заявок: сколько заявок можно отметить разом
+BULK_MAX_APPLICATIONS = 500
+
+# фото в отзывах (храним только file_id Telegram); в ленте — альбом из последних фото,
+# лента собирается раз в REVIEW_FEED_TTL_SECONDS и отдаётся всем из памяти
+REVIEW_MAX_PHOTOS = 10
+REVIEW_FEED_PHOTOS = 10
+REVIEW_FEED_PHOTOS_PER_REVIEW = 3
+REVIEW_FEED_TTL_SECONDS = 60
 # =========================================================
 
+logger = logging.getLogger("tour_bot")
+
+CLOSED_STATUSES = ("approved", "rejected", "closed")
+
+
+# ---------------------- ТЕЛЕФОНЫ -------------------------
+
+PHONE_STRIP_RE = re.compile(r"[^\d+]")
+PHONE_RU_RE = re.compile(r"(7|8)\d{10}")
+
+
+def normalize_phone(contact: Optional[str]) -> Optional[str]:
+    """Номер РФ в каноническом виде 7XXXXXXXXXX или None, если это не телефон."""
+    if not contact:
+        return None
+    digits = PHONE_STRIP_RE.sub("", contact)
+    if digits.startswith("+"):
+        digits = digits[1:]
+    if not PHONE_RU_RE.fullmatch(digits):
+        return None
+    return "7" + digits[1:]
+
+
+# ---------------------- НАПРАВЛЕНИЯ ----------------------
+
+# встроенный справочник, дописывается в базу при каждом старте: (название, страна для курортов, синонимы)
+BUNDLED_DESTINATIONS = [
+    ("Турция", None, ("turkey", "turkiye", "турция")),
+    ("Анталия", "Турция", ("antalya", "анталья")),
+    ("Аланья", "Турция", ("alanya", "алания")),
+    ("Кемер", "Турция", ("kemer",)),
+    ("Белек", "Турция", ("belek",)),
+    ("Сиде", "Турция", ("side",)),
+    ("Бодрум", "Турция", ("bodrum",)),
+    ("Мармарис", "Турция", ("marmaris",)),
+    ("Стамбул", "Турция", ("istanbul",)),
+    ("Египет", None, ("egypt",)),
+    ("Хургада", "Египет", ("hurghada",)),
+    ("Шарм-эль-Шейх", "Египет", ("sharm el sheikh", "шарм")),
+    ("ОАЭ", None, ("uae", "эмираты", "объединенные арабские эмираты")),
+    ("Дубай", "ОАЭ", ("dubai", "дубаи")),
+    ("Абу-Даби", "ОАЭ", ("abu dhabi",)),
+    ("Таиланд", None, ("thailand", "тайланд")),
+    ("Пхукет", "Таиланд", ("phuket",)),
+    ("Паттайя", "Таиланд", ("pattaya", "патайя")),
+    ("Вьетнам", None, ("vietnam",)),
+    ("Нячанг", "Вьетнам", ("nha trang",)),
+    ("Фукуок", "Вьетнам", ("phu quoc",)),
+    ("Мальдивы", None, ("maldives",)),
+    ("Шри-Ланка", None, ("sri lanka",)),
+    ("Гоа", "Индия", ("goa",)),
+    ("Бали", "Индонезия", ("bali",)),
+    ("Хайнань", "Китай", ("hainan", "санья")),
+    ("Сейшелы", None, ("seychelles",)),
+    ("Маврикий", None, ("mauritius",)),
+    ("Занзибар", "Танзания", ("zanzibar",)),
+    ("Тунис", None, ("tunisia",)),
+    ("Кипр", None, ("cyprus",)),
+    ("Греция", None, ("greece",)),
+    ("Крит", "Греция", ("crete",)),
+    ("Родос", "Греция", ("rhodes",)),
+    ("Испания", None, ("spain",)),
+    ("Италия", None, ("italy",)),
+    ("Черногория", None, ("montenegro",)),
+    ("Грузия", None, ("georgia",)),
+    ("Батуми", "Грузия", ("batumi",)),
+    ("Армения", None, ("armenia",)),
+    ("Абхазия", None, ("abkhazia",)),
+    ("Куба", None, ("cuba",)),
+    ("Доминикана", None, ("dominican republic", "доминиканская республика")),
+    ("Мексика", None, ("mexico", "канкун", "cancun")),
+    ("Сочи", "Россия", ("sochi", "адлер")),
+    ("Крым", "Россия", ("crimea",)),
+    ("Калининград", "Россия", ("kaliningrad",)),
+    ("Санкт-Петербург", "Россия", ("saint petersburg", "питер", "спб")),
+    ("Алтай", "Россия", ("altai",)),
+    ("Байкал", "Россия", ("baikal",)),
+]
+
+DEST_STRIP_RE = re.compile(r"[^\w\s]|_")
+# «Турция, Анталия», «Дубай / Абу-Даби» — ищем и по частям
+DEST_PARTS_RE = re.compile(r"[,;/]| и ")
+
+
+def normalize_destination(text: Optional[str]) -> str:
+    """Ключ для поиска: регистр, ё/е, дефисы и знаки препинания не различаются."""
+    if not text:
+        return ""
+    return " ".join(DEST_STRIP_RE.sub(" ", text.casefold().replace("ё", "е")).split())
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # направления, у которых название или синоним заканчивается в этом узле
+        self.ids: List[int] = []
+        # лучшие по популярности направления всего поддерева
+        self.top: Tuple[int, ...] = ()
+
+
+class DestinationIndex:
+    """Справочник направлений в памяти: префиксное дерево по названиям и синонимам.
+
+    В каждом узле заранее лежат самые популярные направления поддерева, поэтому
+    подсказка по началу слова — это проход по len(prefix) узлам. Если такого
+    префикса нет, ищем с опечатками: расстояние Левенштейна до начала ключа (1–2
+    правки) по поддереву первой буквы с отсечением веток, где правок уже больше.
+    """
+
+    def __init__(self, limit: int = DEST_SUGGESTIONS):
+        self.limit = limit
+        self.root = _TrieNode()
+        self.names: Dict[int, str] = {}
+        self.countries: Dict[int, Optional[str]] = {}
+        self.weights: Dict[int, int] = {}
+
+    def load(self, rows: List[Any]) -> None:
+        """rows — (id, name, country, aliases, uses) из Storage.list_destinations()."""
+        root = _TrieNode()
+        names, countries, weights = {}, {}, {}
+        for r in rows:
+            dest_id = r["id"]
+            names[dest_id] = r["name"]
+            countries[dest_id] = r["country"]
+            weights[dest_id] = r["uses"]
+            keys = {normalize_destination(r["name"])}
+            keys.update(normalize_destination(a) for a in (r["aliases"] or "").split("|"))
+            for key in keys - {""}:
+                node = root
+                for ch in key:
+                    node = node.children.setdefault(ch, _TrieNode())
+                node.ids.append(dest_id)
+
+        def rank(dest_id: int) -> Tuple[int, str]:
+            return -weights[dest_id], names[dest_id]
+
+        def fill(node: _TrieNode) -> None:
+            best = set(node.ids)
+            for child in node.children.values():
+                fill(child)
+                best.update(child.top)
+            node.top = tuple(sorted(best, key=rank)[: self.limit])
+            node.ids.sort(key=rank)
+
+        fill(root)
+        # подмена целиком: обработчики видят либо старый, либо новый справочник
+        self.root, self.names, self.countries, self.weights = root, names, countries, weights
+
+    def _node(self, key: str) -> Optional[_TrieNode]:
+        node = self.root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def exact(self, text: str) -> Optional[int]:
+        """Направление, чьё название или синоним совпадает с текстом целиком."""
+        node = self._node(normalize_destination(text))
+        return node.ids[0] if node is not None and node.ids else None
+
+    def match(self, text: str) -> Optional[int]:
+        """exact() по всему тексту, а если нет — по частям через запятую/слэш;
+        курорт точнее страны, поэтому из нескольких совпадений берём курорт."""
+        dest_id = self.exact(text)
+        if dest_id is not None:
+            return dest_id
+        found = [d for d in map(self.exact, DEST_PARTS_RE.split(text)) if d is not None]
+        for dest_id in found:
+            if self.countries[dest_id]:
+                return dest_id
+        return found[0] if found else None
+
+    def suggest(self, text: str) -> List[int]:
+        key = normalize_destination(text)
+        if not key:
+            return []
+        node = self._node(key)
+        if node is not None:
+            return list(node.top)
+        if len(key) < 3 or key[0] not in self.root.children:
+            return []
+        found = self._fuzzy(key, 1 if len(key) <= 5 else 2)
+        ranked = sorted((dist, -self.weights[d], d) for d, dist in found.items())
+        return [d for _, _, d in ranked[: self.limit]]
+
+    def _fuzzy(self, key: str, max_dist: int) -> Dict[int, int]:
+        # первую букву считаем верной: опечатки в ней редки, а перебор всех ветвей
+        # корня на порядок дороже. Строка матрицы считается только в полосе
+        # ±max_dist от диагонали — остальные клетки всё равно больше max_dist.
+        found: Dict[int, int] = {}
+        tail = key[1:]
+        m = len(tail)
+        cap = max_dist + 1
+        first = [min(i, cap) for i in range(m + 1)]
+        stack = [(child, ch, first, 1) for ch, child in self.root.children[key[0]].children.items()]
+        while stack:
+            node, ch, prev, depth = stack.pop()
+            lo, hi = max(1, depth - max_dist), min(m, depth + max_dist)
+            row = [cap] * (m + 1)
+            row[0] = min(depth, cap)
+            for i in range(lo, hi + 1):
+                row[i] = min(row[i - 1] + 1, prev[i] + 1, prev[i - 1] + (tail[i - 1] != ch), cap)
+            if row[m] <= max_dist:
+                # весь введённый текст похож на начало ключей этого поддерева
+                for dest_id in node.top:
+                    if found.get(dest_id, cap) > row[m]:
+                        found[dest_id] = row[m]
+            if lo <= hi and min(row[lo - 1 : hi + 1]) <= max_dist:
+                stack.extend((child, c, row, depth + 1) for c, child in node.children.items())
+        return found
+
+
+# ------------------------ БЮДЖЕТ -------------------------
+
+# «120 000», «1 500 000», «150.000» → слитно; десятичные «1,5» и «1.5» не трогаем
+BUDGET_GROUP_RE = re.compile(r"(?<=\d)[\s\u00a0\u202f'.,](?=\d{3}(?!\d))")
+# число, множитель («100к», «1,5 млн», «120 тр»); не суммы — звёзды, люди, ночи, проценты
+BUDGET_AMOUNT_RE = re.compile(
+    r"(\d+(?:[.,]\d+)?)\s*(млн|тыс\w*|т\.?\s?р\b|к\b|k\b)?"
+    r"(?!\s*(?:\*|\d|звезд|чел|взр|реб|дет|ноч|дн|лет|год|%))"
+)
+BUDGET_CURRENCY_RES = (
+    ("USD", re.compile(r"\$|usd|долл|\bдол\b|бакс|\bу\.?\s?е\b")),
+    ("EUR", re.compile(r"€|eur|евро")),
+)
+BUDGET_UPTO_RE = re.compile(r"(?:\bдо|не более|не больше|максимум|\bmax|в пределах|<)\s*$")
+BUDGET_FROM_RE = re.compile(r"(?:\bот|\bfrom|>)\s*$")
+BUDGET_PER_PERSON_RE = re.compile(
+    r"на (?:1 |одного )?(?:чел|персон)|(?:с|за|на каждого) человека|на каждого|/\s*чел|per person|\bpp\b"
+)
+
+
+# одинаковые формулировки («до 150 000 ₽») повторяются — при разборе старых заявок тоже
+@lru_cache(maxsize=4096)
+def parse_budget(text: Optional[str]) -> Optional[Tuple[Optional[int], Optional[int], str, bool]]:
+    """«до 1500$ на двоих» → (None, 1500, "USD", False): от, до, валюта, на человека ли.
+    None — в тексте нет суммы; валюта "" — сумма больше BUDGET_MAX_AMOUNT."""
+    if not text:
+        return None
+    s = BUDGET_GROUP_RE.sub("", text.casefold().replace("ё", "е"))
+    currency = next((code for code, pattern in BUDGET_CURRENCY_RES if pattern.search(s)), "RUB")
+    found = []
+    multiplied = False
+    for m in BUDGET_AMOUNT_RE.finditer(s):
+        value = float(m.group(1).replace(",", "."))
+        if m.group(2):
+            value *= 1_000_000 if m.group(2).startswith("м") else 1000
+            multiplied = True
+        # «на 2», «5 ночей» отсеяны выше; однозначные числа суммой не бывают
+        if value >= 10:
+            found.append((m, value))
+    if not found:
+        return None
+    amounts = [v for _, v in found]
+    if currency == "RUB" and not multiplied and max(amounts) < 1000:
+        # «100–150» в рублях — это тысячи
+        amounts = [v * 1000 for v in amounts]
+    elif multiplied:
+        # «100–150 тыс»: множитель у последнего числа относится ко всем
+        top = max(amounts)
+        amounts = [v * 1000 if v < 1000 <= top else v for v in amounts]
+    if max(amounts) > BUDGET_MAX_AMOUNT:
+        # разобрано, но суммы нет: в колонки пойдут NULL
+        return None, None, "", False
+    lo, hi = int(min(amounts)), int(max(amounts))
+    if len(amounts) == 1:
+        before = s[: found[0][0].start()]
+        if BUDGET_UPTO_RE.search(before):
+            lo = None
+        elif BUDGET_FROM_RE.search(before):
+            hi = None
+    return lo, hi, currency, bool(BUDGET_PER_PERSON_RE.search(s))
+
+
+def budget_columns(
+    text: Optional[str], adults: Optional[int], children: Optional[int]
+) -> Tuple[Optional[int], Optional[int], str, int, Optional[int]]:
+    """Колонки budget_min, budget_max, budget_currency, budget_per_person, budget_rub.
+
+    budget_rub — верхняя граница на всю поездку в рублях: по ней сортирует
+    и фильтрует админка. Валюта "" — текст разобран, но суммы в нём нет.
+    """
+    parsed = parse_budget(text)
+    if parsed is None or not parsed[2]:
+        return None, None, "", 0, None
+    lo, hi, currency, per_person = parsed
+    rub = (hi if hi is not None else lo) * BUDGET_RUB_RATES[currency]
+    if per_person:
+        rub *= max((adults or 0) + (children or 0), 1)
+    return lo, hi, currency, int(per_person), min(rub, BUDGET_MAX_RUB)
+
 
 # ---------------------- БАЗА ДАННЫХ ----------------------
 
 
-class Database:
+class AsyncStorage:
+    """await db.aio.<метод>(...) — вызов метода Storage из корутины.
+
+    SQLite отвечает из локального файла за микросекунды, и соединение привязано к
+    своему потоку — метод вызывается прямо в цикле. Если у хранилища есть executor
+    (PostgreSQL), метод уходит в его поток: цикл бота в это время обслуживает другие
+    апдейты, а запросы разных хэндлеров идут по разным соединениям пула.
+    """
+
+    def __init__(self, storage: "Storage"):
+        self._storage = storage
+
+    def __getattr__(self, name: str) -> Callable[..., Coroutine]:
+        storage = self._storage
+        if storage.executor is None:
+
+            async def call(*args, **kwargs):
+                return getattr(storage, name)(*args, **kwargs)
+
+        else:
+
+            async def call(*args, **kwargs):
+                storage.listener_loop = loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(storage.executor, partial(getattr(storage, name), *args, **kwargs))
+
+        return call
+
+
+class Storage(ABC):
+    """Хранилище бота: все запросы к базе идут через эти методы.
+
+    Реализации — SqliteDatabase (один файл) и PostgresDatabase (пул соединений,
+    общая база для нескольких экземпляров). Методы синхронные, строки отдаются
+    объектами с доступом по имени колонки (row["id"]). Из корутин методы вызываются
+    через db.aio (AsyncStorage), чтобы сетевые запросы не останавливали цикл событий.
+    Методы интерфейса абстрактные: реализация, где какого-то не хватает, падает ещё
+    в open_storage(), а не на первом вызове из хэндлера.
+    """
+
+    # ошибка нарушения ограничения (повторный отзыв на ту же заявку и т.п.)
+    IntegrityError: type = Exception
+    # пул потоков для db.aio; None — методы вызываются прямо в цикле
+    executor: Optional[ThreadPoolExecutor] = None
+
+    # сортировки списка заявок в админке; при равном бюджете — в порядке индекса по (status, budget_rub)
+    BUDGET_ORDERS = {
+        "new": "a.id DESC",
+        "asc": "a.budget_rub, a.id",
+        "desc": "a.budget_rub DESC, a.id DESC",
+    }
+
+    # epoch-колонки (UTC, секунды) рядом с ISO-строками и из чего они считаются;
+    # по первой колонке таблицы (она в индексе) ищутся строки без перевода
+    EPOCH_COLUMNS = {
+        "applications": (("created_ts", "created_at"), ("updated_ts", "updated_at")),
+        "applications_archive": (("created_ts", "created_at"), ("updated_ts", "updated_at")),
+        "users": (("last_seen_ts", "last_seen_at"), ("created_ts", "created_at")),
+    }
+
+    def __init__(self):
+        # вызываются с (id заявки, новый статус) после создания и смены статуса
+        self.application_listeners: List[Callable[[int, str], None]] = []
+        # цикл, из которого методы уходят в executor: слушатели вызываются в нём
+        self.listener_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stamp_ts = 0
+        self._stamp_iso = ""
+        self.aio = AsyncStorage(self)
+
+    def _notify_application(self, app_id: int, status: str) -> None:
+        loop = self.listener_loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is not None and running is not loop:
+            for listener in self.application_listeners:
+                loop.call_soon_threadsafe(listener, app_id, status)
+            return
+        for listener in self.application_listeners:
+            listener(app_id, status)
+
+    def _stamp(self) -> Tuple[str, int]:
+        """Текущее время: ISO-строка для показа и epoch-секунды для фильтров.
+        Строка форматируется раз в секунду, а не на каждую запись."""
+        ts = int(time.time())
+        if ts != self._stamp_ts:
+            self._stamp_iso = datetime.utcfromtimestamp(ts).isoformat()
+            self._stamp_ts = ts
+        return self._stamp_iso, ts
+
+    def _now(self) -> str:
+        return self._stamp()[0]
+
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def init_schema(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def backfill_contact_phones(self, batch_size: int = 1000) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def backfill_timestamps(self, batch_size: int = 5000) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def backfill_budgets(self, batch_size: int = 5000) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def export_chunks(self, table: str, chunk_size: int) -> Tuple[List[str], Iterator[List[Any]]]:
+        raise NotImplementedError
+
+    # --- отзывы ---
+
+    @abstractmethod
+    def review_for_application_exists(self, application_id: int) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_application_tg_id(self, application_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_review(
+        self,
+        application_id: int,
+        tg_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        stars: int,
+        body: Optional[str],
+        photos: List[str] = (),
+    ) -> int:
+        """photos — file_id фото в порядке отправки (не больше REVIEW_MAX_PHOTOS)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_reviews_newest_first(self, limit: int = 500, before_id: Optional[int] = None) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_review(self, review_id: int) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_review_body(self, review_id: int, body: Optional[str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_review_stars(self, review_id: int, stars: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_review(self, review_id: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_review_photos(self, review_id: int) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def latest_review_photos(self, limit: int, per_review: int) -> List[Any]:
+        """(review_id, stars, file_id) первых per_review фото последних отзывов, от новых к старым."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_review_photos(self, review_id: int) -> None:
+        raise NotImplementedError
+
+    # --- пользователи ---
+
+    @abstractmethod
+    def get_or_create_user(self, tg_id: int, username: Optional[str], first_name: Optional[str]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_by_tg(self, tg_id: int) -> Optional[Any]:
+        raise NotImplementedError
+
+    # --- заявки ---
+
+    @abstractmethod
+    def create_application(self, user: Any, data: dict) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_application(self, app_id: int) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_applications(self, user_id: int, limit: int = 20) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_applications_by_status(self, statuses: List[str], limit: int = 20) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_applications_by_budget(
+        self,
+        statuses: List[str],
+        min_rub: Optional[int],
+        max_rub: Optional[int],
+        order: str = "new",
+        limit: int = 20,
+    ) -> List[Any]:
+        """Заявки с budget_rub в [min_rub, max_rub); order — ключ BUDGET_ORDERS.
+        Заявки без распознанного бюджета сюда не попадают."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_applications_by_phone(self, phone: str, limit: int = 20) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_applications_by_phone(self, phone: str, before_id: Optional[int] = None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_application_status(
+        self,
+        app_id: int,
+        status: str,
+        admin_tg_id: int,
+        admin_comment: str,
+        expected_version: Optional[int] = None,
+    ) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim_application(self, app_id: int, admin_tg_id: int, admin_name: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def bulk_update_status(
+        self, app_ids: List[int], status: str, admin_tg_id: int, admin_name: str, admin_comment: str
+    ) -> Tuple[List[Any], List[Any]]:
+        """Закрывает заявки одной транзакцией. Закрытые и взятые другим админом пропускаются.
+        Возвращает (изменённые заявки, их уведомления админам — уже удалённые из базы)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_admin_notifications(self, app_id: int, sent: List[Tuple[int, int]]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_admin_notifications(self, app_id: int) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_admin_notifications(self, app_id: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_sla_pending(self, workers: int = 1, index: int = 0) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_application_sla_level(self, app_id: int, level: int) -> None:
+        raise NotImplementedError
+
+    # --- воронка ---
+
+    @abstractmethod
+    def add_funnel_counts(self, rows: List[Tuple[str, str, int]]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def funnel_totals(self, since: str) -> Dict[str, int]:
+        raise NotImplementedError
+
+    # --- отчёты по периодам (epoch-секунды, [start_ts, end_ts)) ---
+
+    @abstractmethod
+    def count_applications_created(self, start_ts: int, end_ts: int) -> Dict[str, int]:
+        """Заявки (вместе с архивом), созданные в периоде, по статусам."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_users_created_since(self, since_ts: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_users_active_since(self, since_ts: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def top_destinations(self, start_ts: int, end_ts: int, limit: int) -> List[Any]:
+        """Самые частые направления (id, name, n) среди заявок периода."""
+        raise NotImplementedError
+
+    # --- справочник направлений ---
+
+    @abstractmethod
+    def list_destinations(self) -> List[Any]:
+        """(id, name, country, aliases, uses) — uses: сколько заявок с этим направлением."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_destinations(self, rows: List[Tuple[str, Optional[str], str, str]]) -> None:
+        """rows — (name, country, aliases через «|», source); уже известные имена пропускаются."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def unmatched_destinations(self) -> List[Any]:
+        """Тексты нераспознанных направлений (destination_id NULL или 0): (destination, n, last_id)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_destination_ids(self, mapping: Dict[str, int], up_to_id: int) -> None:
+        """Проставляет destination_id нераспознанным заявкам с id <= up_to_id по тексту
+        направления; не найденным в mapping — 0 (разобрано, но не распознано)."""
+        raise NotImplementedError
+
+    # --- архив ---
+
+    @abstractmethod
+    def archive_closed_batch(self, older_than_days: int, batch_size: int) -> int:
+        raise NotImplementedError
+
+    # --- рассылки ---
+
+    @abstractmethod
+    def create_broadcast(self, admin_tg_id: int, text: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_broadcast(self, broadcast_id: int) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_running_broadcasts(self) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_broadcast_progress_message(self, broadcast_id: int, chat_id: int, msg_id: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_broadcast_status(self, broadcast_id: int, status: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_broadcast_recipients(self, broadcast_id: int, after_user_id: int, limit: int) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def record_broadcast_batch(self, broadcast_id: int, cursor_user_id: int, results: List[tuple]) -> None:
+        raise NotImplementedError
+
+    # --- аренда опроса ---
+
+    @abstractmethod
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit_update_offset(self, name: str, holder: str, update_id: int, ttl: float) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_update_offset(self, name: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_lease(self, name: str, holder: str) -> None:
+        raise NotImplementedError
+
+
+class SqliteDatabase(Storage):
+    IntegrityError = sqlite3.IntegrityError
+
     def __init__(self, path: str):
+        super().__init__()
+        self.path = path
         self.conn = sqlite3.connect(path)
         self.conn.row_factory = sqlite3.Row
+        # WAL: выгрузки и другие читатели не блокируют запись бота
+        self.conn.execute("PRAGMA journal_mode=WAL")
         self.init_schema()
 
+    def close(self) -> None:
+        self.conn.close()
+
     def init_schema(self):
         cur = self.conn.cursor()
 
@@ -101,7 +944,296 @@ class Database:
         """
         )
 
+        # архив закрытых заявок: те же колонки + время переноса
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS applications_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            tg_id INTEGER NOT NULL,
+            username TEXT,
+            status TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            destination TEXT,
+            dates TEXT,
+            adults INTEGER,
+            children INTEGER,
+            budget TEXT,
+            wishes TEXT,
+            contact TEXT,
+            admin_comment TEXT,
+            admin_tg_id INTEGER,
+            archived_at TEXT
+        );
+        """
+        )
+
+        for table in ("applications", "applications_archive"):
+            self._ensure_column(cur, table, "contact_phone", "TEXT")
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_contact_phone ON {table}(contact_phone)"
+            )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_applications_archive_user "
+            "ON applications_archive(user_id)"
+        )
+        # сколько эскалаций по заявке уже отправлено (переживает перезапуск)
+        for table in ("applications", "applications_archive"):
+            self._ensure_column(cur, table, "sla_level", "INTEGER NOT NULL DEFAULT 0")
+            # смена статуса — compare-and-set по version; claimed_by — админ, взявший заявку
+            self._ensure_column(cur, table, "version", "INTEGER NOT NULL DEFAULT 0")
+            self._ensure_column(cur, table, "claimed_by", "INTEGER")
+            self._ensure_column(cur, table, "claimed_by_name", "TEXT")
+            self._ensure_column(cur, table, "claimed_at", "TEXT")
+        for table in ("applications", "applications_archive"):
+            self._ensure_column(cur, table, "created_ts", "INTEGER")
+            self._ensure_column(cur, table, "updated_ts", "INTEGER")
+        # архивация отбирает закрытые заявки по updated_ts
+        cur.execute("DROP INDEX IF EXISTS idx_applications_status_updated")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_applications_status_updated_ts "
+            "ON applications(status, updated_ts)"
+        )
+        self._ensure_column(cur, "users", "created_ts", "INTEGER")
+        self._ensure_column(cur, "users", "last_seen_ts", "INTEGER")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_created_ts ON users(created_ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen_ts ON users(last_seen_ts)")
+        # справочник направлений; destination_id заявки: NULL — ещё не разобрано, 0 — не распознано
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS destinations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            country TEXT,
+            aliases TEXT NOT NULL DEFAULT '',
+            source TEXT NOT NULL
+        );
+        """
+        )
+        for table in ("applications", "applications_archive"):
+            self._ensure_column(cur, table, "destination_id", "INTEGER")
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_destination ON {table}(destination_id)"
+            )
+            # отчёты по периодам: диапазон по created_ts, статус и направление — из индекса
+            cur.execute(f"DROP INDEX IF EXISTS idx_{table}_created_ts")
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_created_ts_dest "
+                f"ON {table}(created_ts, status, destination_id)"
+            )
+        # бюджет в числах (budget_columns); budget_currency IS NULL — ещё не разобран
+        for table in ("applications", "applications_archive"):
+            self._ensure_column(cur, table, "budget_min", "INTEGER")
+            self._ensure_column(cur, table, "budget_max", "INTEGER")
+            self._ensure_column(cur, table, "budget_currency", "TEXT")
+            self._ensure_column(cur, table, "budget_per_person", "INTEGER")
+            self._ensure_column(cur, table, "budget_rub", "INTEGER")
+            # частичный индекс: после разбора пуст, и проверка при старте ничего не читает
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_budget_pending "
+                f"ON {table}(id) WHERE budget_currency IS NULL"
+            )
+        # фильтр и сортировка по бюджету в админке: диапазон и порядок прямо из индекса
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_applications_status_budget ON applications(status, budget_rub)"
+        )
+        # фото отзывов: только file_id Telegram, байты не храним; reviews.photos — их число
+        self._ensure_column(cur, "reviews", "photos", "INTEGER NOT NULL DEFAULT 0")
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS review_photos (
+            review_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (review_id, position)
+        ) WITHOUT ROWID;
+        """
+        )
+        # аренда опроса getUpdates: держатель, срок и последний принятый update_id
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_ts REAL NOT NULL,
+            update_offset INTEGER NOT NULL DEFAULT 0
+        );
+        """
+        )
+        # уведомления админам о заявке: их кнопки правим, когда заявку берут или закрывают
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS admin_notifications (
+            application_id INTEGER NOT NULL,
+            admin_tg_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (application_id, admin_tg_id, message_id)
+        ) WITHOUT ROWID;
+        """
+        )
+
+        # рассылки
+        self._ensure_column(cur, "users", "blocked_at", "TEXT")
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_tg_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL,
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            progress_chat_id INTEGER,
+            progress_msg_id INTEGER,
+            created_at TEXT,
+            updated_at TEXT
+        );
+        """
+        )
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID;
+        """
+        )
+
+        # воронка анкеты по часовым корзинам
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS funnel_stats (
+            bucket TEXT NOT NULL,
+            event TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, event)
+        ) WITHOUT ROWID;
+        """
+        )
+
         self.conn.commit()
+        self.backfill_contact_phones()
+        self.backfill_timestamps()
+        self.backfill_budgets()
+
+        cur.execute("PRAGMA table_info(applications)")
+        self.app_columns = ", ".join(r["name"] for r in cur.fetchall())
+
+    def _ensure_column(self, cur: sqlite3.Cursor, table: str, column: str, decl: str) -> None:
+        cur.execute(f"PRAGMA table_info({table})")
+        if column not in {r["name"] for r in cur.fetchall()}:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def backfill_contact_phones(self, batch_size: int = 1000) -> None:
+        # Старые заявки сохранены без нормализованного номера — досчитываем пачками.
+        cur = self.conn.cursor()
+        last_id = 0
+        while True:
+            cur.execute(
+                """
+                SELECT id, contact FROM applications
+                WHERE id > ? AND contact_phone IS NULL AND contact IS NOT NULL
+                ORDER BY id
+                LIMIT ?
+                """,
+                (last_id, batch_size),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            # "" — контакт не телефон, чтобы не пересчитывать такие строки при каждом старте
+            cur.executemany(
+                "UPDATE applications SET contact_phone=? WHERE id=?",
+                [(normalize_phone(r["contact"]) or "", r["id"]) for r in rows],
+            )
+            self.conn.commit()
+
+    def backfill_timestamps(self, batch_size: int = 5000) -> None:
+        # Строки, записанные до epoch-колонок, — переводим ISO-строки пачками.
+        # Кривая или пустая строка даёт 0, чтобы строка не попадала в выборку снова.
+        cur = self.conn.cursor()
+        for table, columns in self.EPOCH_COLUMNS.items():
+            sets = ", ".join(
+                f"{ts} = COALESCE(CAST(strftime('%s', {iso}) AS INTEGER), 0)" for ts, iso in columns
+            )
+            while True:
+                cur.execute(
+                    f"""
+                    UPDATE {table} SET {sets}
+                    WHERE id IN (SELECT id FROM {table} WHERE {columns[0][0]} IS NULL LIMIT ?)
+                    """,
+                    (batch_size,),
+                )
+                self.conn.commit()
+                if cur.rowcount < batch_size:
+                    break
+
+    def backfill_budgets(self, batch_size: int = 5000) -> None:
+        # Разбор бюджета старых заявок: пачка строк — одна транзакция, в памяти только пачка.
+        # Разобранная строка всегда получает валюту (хотя бы ""), поэтому уходит из
+        # частичного индекса, и следующая пачка снова берётся с его начала.
+        cur = self.conn.cursor()
+        for table in ("applications", "applications_archive"):
+            while True:
+                # INDEXED BY: по устаревшей статистике планировщик выбирает полный проход таблицы
+                cur.execute(
+                    f"""
+                    SELECT id, budget, adults, children FROM {table} INDEXED BY idx_{table}_budget_pending
+                    WHERE budget_currency IS NULL
+                    LIMIT ?
+                    """,
+                    (batch_size,),
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                cur.executemany(
+                    f"""
+                    UPDATE {table} SET budget_min=?, budget_max=?, budget_currency=?,
+                        budget_per_person=?, budget_rub=?
+                    WHERE id=?
+                    """,
+                    [(*budget_columns(r["budget"], r["adults"], r["children"]), r["id"]) for r in rows],
+                )
+                self.conn.commit()
+
+    def export_chunks(self, table: str, chunk_size: int) -> Tuple[List[str], Iterator[List[Any]]]:
+        """Колонки таблицы и её строки кусками по chunk_size.
+
+        Читает через отдельное read-only соединение, поэтому можно звать из потока,
+        а запись бота не блокируется. Архивные заявки идут вместе с актуальными.
+        """
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        cur = conn.cursor()
+        cur.execute(f"PRAGMA table_info({table})")
+        columns = [r[1] for r in cur.fetchall()]
+        cols = ", ".join(columns)
+        if table == "applications":
+            cur.execute(
+                f"SELECT {cols} FROM applications UNION ALL SELECT {cols} FROM applications_archive"
+            )
+        else:
+            cur.execute(f"SELECT {cols} FROM {table}")
+
+        def chunks() -> Iterator[List[Any]]:
+            try:
+                while True:
+                    chunk = cur.fetchmany(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+            finally:
+                conn.close()
+
+        return columns, chunks()
 
     # --- отзывы ---
 
@@ -117,6 +1249,11 @@ class Database:
         cur = self.conn.cursor()
         cur.execute("SELECT tg_id FROM applications WHERE id=?", (application_id,))
         row = cur.fetchone()
+        if not row:
+            cur.execute(
+                "SELECT tg_id FROM applications_archive WHERE id=?", (application_id,)
+            )
+            row = cur.fetchone()
         return int(row["tg_id"]) if row else None
 
     def create_review(
@@ -127,40 +1264,51 @@ class Database:
         first_name: Optional[str],
         stars: int,
         body: Optional[str],
+        photos: List[str] = (),
     ) -> int:
         cur = self.conn.cursor()
         now = self._now()
-        cur.execute(
-            """
-            INSERT INTO reviews (
-                application_id, tg_id, username, first_name,
-                stars, body, created_at, updated_at
-            ) VALUES (?,?,?,?,?,?,?,?)
-            """,
-            (
-                application_id,
-                tg_id,
-                username,
-                first_name,
-                stars,
-                (body or "").strip() or None,
-                now,
-                now,
-            ),
-        )
-        self.conn.commit()
-        return cur.lastrowid
+        try:
+            cur.execute(
+                """
+                INSERT INTO reviews (
+                    application_id, tg_id, username, first_name,
+                    stars, body, created_at, updated_at, photos
+                ) VALUES (?,?,?,?,?,?,?,?,?)
+                """,
+                (
+                    application_id,
+                    tg_id,
+                    username,
+                    first_name,
+                    stars,
+                    (body or "").strip() or None,
+                    now,
+                    now,
+                    len(photos),
+                ),
+            )
+            review_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO review_photos (review_id, position, file_id) VALUES (?,?,?)",
+                [(review_id, i, file_id) for i, file_id in enumerate(photos)],
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return review_id
 
-    def list_reviews_newest_first(self, limit: int = 500) -> List[sqlite3.Row]:
+    def list_reviews_newest_first(self, limit: int = 500, before_id: Optional[int] = None) -> List[sqlite3.Row]:
+        """Отзывы от новых к старым; before_id — курсор страницы (id < before_id)."""
         cur = self.conn.cursor()
-        cur.execute(
-            """
-            SELECT * FROM reviews
-            ORDER BY id DESC
-            LIMIT ?
-            """,
-            (limit,),
-        )
+        if before_id is None:
+            cur.execute("SELECT * FROM reviews ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            cur.execute(
+                "SELECT * FROM reviews WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (before_id, limit),
+            )
         return cur.fetchall()
 
     def get_review(self, review_id: int) -> Optional[sqlite3.Row]:
@@ -186,11 +1334,35 @@ class Database:
 
     def delete_review(self, review_id: int) -> None:
         cur = self.conn.cursor()
+        cur.execute("DELETE FROM review_photos WHERE review_id=?", (review_id,))
         cur.execute("DELETE FROM reviews WHERE id=?", (review_id,))
         self.conn.commit()
 
-    def _now(self) -> str:
-        return datetime.utcnow().isoformat(timespec="seconds")
+    def list_review_photos(self, review_id: int) -> List[str]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT file_id FROM review_photos WHERE review_id=? ORDER BY position", (review_id,))
+        return [r["file_id"] for r in cur.fetchall()]
+
+    def latest_review_photos(self, limit: int, per_review: int) -> List[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT p.review_id, r.stars, p.file_id
+            FROM review_photos p
+            JOIN reviews r ON r.id = p.review_id
+            WHERE p.position < ?
+            ORDER BY p.review_id DESC, p.position
+            LIMIT ?
+            """,
+            (per_review, limit),
+        )
+        return cur.fetchall()
+
+    def delete_review_photos(self, review_id: int) -> None:
+        cur = self.conn.cursor()
+        cur.execute("DELETE FROM review_photos WHERE review_id=?", (review_id,))
+        cur.execute("UPDATE reviews SET photos=0, updated_at=? WHERE id=?", (self._now(), review_id))
+        self.conn.commit()
 
     # --- пользователи ---
 
@@ -203,17 +1375,24 @@ class Database:
         cur = self.conn.cursor()
         cur.execute("SELECT id FROM users WHERE tg_id = ?", (tg_id,))
         row = cur.fetchone()
-        now = self._now()
+        now, ts = self._stamp()
         if row:
             user_id = row["id"]
+            # пользователь снова пишет боту — значит, он его разблокировал
             cur.execute(
-                "UPDATE users SET username=?, first_name=?, last_seen_at=? WHERE id=?",
-                (username, first_name, now, user_id),
+                """
+                UPDATE users SET username=?, first_name=?, last_seen_at=?, last_seen_ts=?, blocked_at=NULL
+                WHERE id=?
+                """,
+                (username, first_name, now, ts, user_id),
             )
         else:
             cur.execute(
-                "INSERT INTO users (tg_id, username, first_name, created_at, last_seen_at) VALUES (?,?,?,?,?)",
-                (tg_id, username, first_name, now, now),
+                """
+                INSERT INTO users (tg_id, username, first_name, created_at, last_seen_at, created_ts, last_seen_ts)
+                VALUES (?,?,?,?,?,?,?)
+                """,
+                (tg_id, username, first_name, now, now, ts, ts),
             )
             user_id = cur.lastrowid
         self.conn.commit()
@@ -228,15 +1407,16 @@ class Database:
 
     def create_application(self, user: sqlite3.Row, data: dict) -> int:
         cur = self.conn.cursor()
-        now = self._now()
+        now, ts = self._stamp()
         cur.execute(
             """
             INSERT INTO applications (
                 user_id, tg_id, username, status,
-                created_at, updated_at,
+                created_at, updated_at, created_ts, updated_ts,
                 destination, dates, adults, children,
-                budget, wishes, contact
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+                budget, wishes, contact, contact_phone, destination_id,
+                budget_min, budget_max, budget_currency, budget_per_person, budget_rub
+            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
             """,
             (
                 user["id"],
@@ -245,6 +1425,8 @@ class Database:
                 "new",
                 now,
                 now,
+                ts,
+                ts,
                 data["destination"],
                 data["dates"],
                 data["adults"],
@@ -252,34 +1434,43 @@ class Database:
                 data["budget"],
                 data["wishes"],
                 data["contact"],
+                normalize_phone(data["contact"]),
+                data.get("destination_id"),
+                *budget_columns(data["budget"], data["adults"], data["children"]),
             ),
         )
         self.conn.commit()
+        self._notify_application(cur.lastrowid, "new")
         return cur.lastrowid
 
     def get_application(self, app_id: int) -> Optional[sqlite3.Row]:
         cur = self.conn.cursor()
-        cur.execute(
-            """
-            SELECT a.*, u.first_name
-            FROM applications a
-            LEFT JOIN users u ON u.id = a.user_id
-            WHERE a.id=?
-            """,
-            (app_id,),
-        )
-        return cur.fetchone()
+        for table in ("applications", "applications_archive"):
+            cur.execute(
+                f"""
+                SELECT a.*, u.first_name
+                FROM {table} a
+                LEFT JOIN users u ON u.id = a.user_id
+                WHERE a.id=?
+                """,
+                (app_id,),
+            )
+            row = cur.fetchone()
+            if row:
+                return row
+        return None
 
     def get_user_applications(self, user_id: int, limit: int = 20) -> List[sqlite3.Row]:
         cur = self.conn.cursor()
         cur.execute(
-            """
-            SELECT * FROM applications
-            WHERE user_id=?
+            f"""
+            SELECT {self.app_columns} FROM applications WHERE user_id=?
+            UNION ALL
+            SELECT {self.app_columns} FROM applications_archive WHERE user_id=?
             ORDER BY id DESC
             LIMIT ?
             """,
-            (user_id, limit),
+            (user_id, user_id, limit),
         )
         return cur.fetchall()
 
@@ -299,1047 +1490,4560 @@ class Database:
         )
         return cur.fetchall()
 
+    def get_applications_by_budget(
+        self,
+        statuses: List[str],
+        min_rub: Optional[int],
+        max_rub: Optional[int],
+        order: str = "new",
+        limit: int = 20,
+    ) -> List[sqlite3.Row]:
+        # по limit строк на статус в порядке индекса и слияние: с IN (...) SQLite
+        # сортировал бы весь диапазон бюджета
+        order_by = self.BUDGET_ORDERS[order]
+        part = f"""
+            SELECT * FROM (
+                SELECT a.*, u.first_name
+                FROM applications a
+                LEFT JOIN users u ON u.id = a.user_id
+                WHERE a.status = ? AND a.budget_rub >= ? AND a.budget_rub < ?
+                ORDER BY {order_by}
+                LIMIT ?
+            )
+        """
+        args: List[Any] = []
+        for status in statuses:
+            args += [status, min_rub or 0, max_rub or 2**62, limit]
+        cur = self.conn.cursor()
+        cur.execute(
+            f"SELECT * FROM ({' UNION ALL '.join([part] * len(statuses))}) AS a ORDER BY {order_by} LIMIT ?",
+            (*args, limit),
+        )
+        return cur.fetchall()
+
+    def get_applications_by_phone(self, phone: str, limit: int = 20) -> List[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""
+            SELECT a.*, u.first_name
+            FROM (
+                SELECT {self.app_columns} FROM applications WHERE contact_phone=?
+                UNION ALL
+                SELECT {self.app_columns} FROM applications_archive WHERE contact_phone=?
+            ) a
+            LEFT JOIN users u ON u.id = a.user_id
+            ORDER BY a.id DESC
+            LIMIT ?
+            """,
+            (phone, phone, limit),
+        )
+        return cur.fetchall()
+
+    def count_applications_by_phone(self, phone: str, before_id: Optional[int] = None) -> int:
+        cur = self.conn.cursor()
+        bound = before_id if before_id is not None else -1
+        total = 0
+        for table in ("applications", "applications_archive"):
+            cur.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE contact_phone=? AND (?<0 OR id<?)",
+                (phone, bound, bound),
+            )
+            total += int(cur.fetchone()[0])
+        return total
+
     def update_application_status(
         self,
         app_id: int,
         status: str,
         admin_tg_id: int,
         admin_comment: str,
-    ):
+        expected_version: Optional[int] = None,
+    ) -> bool:
+        """Меняет статус. С expected_version — только если заявку никто не менял
+        с момента чтения (compare-and-set). Возвращает, применилось ли изменение."""
         cur = self.conn.cursor()
+        now, ts = self._stamp()
         cur.execute(
             """
             UPDATE applications
-            SET status=?, admin_tg_id=?, admin_comment=?, updated_at=?
-            WHERE id=?
+            SET status=?, admin_tg_id=?, admin_comment=?, updated_at=?, updated_ts=?, version=version+1
+            WHERE id=? AND (? IS NULL OR version=?)
             """,
-            (status, admin_tg_id, admin_comment, self._now(), app_id),
+            (status, admin_tg_id, admin_comment, now, ts, app_id, expected_version, expected_version),
         )
         self.conn.commit()
+        if cur.rowcount != 1:
+            return False
+        self._notify_application(app_id, status)
+        return True
 
+    def claim_application(self, app_id: int, admin_tg_id: int, admin_name: str) -> bool:
+        """Атомарно берёт новую заявку в работу: new -> in_progress. False — её уже взяли."""
+        cur = self.conn.cursor()
+        now, ts = self._stamp()
+        cur.execute(
+            """
+            UPDATE applications
+            SET status='in_progress', admin_tg_id=?, claimed_by=?, claimed_by_name=?,
+                claimed_at=?, updated_at=?, updated_ts=?, version=version+1
+            WHERE id=? AND status='new'
+            """,
+            (admin_tg_id, admin_tg_id, admin_name, now, now, ts, app_id),
+        )
+        self.conn.commit()
+        if cur.rowcount != 1:
+            return False
+        self._notify_application(app_id, "in_progress")
+        return True
+
+    def bulk_update_status(
+        self, app_ids: List[int], status: str, admin_tg_id: int, admin_name: str, admin_comment: str
+    ) -> Tuple[List[sqlite3.Row], List[sqlite3.Row]]:
+        if not app_ids:
+            return [], []
+        cur = self.conn.cursor()
+        now, ts = self._stamp()
+        placeholders = ",".join("?" * len(app_ids))
+        closed = ",".join("?" * len(CLOSED_STATUSES))
+        # IMMEDIATE: между выборкой и UPDATE другой процесс не закроет и не возьмёт заявку
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute(
+                f"""
+                SELECT id, tg_id, destination, dates FROM applications
+                WHERE id IN ({placeholders}) AND status NOT IN ({closed})
+                  AND (claimed_by IS NULL OR claimed_by = ?)
+                """,
+                (*app_ids, *CLOSED_STATUSES, admin_tg_id),
+            )
+            apps = cur.fetchall()
+            ids = [a["id"] for a in apps]
+            notifications = []
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                cur.execute(
+                    f"""
+                    UPDATE applications
+                    SET status=?, admin_tg_id=?, admin_comment=?,
+                        claimed_by=COALESCE(claimed_by, ?), claimed_by_name=COALESCE(claimed_by_name, ?),
+                        claimed_at=COALESCE(claimed_at, ?), updated_at=?, updated_ts=?, version=version+1
+                    WHERE id IN ({placeholders})
+                    """,
+                    (status, admin_tg_id, admin_comment, admin_tg_id, admin_name, now, now, ts, *ids),
+                )
+                cur.execute(
+                    f"""
+                    SELECT application_id, admin_tg_id, message_id FROM admin_notifications
+                    WHERE application_id IN ({placeholders})
+                    """,
+                    ids,
+                )
+                notifications = cur.fetchall()
+                cur.execute(f"DELETE FROM admin_notifications WHERE application_id IN ({placeholders})", ids)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        for app_id in ids:
+            self._notify_application(app_id, status)
+        return apps, notifications
+
+    def add_admin_notifications(self, app_id: int, sent: List[Tuple[int, int]]) -> None:
+        """sent — (id админа, id сообщения) разосланных уведомлений о заявке."""
+        cur = self.conn.cursor()
+        cur.executemany(
+            "INSERT OR IGNORE INTO admin_notifications (application_id, admin_tg_id, message_id) VALUES (?,?,?)",
+            [(app_id, admin_id, message_id) for admin_id, message_id in sent],
+        )
+        self.conn.commit()
 
-db = Database(DB_PATH)
-
-# ----------------------- FSM СОСТОЯНИЯ --------------------
+    def list_admin_notifications(self, app_id: int) -> List[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT admin_tg_id, message_id FROM admin_notifications WHERE application_id=?",
+            (app_id,),
+        )
+        return cur.fetchall()
 
+    def delete_admin_notifications(self, app_id: int) -> None:
+        cur = self.conn.cursor()
+        cur.execute("DELETE FROM admin_notifications WHERE application_id=?", (app_id,))
+        self.conn.commit()
 
-class AppForm(StatesGroup):
-    destination = State()
-    dates = State()
-    adults = State()
-    children = State()
-    budget = State()
-    wishes = State()
-    contact = State()
-    confirm = State()
+    def list_sla_pending(self, workers: int = 1, index: int = 0) -> List[sqlite3.Row]:
+        """Заявки в статусе new своего процесса (tg_id % workers == index) для таймеров SLA."""
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT id, created_ts, sla_level FROM applications
+            WHERE status='new' AND tg_id % ? = ?
+            """,
+            (workers, index),
+        )
+        return cur.fetchall()
 
+    def set_application_sla_level(self, app_id: int, level: int) -> None:
+        cur = self.conn.cursor()
+        cur.execute("UPDATE applications SET sla_level=? WHERE id=?", (level, app_id))
+        self.conn.commit()
 
-class ApproveForm(StatesGroup):
-    app_id = State()
-    comment = State()
+    # --- воронка ---
 
+    def add_funnel_counts(self, rows: List[Tuple[str, str, int]]) -> None:
+        """rows — (начало корзины, событие, прирост); счётчики складываются."""
+        cur = self.conn.cursor()
+        cur.executemany(
+            """
+            INSERT INTO funnel_stats (bucket, event, count) VALUES (?,?,?)
+            ON CONFLICT(bucket, event) DO UPDATE SET count = count + excluded.count
+            """,
+            rows,
+        )
+        self.conn.commit()
 
-class RejectForm(StatesGroup):
-    app_id = State()
-    comment = State()
+    def funnel_totals(self, since: str) -> Dict[str, int]:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT event, SUM(count) AS n FROM funnel_stats WHERE bucket >= ? GROUP BY event",
+            (since,),
+        )
+        return {r["event"]: int(r["n"]) for r in cur.fetchall()}
 
+    # --- отчёты по периодам ---
 
-class SupportForm(StatesGroup):
-    message = State()
+    def count_applications_created(self, start_ts: int, end_ts: int) -> Dict[str, int]:
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT status, COUNT(*) AS n FROM (
+                SELECT status FROM applications WHERE created_ts >= ? AND created_ts < ?
+                UNION ALL
+                SELECT status FROM applications_archive WHERE created_ts >= ? AND created_ts < ?
+            )
+            GROUP BY status
+            """,
+            (start_ts, end_ts, start_ts, end_ts),
+        )
+        return {r["status"]: int(r["n"]) for r in cur.fetchall()}
 
+    def count_users_created_since(self, since_ts: int) -> int:
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM users WHERE created_ts >= ?", (since_ts,))
+        return int(cur.fetchone()[0])
 
-class ReviewForm(StatesGroup):
-    waiting_text = State()
+    def count_users_active_since(self, since_ts: int) -> int:
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM users WHERE last_seen_ts >= ?", (since_ts,))
+        return int(cur.fetchone()[0])
 
+    def top_destinations(self, start_ts: int, end_ts: int, limit: int) -> List[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT d.id, d.name, a.n FROM (
+                SELECT destination_id, COUNT(*) AS n FROM (
+                    SELECT destination_id FROM applications WHERE created_ts >= ? AND created_ts < ?
+                    UNION ALL
+                    SELECT destination_id FROM applications_archive WHERE created_ts >= ? AND created_ts < ?
+                )
+                GROUP BY destination_id
+            ) AS a
+            JOIN destinations d ON d.id = a.destination_id
+            ORDER BY a.n DESC, d.name
+            LIMIT ?
+            """,
+            (start_ts, end_ts, start_ts, end_ts, limit),
+        )
+        return cur.fetchall()
 
-class AdminReviewForm(StatesGroup):
-    waiting_body = State()
+    # --- справочник направлений ---
 
+    def list_destinations(self) -> List[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT d.id, d.name, d.country, d.aliases,
+                (SELECT COUNT(*) FROM applications WHERE destination_id = d.id)
+                + (SELECT COUNT(*) FROM applications_archive WHERE destination_id = d.id) AS uses
+            FROM destinations d
+            """
+        )
+        return cur.fetchall()
 
-# ----------------------- КЛАВИАТУРЫ -----------------------
+    def add_destinations(self, rows: List[Tuple[str, Optional[str], str, str]]) -> None:
+        cur = self.conn.cursor()
+        cur.executemany(
+            "INSERT OR IGNORE INTO destinations (name, country, aliases, source) VALUES (?,?,?,?)",
+            rows,
+        )
+        self.conn.commit()
 
+    def unmatched_destinations(self) -> List[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT destination, COUNT(*) AS n, MAX(id) AS last_id FROM (
+                SELECT id, destination FROM applications
+                WHERE destination_id IS NULL OR destination_id = 0
+                UNION ALL
+                SELECT id, destination FROM applications_archive
+                WHERE destination_id IS NULL OR destination_id = 0
+            )
+            GROUP BY destination
+            """
+        )
+        return cur.fetchall()
 
-def main_menu_kb(is_admin: bool = False) -> ReplyKeyboardMarkup:
-    kb = [
-        [
-            KeyboardButton(text="🏖 Подобрать тур"),
-            KeyboardButton(text="📋 Мои заявки"),
-        ],
-        [
-            KeyboardButton(text="⭐ Отзывы клиентов"),
-            KeyboardButton(text="ℹ️ О компании"),
-        ],
-        [
-            KeyboardButton(text="🆘 Связаться с менеджером"),
-        ],
-        [
-            KeyboardButton(text="🔁 Повторить заявку"),
-            KeyboardButton(text="❓ FAQ"),
-        ],
-    ]
-    if is_admin:
-        kb.append([KeyboardButton(text="🛠 Админ‑панель")])
-    return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+    def set_destination_ids(self, mapping: Dict[str, int], up_to_id: int) -> None:
+        cur = self.conn.cursor()
+        cur.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS destination_map "
+            "(destination TEXT PRIMARY KEY, destination_id INTEGER NOT NULL)"
+        )
+        cur.execute("DELETE FROM destination_map")
+        cur.executemany("INSERT INTO destination_map VALUES (?,?)", mapping.items())
+        for table in ("applications", "applications_archive"):
+            cur.execute(
+                f"""
+                UPDATE {table} SET destination_id = (
+                    SELECT m.destination_id FROM destination_map m WHERE m.destination = {table}.destination
+                )
+                WHERE (destination_id IS NULL OR destination_id = 0) AND id <= ?
+                    AND destination IN (SELECT destination FROM destination_map)
+                """,
+                (up_to_id,),
+            )
+            cur.execute(
+                f"UPDATE {table} SET destination_id = 0 WHERE destination_id IS NULL AND id <= ?",
+                (up_to_id,),
+            )
+        self.conn.commit()
 
+    # --- архив ---
 
-def admin_panel_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="🆕 Новые заявки", callback_data="adm:list:new"),
-                InlineKeyboardButton(text="⏳ В обработке", callback_data="adm:list:in_progress"),
-            ],
-            [
-                InlineKeyboardButton(text="✅ Одобренные", callback_data="adm:list:approved"),
-                InlineKeyboardButton(text="❌ Отклонённые", callback_data="adm:list:rejected"),
-            ],
-            [
-                InlineKeyboardButton(text="📊 Все заявки", callback_data="adm:list:all"),
-            ],
-            [
-                InlineKeyboardButton(text="⭐ Управление отзывами", callback_data="admrev:list"),
-            ],
-        ]
-    )
+    def archive_closed_batch(self, older_than_days: int, batch_size: int) -> int:
+        """Переносит одну пачку закрытых заявок в архив. Возвращает число перенесённых строк."""
+        cutoff = int(time.time()) - older_than_days * 86400
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""
+            SELECT id FROM applications
+            WHERE status IN ({",".join("?" * len(CLOSED_STATUSES))}) AND updated_ts < ?
+            LIMIT ?
+            """,
+            (*CLOSED_STATUSES, cutoff, batch_size),
+        )
+        ids = [r["id"] for r in cur.fetchall()]
+        if not ids:
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        try:
+            cur.execute(
+                f"""
+                INSERT INTO applications_archive ({self.app_columns}, archived_at)
+                SELECT {self.app_columns}, ? FROM applications WHERE id IN ({placeholders})
+                """,
+                (self._now(), *ids),
+            )
+            cur.execute(f"DELETE FROM applications WHERE id IN ({placeholders})", ids)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return len(ids)
 
+    # --- рассылки ---
 
-def app_item_kb(app_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="🔍 Открыть заявку",
-                    callback_data=f"adm:open:{app_id}",
-                )
-            ]
-        ]
-    )
+    def create_broadcast(self, admin_tg_id: int, text: str) -> int:
+        cur = self.conn.cursor()
+        now = self._now()
+        cur.execute("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL")
+        total = int(cur.fetchone()[0])
+        cur.execute(
+            """
+            INSERT INTO broadcasts (admin_tg_id, text, status, total, created_at, updated_at)
+            VALUES (?,?,?,?,?,?)
+            """,
+            (admin_tg_id, text, "running", total, now, now),
+        )
+        self.conn.commit()
+        return cur.lastrowid
 
+    def get_broadcast(self, broadcast_id: int) -> Optional[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM broadcasts WHERE id=?", (broadcast_id,))
+        return cur.fetchone()
 
-def app_manage_kb(app_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="✅ Одобрить", callback_data=f"adm:approve:{app_id}"
-                ),
-                InlineKeyboardButton(
-                    text="❌ Отклонить", callback_data=f"adm:reject:{app_id}"
-                ),
-            ],
-        ]
-    )
+    def list_running_broadcasts(self) -> List[sqlite3.Row]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM broadcasts WHERE status='running' ORDER BY id")
+        return cur.fetchall()
 
+    def set_broadcast_progress_message(self, broadcast_id: int, chat_id: int, msg_id: int) -> None:
+        cur = self.conn.cursor()
+        cur.execute(
+            "UPDATE broadcasts SET progress_chat_id=?, progress_msg_id=? WHERE id=?",
+            (chat_id, msg_id, broadcast_id),
+        )
+        self.conn.commit()
 
-def app_confirm_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="📨 Отправить заявку", callback_data="app:send"),
-            ],
-            [
-                InlineKeyboardButton(text="🔁 Заполнить заново", callback_data="app:restart"),
-            ],
-        ]
-    )
+    def set_broadcast_status(self, broadcast_id: int, status: str) -> None:
+        cur = self.conn.cursor()
+        cur.execute(
+            "UPDATE broadcasts SET status=?, updated_at=? WHERE id=?",
+            (status, self._now(), broadcast_id),
+        )
+        self.conn.commit()
 
+    def get_broadcast_recipients(
+        self, broadcast_id: int, after_user_id: int, limit: int
+    ) -> List[sqlite3.Row]:
+        # курсор по id: без OFFSET, и после рестарта продолжаем с места остановки
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            SELECT u.id, u.tg_id FROM users u
+            WHERE u.id > ? AND u.blocked_at IS NULL
+              AND NOT EXISTS (
+                SELECT 1 FROM broadcast_deliveries d
+                WHERE d.broadcast_id=? AND d.user_id=u.id
+              )
+            ORDER BY u.id
+            LIMIT ?
+            """,
+            (after_user_id, broadcast_id, limit),
+        )
+        return cur.fetchall()
 
-def user_after_status_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="🏖 Новая заявка", callback_data="user:newapp"),
-            ],
-            [
-                InlineKeyboardButton(text="🆘 Связаться с менеджером", callback_data="user:contact"),
-            ],
-        ]
-    )
-
+    def record_broadcast_batch(
+        self,
+        broadcast_id: int,
+        cursor_user_id: int,
+        results: List[tuple],
+    ) -> None:
+        """results — кортежи (user_id, status, error); status: sent / failed / blocked."""
+        cur = self.conn.cursor()
+        now = self._now()
+        cur.executemany(
+            "INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, user_id, status, error) "
+            "VALUES (?,?,?,?)",
+            [(broadcast_id, user_id, status, error) for user_id, status, error in results],
+        )
+        blocked = [(now, user_id) for user_id, status, _ in results if status == "blocked"]
+        if blocked:
+            cur.executemany("UPDATE users SET blocked_at=? WHERE id=?", blocked)
+        cur.execute(
+            """
+            UPDATE broadcasts
+            SET cursor_user_id=?, updated_at=?,
+                sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+            WHERE id=?
+            """,
+            (
+                cursor_user_id,
+                now,
+                sum(1 for r in results if r[1] == "sent"),
+                sum(1 for r in results if r[1] == "failed"),
+                len(blocked),
+                broadcast_id,
+            ),
+        )
+        self.conn.commit()
 
-def repeat_confirm_kb(app_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="📨 Повторить эту заявку",
-                    callback_data=f"rep:send:{app_id}",
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text="❌ Отмена",
-                    callback_data="rep:cancel",
-                )
-            ],
-        ]
-    )
+    # --- аренда опроса ---
 
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Берёт или продлевает аренду; чужую — только просроченную."""
+        now = time.time()
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO leases (name, holder, expires_ts) VALUES (?,?,?)
+            ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_ts=excluded.expires_ts
+            WHERE leases.holder=excluded.holder OR leases.expires_ts < ?
+            """,
+            (name, holder, now + ttl, now),
+        )
+        self.conn.commit()
+        return cur.rowcount == 1
 
-def review_prompt_kb(app_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="⭐ Оставить отзыв",
-                    callback_data=f"rev:start:{app_id}",
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text="⏭ Пропустить",
-                    callback_data="rev:skip",
-                )
-            ],
-        ]
-    )
+    def commit_update_offset(self, name: str, holder: str, update_id: int, ttl: float) -> bool:
+        """Сохраняет update_id и продлевает аренду; False — аренда уже у другого."""
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            UPDATE leases SET update_offset=MAX(update_offset, ?), expires_ts=?
+            WHERE name=? AND holder=?
+            """,
+            (update_id, time.time() + ttl, name, holder),
+        )
+        self.conn.commit()
+        return cur.rowcount == 1
 
+    def get_update_offset(self, name: str) -> int:
+        cur = self.conn.cursor()
+        cur.execute("SELECT update_offset FROM leases WHERE name=?", (name,))
+        row = cur.fetchone()
+        return row[0] if row else 0
 
-def review_stars_kb(app_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text=f"{i} ⭐", callback_data=f"rev:rate:{app_id}:{i}")
-                for i in range(1, 6)
-            ]
-        ]
-    )
+    def release_lease(self, name: str, holder: str) -> None:
+        cur = self.conn.cursor()
+        cur.execute("UPDATE leases SET expires_ts=0 WHERE name=? AND holder=?", (name, holder))
+        self.conn.commit()
 
 
-def review_text_options_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="✨ Только оценка (без текста)",
-                    callback_data="rev:notext",
-                )
-            ],
-        ]
-    )
+class PostgresDatabase(Storage):
+    """PostgreSQL через asyncpg: пул соединений и кэш подготовленных запросов.
 
+    Пул живёт в собственном потоке со своим циклом событий, а методы остаются
+    синхронными, как у SqliteDatabase: вызов ставит запрос в этот цикл и ждёт
+    результат. Обработчики зовут методы через db.aio — из потоков executor, по
+    одному на соединение пула, — поэтому запросы идут параллельно, а цикл бота
+    их не ждёт.
+    """
 
-def stars_row(n: int) -> str:
-    n = max(1, min(5, n))
-    return "⭐" * n + "☆" * (5 - n)
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = POSTGRES_POOL_MIN,
+        max_size: int = POSTGRES_POOL_MAX,
+        statement_cache: int = POSTGRES_STATEMENT_CACHE,
+    ):
+        import asyncpg
+
+        super().__init__()
+        self.IntegrityError = asyncpg.IntegrityConstraintViolationError
+        self.executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix="postgres-call")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="postgres-storage", daemon=True)
+        self._thread.start()
+
+        async def connect():
+            return await asyncpg.create_pool(
+                dsn,
+                min_size=min_size,
+                max_size=max_size,
+                statement_cache_size=statement_cache,
+            )
 
+        self.pool = self._run(connect())
+        self.init_schema()
 
-def admin_reviews_list_kb(rows: List[sqlite3.Row]) -> InlineKeyboardMarkup:
-    lines: List[List[InlineKeyboardButton]] = []
-    row: List[InlineKeyboardButton] = []
-    for r in rows:
-        row.append(
-            InlineKeyboardButton(
-                text=f"#{r['id']} · {r['stars']}⭐",
-                callback_data=f"admrev:open:{r['id']}",
+    def close(self) -> None:
+        self.executor.shutdown()
+        self._run(self.pool.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    # --- доступ к пулу ---
+
+    def _run(self, coro: Coroutine) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _fetch(self, sql: str, *args: Any) -> List[Any]:
+        return self._run(self.pool.fetch(sql, *args))
+
+    def _fetchrow(self, sql: str, *args: Any) -> Optional[Any]:
+        return self._run(self.pool.fetchrow(sql, *args))
+
+    def _fetchval(self, sql: str, *args: Any) -> Any:
+        return self._run(self.pool.fetchval(sql, *args))
+
+    def _execute(self, sql: str, *args: Any) -> int:
+        """Выполняет запрос; возвращает число затронутых строк (из статуса «UPDATE 1»)."""
+        status = self._run(self.pool.execute(sql, *args))
+        count = status.rsplit(" ", 1)[-1]
+        return int(count) if count.isdigit() else 0
+
+    def _executemany(self, sql: str, args: List[tuple]) -> None:
+        if args:
+            self._run(self.pool.executemany(sql, args))
+
+    def _transaction(self, fn: Callable[[Any], Coroutine]) -> Any:
+        """fn(conn) в одной транзакции на одном соединении пула."""
+
+        async def run():
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    return await fn(conn)
+
+        return self._run(run())
+
+    # --- схема ---
+
+    def init_schema(self) -> None:
+        async def create(conn):
+            # несколько экземпляров могут стартовать одновременно
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('tour_bot_schema'))")
+            await conn.execute(
+                """
+            CREATE TABLE IF NOT EXISTS users (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                tg_id BIGINT UNIQUE NOT NULL,
+                username TEXT,
+                first_name TEXT,
+                created_at TEXT,
+                last_seen_at TEXT,
+                blocked_at TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS applications (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                user_id BIGINT NOT NULL REFERENCES users(id),
+                tg_id BIGINT NOT NULL,
+                username TEXT,
+                status TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                destination TEXT,
+                dates TEXT,
+                adults INTEGER,
+                children INTEGER,
+                budget TEXT,
+                wishes TEXT,
+                contact TEXT,
+                admin_comment TEXT,
+                admin_tg_id BIGINT,
+                contact_phone TEXT,
+                sla_level INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0,
+                claimed_by BIGINT,
+                claimed_by_name TEXT,
+                claimed_at TEXT
+            );
+
+            -- без внешнего ключа на applications: заявка может уехать в архив
+            CREATE TABLE IF NOT EXISTS reviews (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                application_id BIGINT UNIQUE NOT NULL,
+                tg_id BIGINT NOT NULL,
+                username TEXT,
+                first_name TEXT,
+                stars INTEGER NOT NULL,
+                body TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS applications_archive (
+                LIKE applications INCLUDING DEFAULTS,
+                archived_at TEXT,
+                PRIMARY KEY (id)
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_applications_contact_phone ON applications(contact_phone);
+            CREATE INDEX IF NOT EXISTS idx_applications_archive_contact_phone
+                ON applications_archive(contact_phone);
+            CREATE INDEX IF NOT EXISTS idx_applications_archive_user ON applications_archive(user_id);
+
+            -- epoch-секунды рядом с ISO-строками: отчёты по периодам и архивация
+            ALTER TABLE applications
+                ADD COLUMN IF NOT EXISTS created_ts BIGINT, ADD COLUMN IF NOT EXISTS updated_ts BIGINT;
+            ALTER TABLE applications_archive
+                ADD COLUMN IF NOT EXISTS created_ts BIGINT, ADD COLUMN IF NOT EXISTS updated_ts BIGINT;
+            ALTER TABLE users
+                ADD COLUMN IF NOT EXISTS created_ts BIGINT, ADD COLUMN IF NOT EXISTS last_seen_ts BIGINT;
+            DROP INDEX IF EXISTS idx_applications_status_updated;
+            CREATE INDEX IF NOT EXISTS idx_applications_status_updated_ts ON applications(status, updated_ts);
+            CREATE INDEX IF NOT EXISTS idx_users_created_ts ON users(created_ts);
+            CREATE INDEX IF NOT EXISTS idx_users_last_seen_ts ON users(last_seen_ts);
+
+            -- справочник направлений; destination_id: NULL — ещё не разобрано, 0 — не распознано
+            CREATE TABLE IF NOT EXISTS destinations (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL,
+                country TEXT,
+                aliases TEXT NOT NULL DEFAULT '',
+                source TEXT NOT NULL
+            );
+            ALTER TABLE applications ADD COLUMN IF NOT EXISTS destination_id BIGINT;
+            ALTER TABLE applications_archive ADD COLUMN IF NOT EXISTS destination_id BIGINT;
+            CREATE INDEX IF NOT EXISTS idx_applications_destination ON applications(destination_id);
+            CREATE INDEX IF NOT EXISTS idx_applications_archive_destination
+                ON applications_archive(destination_id);
+            DROP INDEX IF EXISTS idx_applications_created_ts;
+            DROP INDEX IF EXISTS idx_applications_archive_created_ts;
+            CREATE INDEX IF NOT EXISTS idx_applications_created_ts_dest
+                ON applications(created_ts, status, destination_id);
+            CREATE INDEX IF NOT EXISTS idx_applications_archive_created_ts_dest
+                ON applications_archive(created_ts, status, destination_id);
+
+            -- бюджет в числах (budget_columns); budget_currency IS NULL — ещё не разобран
+            ALTER TABLE applications
+                ADD COLUMN IF NOT EXISTS budget_min BIGINT, ADD COLUMN IF NOT EXISTS budget_max BIGINT,
+                ADD COLUMN IF NOT EXISTS budget_currency TEXT, ADD COLUMN IF NOT EXISTS budget_per_person INTEGER,
+                ADD COLUMN IF NOT EXISTS budget_rub BIGINT;
+            ALTER TABLE applications_archive
+                ADD COLUMN IF NOT EXISTS budget_min BIGINT, ADD COLUMN IF NOT EXISTS budget_max BIGINT,
+                ADD COLUMN IF NOT EXISTS budget_currency TEXT, ADD COLUMN IF NOT EXISTS budget_per_person INTEGER,
+                ADD COLUMN IF NOT EXISTS budget_rub BIGINT;
+            CREATE INDEX IF NOT EXISTS idx_applications_budget_pending
+                ON applications(id) WHERE budget_currency IS NULL;
+            CREATE INDEX IF NOT EXISTS idx_applications_archive_budget_pending
+                ON applications_archive(id) WHERE budget_currency IS NULL;
+            CREATE INDEX IF NOT EXISTS idx_applications_status_budget ON applications(status, budget_rub);
+
+            -- фото отзывов: только file_id Telegram; reviews.photos — их число
+            ALTER TABLE reviews ADD COLUMN IF NOT EXISTS photos INTEGER NOT NULL DEFAULT 0;
+            CREATE TABLE IF NOT EXISTS review_photos (
+                review_id BIGINT NOT NULL,
+                position INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                PRIMARY KEY (review_id, position)
+            );
+
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_ts DOUBLE PRECISION NOT NULL,
+                update_offset BIGINT NOT NULL DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS admin_notifications (
+                application_id BIGINT NOT NULL,
+                admin_tg_id BIGINT NOT NULL,
+                message_id BIGINT NOT NULL,
+                PRIMARY KEY (application_id, admin_tg_id, message_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                admin_tg_id BIGINT NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL,
+                cursor_user_id BIGINT NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                progress_chat_id BIGINT,
+                progress_msg_id BIGINT,
+                created_at TEXT,
+                updated_at TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                broadcast_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                PRIMARY KEY (broadcast_id, user_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS funnel_stats (
+                bucket TEXT NOT NULL,
+                event TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, event)
+            );
+            """
             )
+
+        self._transaction(create)
+        self.backfill_contact_phones()
+        self.backfill_timestamps()
+        self.backfill_budgets()
+        rows = self._fetch(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'applications'
+            ORDER BY ordinal_position
+            """
         )
-        if len(row) >= 3:
-            lines.append(row)
-            row = []
-    if row:
-        lines.append(row)
-    lines.append(
-        [InlineKeyboardButton(text="⬅️ В админ‑панель", callback_data="admrev:panel")]
-    )
-    return InlineKeyboardMarkup(inline_keyboard=lines)
+        self.app_columns = ", ".join(r["column_name"] for r in rows)
+
+    def backfill_contact_phones(self, batch_size: int = 1000) -> None:
+        last_id = 0
+        while True:
+            rows = self._fetch(
+                """
+                SELECT id, contact FROM applications
+                WHERE id > $1 AND contact_phone IS NULL AND contact IS NOT NULL
+                ORDER BY id
+                LIMIT $2
+                """,
+                last_id,
+                batch_size,
+            )
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            self._executemany(
+                "UPDATE applications SET contact_phone=$1 WHERE id=$2",
+                [(normalize_phone(r["contact"]) or "", r["id"]) for r in rows],
+            )
 
+    # ISO-дата с допустимыми месяцем/днём/временем (и необязательным поясом): только такое приводится к timestamp
+    ISO_TIMESTAMP_RE = (
+        r"^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])"
+        r"([T ]([01]\d|2[0-3]):[0-5]\d(:[0-5]\d(\.\d+)?)?([+-]\d{2}(:?\d{2})?|Z)?)?$"
+    )
 
-def admin_review_manage_kb(review_id: int) -> InlineKeyboardMarkup:
-    star_row = [
-        InlineKeyboardButton(text=f"{i}⭐", callback_data=f"admrev:star:{review_id}:{i}")
-        for i in range(1, 6)
-    ]
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="✏️ Изменить текст",
-                    callback_data=f"admrev:edittext:{review_id}",
+    def backfill_timestamps(self, batch_size: int = 5000) -> None:
+        for table, columns in self.EPOCH_COLUMNS.items():
+            # приведение к timestamp падает на мусоре и валит старт: непохожее на дату даёт 0, как strftime в SQLite
+            sets = ", ".join(
+                f"{ts} = CASE WHEN {iso} ~ '{self.ISO_TIMESTAMP_RE}' "
+                f"THEN EXTRACT(EPOCH FROM {iso}::timestamp)::bigint ELSE 0 END"
+                for ts, iso in columns
+            )
+            while True:
+                updated = self._execute(
+                    f"""
+                    UPDATE {table} SET {sets}
+                    WHERE id IN (SELECT id FROM {table} WHERE {columns[0][0]} IS NULL LIMIT $1)
+                    """,
+                    batch_size,
                 )
-            ],
-            star_row[:3],
-            star_row[3:],
-            [
-                InlineKeyboardButton(
-                    text="🗑 Удалить",
-                    callback_data=f"admrev:delask:{review_id}",
+                if updated < batch_size:
+                    break
+
+    def backfill_budgets(self, batch_size: int = 5000) -> None:
+        for table in ("applications", "applications_archive"):
+            while True:
+                rows = self._fetch(
+                    f"SELECT id, budget, adults, children FROM {table} WHERE budget_currency IS NULL LIMIT $1",
+                    batch_size,
+                )
+                if not rows:
+                    break
+                # пачка — один UPDATE по массивам колонок
+                columns = list(zip(*(budget_columns(r["budget"], r["adults"], r["children"]) for r in rows)))
+                self._execute(
+                    f"""
+                    UPDATE {table} t SET budget_min = v.lo, budget_max = v.hi, budget_currency = v.currency,
+                        budget_per_person = v.per_person, budget_rub = v.rub
+                    FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[], $5::int[], $6::bigint[])
+                        AS v(id, lo, hi, currency, per_person, rub)
+                    WHERE t.id = v.id
+                    """,
+                    [r["id"] for r in rows],
+                    *map(list, columns),
                 )
-            ],
-            [
-                InlineKeyboardButton(text="📋 К списку отзывов", callback_data="admrev:list"),
-            ],
-            [
-                InlineKeyboardButton(text="⬅️ В админ‑панель", callback_data="admrev:panel"),
-            ],
-        ]
-    )
 
+    def export_chunks(self, table: str, chunk_size: int) -> Tuple[List[str], Iterator[List[Any]]]:
+        """Колонки таблицы и её строки кусками: серверный курсор на отдельном соединении пула."""
+        rows = self._fetch(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = $1
+            ORDER BY ordinal_position
+            """,
+            table,
+        )
+        columns = [r["column_name"] for r in rows]
+        cols = ", ".join(columns)
+        if table == "applications":
+            query = f"SELECT {cols} FROM applications UNION ALL SELECT {cols} FROM applications_archive"
+        else:
+            query = f"SELECT {cols} FROM {table}"
+
+        async def open_cursor():
+            conn = await self.pool.acquire()
+            tr = conn.transaction(readonly=True)
+            await tr.start()
+            return conn, tr, await conn.cursor(query)
+
+        async def close_cursor(conn, tr):
+            try:
+                await tr.rollback()
+            finally:
+                await self.pool.release(conn)
+
+        def chunks() -> Iterator[List[Any]]:
+            conn, tr, cursor = self._run(open_cursor())
+            try:
+                while True:
+                    chunk = self._run(cursor.fetch(chunk_size))
+                    if not chunk:
+                        return
+                    yield chunk
+            finally:
+                self._run(close_cursor(conn, tr))
+
+        return columns, chunks()
 
-def admin_review_delete_confirm_kb(review_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="✅ Да, удалить",
-                    callback_data=f"admrev:delyes:{review_id}",
-                ),
-                InlineKeyboardButton(
-                    text="↩️ Отмена",
-                    callback_data=f"admrev:open:{review_id}",
-                ),
-            ],
-        ]
-    )
+    # --- отзывы ---
 
+    def review_for_application_exists(self, application_id: int) -> bool:
+        return self._fetchval("SELECT 1 FROM reviews WHERE application_id=$1 LIMIT 1", application_id) is not None
 
-def format_public_reviews_block(rows: List[sqlite3.Row]) -> str:
-    if not rows:
-        return (
-            "⭐️ <b>Отзывы клиентов</b>\n\n"
-            "Пока отзывов нет. После отправки заявки бот предложит оставить оценку."
+    def get_application_tg_id(self, application_id: int) -> Optional[int]:
+        return self._fetchval(
+            """
+            SELECT tg_id FROM applications WHERE id=$1
+            UNION ALL
+            SELECT tg_id FROM applications_archive WHERE id=$1
+            LIMIT 1
+            """,
+            application_id,
         )
-    head = "⭐️ <b>Отзывы клиентов Anex</b>\n━━━━━━━━━━━━━━━━━━━━\n\n"
-    reserve = 120
-    max_len = 4096
-    parts: List[str] = []
-    pos = 0
-    total = len(head)
-    while pos < len(rows) and total < max_len - reserve:
-        r = rows[pos]
-        who = r["first_name"] or (f"@{r['username']}" if r["username"] else "Клиент")
-        who_e = html.escape(str(who))
-        body_raw = r["body"]
-        if body_raw:
-            body_e = html.escape(str(body_raw))
-            body_line = body_e
-        else:
-            body_line = "<i>без текста</i>"
-        block = (
-            f"▸ <b>#{r['id']}</b>  {stars_row(int(r['stars']))}\n"
-            f"👤 {who_e}\n"
-            f"💬 {body_line}\n"
-            f"───────────────"
+
+    def create_review(
+        self,
+        application_id: int,
+        tg_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        stars: int,
+        body: Optional[str],
+        photos: List[str] = (),
+    ) -> int:
+        now = self._now()
+        # отзыв и его фото — одним запросом, без отдельной транзакции
+        return self._fetchval(
+            """
+            WITH review AS (
+                INSERT INTO reviews (
+                    application_id, tg_id, username, first_name,
+                    stars, body, created_at, updated_at, photos
+                ) VALUES ($1,$2,$3,$4,$5,$6,$7,$7,cardinality($8::text[]))
+                RETURNING id
+            ), photos AS (
+                INSERT INTO review_photos (review_id, position, file_id)
+                SELECT review.id, p.ord - 1, p.file_id
+                FROM review, unnest($8::text[]) WITH ORDINALITY AS p(file_id, ord)
+            )
+            SELECT id FROM review
+            """,
+            application_id,
+            tg_id,
+            username,
+            first_name,
+            stars,
+            (body or "").strip() or None,
+            now,
+            list(photos),
         )
-        sep = "\n\n" if parts else ""
-        if total + len(sep) + len(block) > max_len - reserve:
-            break
-        parts.append(block)
-        total += len(sep) + len(block)
-        pos += 1
-    text = head + "\n\n".join(parts)
-    rest = len(rows) - pos
-    if rest > 0:
-        text += f"\n\n<i>… и ещё {rest} отзыв(ов) — сообщение ограничено длиной Telegram.</i>"
-    return text
+
+    def list_reviews_newest_first(self, limit: int = 500, before_id: Optional[int] = None) -> List[Any]:
+        if before_id is None:
+            return self._fetch("SELECT * FROM reviews ORDER BY id DESC LIMIT $1", limit)
+        return self._fetch("SELECT * FROM reviews WHERE id < $1 ORDER BY id DESC LIMIT $2", before_id, limit)
+
+    def get_review(self, review_id: int) -> Optional[Any]:
+        return self._fetchrow("SELECT * FROM reviews WHERE id=$1", review_id)
+
+    def update_review_body(self, review_id: int, body: Optional[str]) -> None:
+        self._execute("UPDATE reviews SET body=$1, updated_at=$2 WHERE id=$3", body, self._now(), review_id)
+
+    def update_review_stars(self, review_id: int, stars: int) -> None:
+        self._execute("UPDATE reviews SET stars=$1, updated_at=$2 WHERE id=$3", stars, self._now(), review_id)
+
+    def delete_review(self, review_id: int) -> None:
+        self._execute(
+            """
+            WITH photos AS (DELETE FROM review_photos WHERE review_id=$1)
+            DELETE FROM reviews WHERE id=$1
+            """,
+            review_id,
+        )
+
+    def list_review_photos(self, review_id: int) -> List[str]:
+        rows = self._fetch("SELECT file_id FROM review_photos WHERE review_id=$1 ORDER BY position", review_id)
+        return [r["file_id"] for r in rows]
+
+    def latest_review_photos(self, limit: int, per_review: int) -> List[Any]:
+        return self._fetch(
+            """
+            SELECT p.review_id, r.stars, p.file_id
+            FROM review_photos p
+            JOIN reviews r ON r.id = p.review_id
+            WHERE p.position < $2
+            ORDER BY p.review_id DESC, p.position
+            LIMIT $1
+            """,
+            limit,
+            per_review,
+        )
+
+    def delete_review_photos(self, review_id: int) -> None:
+        self._execute(
+            """
+            WITH photos AS (DELETE FROM review_photos WHERE review_id=$1)
+            UPDATE reviews SET photos=0, updated_at=$2 WHERE id=$1
+            """,
+            review_id,
+            self._now(),
+        )
+
+    # --- пользователи ---
+
+    def get_or_create_user(self, tg_id: int, username: Optional[str], first_name: Optional[str]) -> int:
+        # один запрос вместо SELECT + INSERT/UPDATE; пользователь снова пишет — снимаем blocked_at
+        now, ts = self._stamp()
+        return self._fetchval(
+            """
+            INSERT INTO users (tg_id, username, first_name, created_at, last_seen_at, created_ts, last_seen_ts)
+            VALUES ($1,$2,$3,$4,$4,$5,$5)
+            ON CONFLICT (tg_id) DO UPDATE
+            SET username=excluded.username, first_name=excluded.first_name,
+                last_seen_at=excluded.last_seen_at, last_seen_ts=excluded.last_seen_ts, blocked_at=NULL
+            RETURNING id
+            """,
+            tg_id,
+            username,
+            first_name,
+            now,
+            ts,
+        )
+
+    def get_user_by_tg(self, tg_id: int) -> Optional[Any]:
+        return self._fetchrow("SELECT * FROM users WHERE tg_id=$1", tg_id)
+
+    # --- заявки ---
+
+    def create_application(self, user: Any, data: dict) -> int:
+        now, ts = self._stamp()
+        app_id = self._fetchval(
+            """
+            INSERT INTO applications (
+                user_id, tg_id, username, status,
+                created_at, updated_at, created_ts, updated_ts,
+                destination, dates, adults, children,
+                budget, wishes, contact, contact_phone, destination_id,
+                budget_min, budget_max, budget_currency, budget_per_person, budget_rub
+            ) VALUES ($1,$2,$3,'new',$4,$4,$5,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17,$18,$19)
+            RETURNING id
+            """,
+            user["id"],
+            user["tg_id"],
+            user["username"],
+            now,
+            ts,
+            data["destination"],
+            data["dates"],
+            data["adults"],
+            data["children"],
+            data["budget"],
+            data["wishes"],
+            data["contact"],
+            normalize_phone(data["contact"]),
+            data.get("destination_id"),
+            *budget_columns(data["budget"], data["adults"], data["children"]),
+        )
+        self._notify_application(app_id, "new")
+        return app_id
+
+    def get_application(self, app_id: int) -> Optional[Any]:
+        for table in ("applications", "applications_archive"):
+            row = self._fetchrow(
+                f"""
+                SELECT a.*, u.first_name
+                FROM {table} a
+                LEFT JOIN users u ON u.id = a.user_id
+                WHERE a.id=$1
+                """,
+                app_id,
+            )
+            if row:
+                return row
+        return None
+
+    def get_user_applications(self, user_id: int, limit: int = 20) -> List[Any]:
+        return self._fetch(
+            f"""
+            SELECT {self.app_columns} FROM applications WHERE user_id=$1
+            UNION ALL
+            SELECT {self.app_columns} FROM applications_archive WHERE user_id=$1
+            ORDER BY id DESC
+            LIMIT $2
+            """,
+            user_id,
+            limit,
+        )
+
+    def get_applications_by_status(self, statuses: List[str], limit: int = 20) -> List[Any]:
+        # ANY($1) — один подготовленный запрос на любой набор статусов
+        return self._fetch(
+            """
+            SELECT a.*, u.first_name
+            FROM applications a
+            LEFT JOIN users u ON u.id = a.user_id
+            WHERE a.status = ANY($1::text[])
+            ORDER BY a.id DESC
+            LIMIT $2
+            """,
+            list(statuses),
+            limit,
+        )
+
+    def get_applications_by_budget(
+        self,
+        statuses: List[str],
+        min_rub: Optional[int],
+        max_rub: Optional[int],
+        order: str = "new",
+        limit: int = 20,
+    ) -> List[Any]:
+        # LATERAL: по limit строк на статус из индекса (status, budget_rub), потом слияние
+        order_by = self.BUDGET_ORDERS[order]
+        return self._fetch(
+            f"""
+            SELECT a.* FROM unnest($3::text[]) AS s(status)
+            CROSS JOIN LATERAL (
+                SELECT a.*, u.first_name
+                FROM applications a
+                LEFT JOIN users u ON u.id = a.user_id
+                WHERE a.status = s.status AND a.budget_rub >= $1 AND a.budget_rub < $2
+                ORDER BY {order_by}
+                LIMIT $4
+            ) a
+            ORDER BY {order_by}
+            LIMIT $4
+            """,
+            min_rub or 0,
+            max_rub or 2**62,
+            list(statuses),
+            limit,
+        )
+
+    def get_applications_by_phone(self, phone: str, limit: int = 20) -> List[Any]:
+        return self._fetch(
+            f"""
+            SELECT a.*, u.first_name
+            FROM (
+                SELECT {self.app_columns} FROM applications WHERE contact_phone=$1
+                UNION ALL
+                SELECT {self.app_columns} FROM applications_archive WHERE contact_phone=$1
+            ) a
+            LEFT JOIN users u ON u.id = a.user_id
+            ORDER BY a.id DESC
+            LIMIT $2
+            """,
+            phone,
+            limit,
+        )
+
+    def count_applications_by_phone(self, phone: str, before_id: Optional[int] = None) -> int:
+        bound = before_id if before_id is not None else -1
+        return self._fetchval(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM applications WHERE contact_phone=$1 AND ($2 < 0 OR id < $2))
+              + (SELECT COUNT(*) FROM applications_archive WHERE contact_phone=$1 AND ($2 < 0 OR id < $2))
+            """,
+            phone,
+            bound,
+        )
+
+    def update_application_status(
+        self,
+        app_id: int,
+        status: str,
+        admin_tg_id: int,
+        admin_comment: str,
+        expected_version: Optional[int] = None,
+    ) -> bool:
+        now, ts = self._stamp()
+        updated = self._execute(
+            """
+            UPDATE applications
+            SET status=$1, admin_tg_id=$2, admin_comment=$3, updated_at=$4, updated_ts=$5, version=version+1
+            WHERE id=$6 AND ($7::integer IS NULL OR version=$7)
+            """,
+            status,
+            admin_tg_id,
+            admin_comment,
+            now,
+            ts,
+            app_id,
+            expected_version,
+        )
+        if updated != 1:
+            return False
+        self._notify_application(app_id, status)
+        return True
+
+    def claim_application(self, app_id: int, admin_tg_id: int, admin_name: str) -> bool:
+        now, ts = self._stamp()
+        claimed = self._execute(
+            """
+            UPDATE applications
+            SET status='in_progress', admin_tg_id=$1, claimed_by=$1, claimed_by_name=$2,
+                claimed_at=$3, updated_at=$3, updated_ts=$4, version=version+1
+            WHERE id=$5 AND status='new'
+            """,
+            admin_tg_id,
+            admin_name,
+            now,
+            ts,
+            app_id,
+        )
+        if claimed != 1:
+            return False
+        self._notify_application(app_id, "in_progress")
+        return True
+
+    def bulk_update_status(
+        self, app_ids: List[int], status: str, admin_tg_id: int, admin_name: str, admin_comment: str
+    ) -> Tuple[List[Any], List[Any]]:
+        if not app_ids:
+            return [], []
+        now, ts = self._stamp()
+
+        async def close(conn):
+            apps = await conn.fetch(
+                """
+                UPDATE applications
+                SET status=$1, admin_tg_id=$2, admin_comment=$3,
+                    claimed_by=COALESCE(claimed_by, $2), claimed_by_name=COALESCE(claimed_by_name, $4),
+                    claimed_at=COALESCE(claimed_at, $5), updated_at=$5, updated_ts=$6, version=version+1
+                WHERE id = ANY($7::bigint[]) AND status <> ALL($8::text[])
+                  AND (claimed_by IS NULL OR claimed_by = $2)
+                RETURNING id, tg_id, destination, dates
+                """,
+                status,
+                admin_tg_id,
+                admin_comment,
+                admin_name,
+                now,
+                ts,
+                app_ids,
+                list(CLOSED_STATUSES),
+            )
+            notifications = await conn.fetch(
+                """
+                DELETE FROM admin_notifications WHERE application_id = ANY($1::bigint[])
+                RETURNING application_id, admin_tg_id, message_id
+                """,
+                [a["id"] for a in apps],
+            )
+            return apps, notifications
+
+        apps, notifications = self._transaction(close)
+        for a in apps:
+            self._notify_application(a["id"], status)
+        return apps, notifications
+
+    def add_admin_notifications(self, app_id: int, sent: List[Tuple[int, int]]) -> None:
+        self._executemany(
+            """
+            INSERT INTO admin_notifications (application_id, admin_tg_id, message_id)
+            VALUES ($1,$2,$3) ON CONFLICT DO NOTHING
+            """,
+            [(app_id, admin_id, message_id) for admin_id, message_id in sent],
+        )
+
+    def list_admin_notifications(self, app_id: int) -> List[Any]:
+        return self._fetch(
+            "SELECT admin_tg_id, message_id FROM admin_notifications WHERE application_id=$1",
+            app_id,
+        )
+
+    def delete_admin_notifications(self, app_id: int) -> None:
+        self._execute("DELETE FROM admin_notifications WHERE application_id=$1", app_id)
+
+    def list_sla_pending(self, workers: int = 1, index: int = 0) -> List[Any]:
+        return self._fetch(
+            "SELECT id, created_ts, sla_level FROM applications WHERE status='new' AND tg_id % $1 = $2",
+            workers,
+            index,
+        )
+
+    def set_application_sla_level(self, app_id: int, level: int) -> None:
+        self._execute("UPDATE applications SET sla_level=$1 WHERE id=$2", level, app_id)
+
+    # --- воронка ---
+
+    def add_funnel_counts(self, rows: List[Tuple[str, str, int]]) -> None:
+        self._executemany(
+            """
+            INSERT INTO funnel_stats (bucket, event, count) VALUES ($1,$2,$3)
+            ON CONFLICT (bucket, event) DO UPDATE SET count = funnel_stats.count + excluded.count
+            """,
+            rows,
+        )
+
+    def funnel_totals(self, since: str) -> Dict[str, int]:
+        rows = self._fetch(
+            "SELECT event, SUM(count) AS n FROM funnel_stats WHERE bucket >= $1 GROUP BY event",
+            since,
+        )
+        return {r["event"]: int(r["n"]) for r in rows}
+
+    # --- отчёты по периодам ---
+
+    def count_applications_created(self, start_ts: int, end_ts: int) -> Dict[str, int]:
+        rows = self._fetch(
+            """
+            SELECT status, COUNT(*) AS n FROM (
+                SELECT status FROM applications WHERE created_ts >= $1 AND created_ts < $2
+                UNION ALL
+                SELECT status FROM applications_archive WHERE created_ts >= $1 AND created_ts < $2
+            ) a
+            GROUP BY status
+            """,
+            start_ts,
+            end_ts,
+        )
+        return {r["status"]: int(r["n"]) for r in rows}
+
+    def count_users_created_since(self, since_ts: int) -> int:
+        return self._fetchval("SELECT COUNT(*) FROM users WHERE created_ts >= $1", since_ts)
+
+    def count_users_active_since(self, since_ts: int) -> int:
+        return self._fetchval("SELECT COUNT(*) FROM users WHERE last_seen_ts >= $1", since_ts)
+
+    def top_destinations(self, start_ts: int, end_ts: int, limit: int) -> List[Any]:
+        return self._fetch(
+            """
+            SELECT d.id, d.name, a.n FROM (
+                SELECT destination_id, COUNT(*) AS n FROM (
+                    SELECT destination_id FROM applications WHERE created_ts >= $1 AND created_ts < $2
+                    UNION ALL
+                    SELECT destination_id FROM applications_archive WHERE created_ts >= $1 AND created_ts < $2
+                ) t
+                GROUP BY destination_id
+            ) a
+            JOIN destinations d ON d.id = a.destination_id
+            ORDER BY a.n DESC, d.name
+            LIMIT $3
+            """,
+            start_ts,
+            end_ts,
+            limit,
+        )
+
+    # --- справочник направлений ---
+
+    def list_destinations(self) -> List[Any]:
+        return self._fetch(
+            """
+            SELECT d.id, d.name, d.country, d.aliases,
+                (SELECT COUNT(*) FROM applications WHERE destination_id = d.id)
+                + (SELECT COUNT(*) FROM applications_archive WHERE destination_id = d.id) AS uses
+            FROM destinations d
+            """
+        )
+
+    def add_destinations(self, rows: List[Tuple[str, Optional[str], str, str]]) -> None:
+        self._executemany(
+            """
+            INSERT INTO destinations (name, country, aliases, source) VALUES ($1,$2,$3,$4)
+            ON CONFLICT (name) DO NOTHING
+            """,
+            rows,
+        )
+
+    def unmatched_destinations(self) -> List[Any]:
+        return self._fetch(
+            """
+            SELECT destination, COUNT(*) AS n, MAX(id) AS last_id FROM (
+                SELECT id, destination FROM applications
+                WHERE destination_id IS NULL OR destination_id = 0
+                UNION ALL
+                SELECT id, destination FROM applications_archive
+                WHERE destination_id IS NULL OR destination_id = 0
+            ) a
+            GROUP BY destination
+            """
+        )
+
+    def set_destination_ids(self, mapping: Dict[str, int], up_to_id: int) -> None:
+        names, ids = list(mapping), list(mapping.values())
+
+        async def apply(conn):
+            for table in ("applications", "applications_archive"):
+                await conn.execute(
+                    f"""
+                    UPDATE {table} t SET destination_id = m.destination_id
+                    FROM unnest($1::text[], $2::bigint[]) AS m(destination, destination_id)
+                    WHERE t.destination = m.destination AND t.id <= $3
+                        AND (t.destination_id IS NULL OR t.destination_id = 0)
+                    """,
+                    names,
+                    ids,
+                    up_to_id,
+                )
+                await conn.execute(
+                    f"UPDATE {table} SET destination_id = 0 WHERE destination_id IS NULL AND id <= $1",
+                    up_to_id,
+                )
+
+        self._transaction(apply)
+
+    # --- архив ---
+
+    def archive_closed_batch(self, older_than_days: int, batch_size: int) -> int:
+        cutoff = int(time.time()) - older_than_days * 86400
+        # перенос одним запросом; SKIP LOCKED — два экземпляра не возьмут одни и те же строки
+        return self._execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM applications
+                WHERE id IN (
+                    SELECT id FROM applications
+                    WHERE status = ANY($1::text[]) AND updated_ts < $2
+                    LIMIT $3
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {self.app_columns}
+            )
+            INSERT INTO applications_archive ({self.app_columns}, archived_at)
+            SELECT {self.app_columns}, $4 FROM moved
+            """,
+            list(CLOSED_STATUSES),
+            cutoff,
+            batch_size,
+            self._now(),
+        )
+
+    # --- рассылки ---
+
+    def create_broadcast(self, admin_tg_id: int, text: str) -> int:
+        return self._fetchval(
+            """
+            INSERT INTO broadcasts (admin_tg_id, text, status, total, created_at, updated_at)
+            SELECT $1, $2, 'running', COUNT(*), $3, $3 FROM users WHERE blocked_at IS NULL
+            RETURNING id
+            """,
+            admin_tg_id,
+            text,
+            self._now(),
+        )
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[Any]:
+        return self._fetchrow("SELECT * FROM broadcasts WHERE id=$1", broadcast_id)
+
+    def list_running_broadcasts(self) -> List[Any]:
+        return self._fetch("SELECT * FROM broadcasts WHERE status='running' ORDER BY id")
+
+    def set_broadcast_progress_message(self, broadcast_id: int, chat_id: int, msg_id: int) -> None:
+        self._execute(
+            "UPDATE broadcasts SET progress_chat_id=$1, progress_msg_id=$2 WHERE id=$3",
+            chat_id,
+            msg_id,
+            broadcast_id,
+        )
+
+    def set_broadcast_status(self, broadcast_id: int, status: str) -> None:
+        self._execute("UPDATE broadcasts SET status=$1, updated_at=$2 WHERE id=$3", status, self._now(), broadcast_id)
+
+    def get_broadcast_recipients(self, broadcast_id: int, after_user_id: int, limit: int) -> List[Any]:
+        return self._fetch(
+            """
+            SELECT u.id, u.tg_id FROM users u
+            WHERE u.id > $1 AND u.blocked_at IS NULL
+              AND NOT EXISTS (
+                SELECT 1 FROM broadcast_deliveries d
+                WHERE d.broadcast_id=$2 AND d.user_id=u.id
+              )
+            ORDER BY u.id
+            LIMIT $3
+            """,
+            after_user_id,
+            broadcast_id,
+            limit,
+        )
+
+    def record_broadcast_batch(self, broadcast_id: int, cursor_user_id: int, results: List[tuple]) -> None:
+        now = self._now()
+        blocked = [(now, user_id) for user_id, status, _ in results if status == "blocked"]
+
+        async def record(conn):
+            await conn.executemany(
+                """
+                INSERT INTO broadcast_deliveries (broadcast_id, user_id, status, error)
+                VALUES ($1,$2,$3,$4)
+                ON CONFLICT (broadcast_id, user_id) DO UPDATE
+                SET status=excluded.status, error=excluded.error
+                """,
+                [(broadcast_id, user_id, status, error) for user_id, status, error in results],
+            )
+            if blocked:
+                await conn.executemany("UPDATE users SET blocked_at=$1 WHERE id=$2", blocked)
+            await conn.execute(
+                """
+                UPDATE broadcasts
+                SET cursor_user_id=$1, updated_at=$2,
+                    sent = sent + $3, failed = failed + $4, blocked = blocked + $5
+                WHERE id=$6
+                """,
+                cursor_user_id,
+                now,
+                sum(1 for r in results if r[1] == "sent"),
+                sum(1 for r in results if r[1] == "failed"),
+                len(blocked),
+                broadcast_id,
+            )
+
+        self._transaction(record)
+
+    # --- аренда опроса ---
+    # срок считаем по часам сервера базы: у экземпляров на разных машинах часы могут расходиться
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        return (
+            self._execute(
+                """
+                INSERT INTO leases (name, holder, expires_ts)
+                VALUES ($1, $2, extract(epoch from clock_timestamp()) + $3)
+                ON CONFLICT (name) DO UPDATE SET holder=excluded.holder, expires_ts=excluded.expires_ts
+                WHERE leases.holder=excluded.holder
+                   OR leases.expires_ts < extract(epoch from clock_timestamp())
+                """,
+                name,
+                holder,
+                float(ttl),
+            )
+            == 1
+        )
+
+    def commit_update_offset(self, name: str, holder: str, update_id: int, ttl: float) -> bool:
+        return (
+            self._execute(
+                """
+                UPDATE leases
+                SET update_offset=GREATEST(update_offset, $3),
+                    expires_ts=extract(epoch from clock_timestamp()) + $4
+                WHERE name=$1 AND holder=$2
+                """,
+                name,
+                holder,
+                update_id,
+                float(ttl),
+            )
+            == 1
+        )
+
+    def get_update_offset(self, name: str) -> int:
+        return self._fetchval("SELECT update_offset FROM leases WHERE name=$1", name) or 0
+
+    def release_lease(self, name: str, holder: str) -> None:
+        self._execute("UPDATE leases SET expires_ts=0 WHERE name=$1 AND holder=$2", name, holder)
+
+
+def open_storage() -> Storage:
+    if STORAGE_BACKEND == "postgres":
+        return PostgresDatabase(POSTGRES_DSN)
+    if STORAGE_BACKEND != "sqlite":
+        raise ValueError(f"unknown BOT_STORAGE: {STORAGE_BACKEND}")
+    return SqliteDatabase(DB_PATH)
+
+
+db = open_storage()
+
+# ----------------------- FSM СОСТОЯНИЯ --------------------
+
+
+class AppForm(StatesGroup):
+    destination = State()
+    dates = State()
+    adults = State()
+    children = State()
+    budget = State()
+    wishes = State()
+    contact = State()
+    confirm = State()
+
+
+class ApproveForm(StatesGroup):
+    app_id = State()
+    comment = State()
+
+
+class RejectForm(StatesGroup):
+    app_id = State()
+    comment = State()
+
+
+class BulkForm(StatesGroup):
+    comment = State()
+
+
+class SupportForm(StatesGroup):
+    message = State()
+
+
+class ReviewForm(StatesGroup):
+    waiting_text = State()
+
+
+class AdminReviewForm(StatesGroup):
+    waiting_body = State()
+
+
+class PhoneSearchForm(StatesGroup):
+    phone = State()
+
+
+class BroadcastForm(StatesGroup):
+    text = State()
+    confirm = State()
+
+
+# ------------------------ ТЕКСТЫ --------------------------
+
+
+class Markup(str):
+    """Готовый HTML: Template вставляет такое значение без экранирования."""
+
+    __slots__ = ()
+
+
+class Template:
+    """Шаблон сообщения: разбирается один раз, при рендере каждое поле экранируется.
+
+    Поля — только именованные ({name}); всё, что подставляется, кроме Markup,
+    проходит через html.escape, поэтому пользовательский ввод не может сломать
+    разметку сообщения.
+    """
+
+    __slots__ = ("parts",)
+    _formatter = string.Formatter()
+
+    def __init__(self, text: str):
+        parts = []
+        for literal, name, spec, conversion in self._formatter.parse(text):
+            if spec or conversion or name == "" or (name and not name.isidentifier()):
+                raise ValueError(f"unsupported template field: {name!r}")
+            parts.append((literal, name))
+        self.parts = tuple(parts)
+
+    def render(self, **values) -> str:
+        out = []
+        for literal, name in self.parts:
+            out.append(literal)
+            if name is not None:
+                value = values[name]
+                out.append(value if isinstance(value, Markup) else html.escape(str(value), quote=False))
+        return "".join(out)
+
+
+TEXT_WELCOME = (
+    "👋 <b>Добро пожаловать в тур‑бот Anex!</b>\n\n"
+    "Здесь вы можете оформить заявку на подбор тура, посмотреть статус своих заявок "
+    "и связаться с менеджером."
+)
+TEXT_STEP_DESTINATION = (
+    "✈️ <b>Шаг 1 из 7.</b>\n\n"
+    "В какую страну или город вы хотите поехать?"
+)
+TEXT_STEP_DATES = (
+    "📅 <b>Шаг 2 из 7.</b>\n\n"
+    "Когда планируете поездку? Укажите примерные даты или период."
+)
+TEXT_STEP_ADULTS = (
+    "👥 <b>Шаг 3 из 7.</b>\n\n"
+    "Сколько взрослых едет? (введите число)"
+)
+TEXT_STEP_CHILDREN = (
+    "👨‍👩‍👧 <b>Шаг 4 из 7.</b>\n\n"
+    "Сколько детей едет? Если без детей — введите 0."
+)
+TEXT_STEP_BUDGET = (
+    "💵 <b>Шаг 5 из 7.</b>\n\n"
+    "Какой ориентировочный бюджет на тур? Можно указать валюту, например:\n"
+    "<i>до 1500$ на двоих</i> или <i>до 120 000 ₽</i>."
+)
+TEXT_STEP_WISHES = (
+    "🏨 <b>Шаг 6 из 7.</b>\n\n"
+    "Ваши пожелания к отелю и туру:\n"
+    "• звёздность отеля\n"
+    "• тип питания\n"
+    "• важные моменты (первая линия, тихий район и т.д.)\n\n"
+    "Если особых пожеланий нет — напишите «без пожеланий»."
+)
+TEXT_ABOUT = (
+    "🌍 <b>Anex Tour — подбор путешествий под ваши желания.</b>\n\n"
+    "Мы поможем подобрать тур по вашему бюджету, пожеланиям к отелю и датам.\n"
+    "Заполните заявку и дождитесь ответа менеджера."
+)
+TEXT_FAQ = (
+    "❓ <b>Частые вопросы</b>\n\n"
+    "<b>1. Как быстро отвечает менеджер?</b>\n"
+    "Обычно в течение 15–60 минут в рабочее время.\n\n"
+    "<b>2. Когда оплачивать тур?</b>\n"
+    "После согласования варианта и подтверждения брони.\n\n"
+    "<b>3. Нужна ли виза?</b>\n"
+    "Зависит от направления. Менеджер подскажет по вашей стране.\n\n"
+    "<b>4. Какие документы нужны?</b>\n"
+    "Паспорт (загран или внутренний — по направлению), иногда доп. документы для визы.\n\n"
+    "<b>5. Можно ли вернуть деньги?</b>\n"
+    "Условия зависят от тарифа и правил туроператора. Мы подскажем оптимальный вариант."
+)
+TEXT_FORM_REMINDER = (
+    "⏳ Вы начали подбор тура, но не закончили анкету.\n\n"
+    "Продолжим с того же места — просто ответьте на последний вопрос. "
+    "Или начните заново / отмените анкету кнопками ниже."
+)
+TEXT_REVIEW_STARS_REMINDER = "⭐ Вы хотели оценить нашу работу — это займёт пару секунд:"
+TEXT_REVIEW_TEXT_REMINDER = (
+    "✍️ Вы поставили оценку, но не отправили отзыв.\n"
+    "Напишите пару слов одним сообщением или сохраните только оценку."
+)
+TEXT_HANDLER_TIMEOUT = "⏳ Не успели обработать запрос — попробуйте ещё раз через минуту."
+
+TEXT_ADMIN_PANEL = (
+    "🛠 <b>Админ‑панель Anex</b>\n\n"
+    "Выберите, какие заявки хотите посмотреть."
+)
+
+T_DEST_SUGGEST = Template(
+    "🔎 Не нашли «{text}» в нашем списке направлений. Возможно, вы имели в виду:"
+)
+T_STEP_CONTACT = Template(
+    "📞 <b>Шаг 7 из 7.</b>\n\n"
+    "Оставьте, пожалуйста, контакт для связи: только номер телефона.\n"
+    "Только номер РФ: +7XXXXXXXXXX или 8XXXXXXXXXX.\n"
+    "По умолчанию можем использовать: <b>{default_contact}</b> (если это номер телефона — просто отправьте его)."
+)
+T_APP_CONFIRM = Template(
+    "📝 <b>Проверьте заявку:</b>\n\n"
+    "<b>Направление:</b> {destination}\n"
+    "<b>Даты:</b> {dates}\n"
+    "<b>Взрослых:</b> {adults}\n"
+    "<b>Детей:</b> {children}\n"
+    "<b>Бюджет:</b> {budget}\n"
+    "<b>Пожелания:</b> {wishes}\n"
+    "<b>Контакт:</b> {contact}\n\n"
+    "Если всё верно — отправьте заявку менеджеру."
+)
+T_APP_SENT = Template(
+    "✅ <b>Заявка №{app_id} отправлена менеджеру.</b>\n\n"
+    "Мы свяжемся с вами в ближайшее время."
+)
+T_ADMIN_NEW_APP = Template(
+    "📩 <b>Новая заявка №{app_id}</b>\n"
+    "От: @{username} (ID {tg_id})\n\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}\n"
+    "Взрослых: {adults}, детей: {children}\n"
+    "Бюджет: {budget}\n"
+    "Пожелания: {wishes}\n"
+    "Контакт: {contact}"
+    "{returning}"
+)
+T_ADMIN_REPEAT_APP = Template(
+    "📩 <b>Новая повторная заявка №{app_id}</b>\n"
+    "(на основе заявки №{source_id})\n"
+    "От: @{username} (ID {tg_id})\n\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}\n"
+    "Взрослых: {adults}, детей: {children}\n"
+    "Бюджет: {budget}\n"
+    "Пожелания: {wishes}\n"
+    "Контакт: {contact}"
+    "{returning}"
+)
+T_RETURNING_CLIENT = Template(
+    "\n\n🔁 <b>Постоянный клиент</b>: ранее заявок с этого номера — {count}"
+)
+T_MY_APPS_LINE = Template(
+    "• №{app_id} — {status}\n"
+    "  Направление: {destination}\n"
+    "  Даты: {dates}\n"
+    "  Обновлено: {updated_at}\n"
+)
+T_REPEAT_LAST = Template(
+    "📎 <b>Последняя заявка №{app_id}</b> ({status})\n\n"
+    "<b>Направление:</b> {destination}\n"
+    "<b>Даты:</b> {dates}\n"
+    "<b>Взрослых:</b> {adults}\n"
+    "<b>Детей:</b> {children}\n"
+    "<b>Бюджет:</b> {budget}\n"
+    "<b>Пожелания:</b> {wishes}\n"
+    "<b>Контакт:</b> {contact}\n\n"
+    "Отправить такую же заявку ещё раз?"
+)
+T_REPEAT_SENT = Template(
+    "✅ Заявка №{app_id} отправлена повторно.\n"
+    "(на основе заявки №{source_id})"
+)
+T_SLA_ESCALATION = Template(
+    "⏰ <b>Заявка №{app_id} без ответа уже {age}</b>\n"
+    "Клиент: @{username} (ID {tg_id})\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}"
+)
+T_SUPPORT_TO_ADMIN = Template(
+    "📨 Сообщение от пользователя @{username} (ID {tg_id}):\n\n{text}"
+)
+T_APP_SHORT = Template(
+    "№{app_id} — {status}\n"
+    "Клиент: @{username} (ID {tg_id})\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}\n"
+    "Бюджет: {budget}\n"
+    "Создана: {created_at}"
+)
+T_APP_FULL = Template(
+    "📝 <b>Заявка №{app_id}</b> — {status}\n\n"
+    "<b>Клиент:</b> @{username} (ID {tg_id})\n"
+    "<b>Имя:</b> {first_name}\n"
+    "<b>Создана:</b> {created_at}\n"
+    "<b>Обновлена:</b> {updated_at}\n\n"
+    "<b>Направление:</b> {destination}\n"
+    "<b>Даты:</b> {dates}\n"
+    "<b>Взрослых:</b> {adults}\n"
+    "<b>Детей:</b> {children}\n"
+    "<b>Бюджет:</b> {budget}\n"
+    "<b>Пожелания:</b> {wishes}\n"
+    "<b>Контакт:</b> {contact}\n\n"
+    "<b>Комментарий менеджера:</b> {admin_comment}"
+    "{claimed}"
+)
+T_APP_CLAIMED = Template("\n<b>В работе у:</b> {name}")
+T_APPROVED_WITH_COMMENT = Template(
+    "✅ <b>Ваша заявка №{app_id} одобрена менеджером.</b>\n\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}\n\n"
+    "Комментарий менеджера:\n{comment}"
+)
+T_APPROVED = Template(
+    "✅ <b>Ваша заявка №{app_id} одобрена менеджером.</b>\n\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}\n\n"
+    "С вами свяжутся для уточнения деталей."
+)
+T_REJECTED = Template(
+    "❌ <b>Ваша заявка №{app_id} отклонена.</b>\n\n"
+    "Причина:\n{comment}"
+)
+T_CLOSED_WITH_COMMENT = Template(
+    "🗄 <b>Ваша заявка №{app_id} закрыта.</b>\n\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}\n\n"
+    "Комментарий менеджера:\n{comment}"
+)
+T_CLOSED = Template(
+    "🗄 <b>Ваша заявка №{app_id} закрыта.</b>\n\n"
+    "Направление: {destination}\n"
+    "Даты: {dates}\n\n"
+    "Если поездка ещё актуальна — оставьте новую заявку."
+)
+T_PUBLIC_REVIEW = Template(
+    "▸ <b>#{review_id}</b>  {stars}{photos}\n"
+    "👤 {who}\n"
+    "💬 {body}\n"
+    "───────────────"
+)
+T_ADMIN_REVIEW_CAPTION = Template(
+    "📝 <b>Отзыв №{review_id}</b>\n"
+    "Заявка: №{application_id}\n"
+    "Клиент: {who} (tg {tg_id})\n"
+    "Оценка: {stars}\n"
+    "Фото: {photos}\n"
+    "Текст:\n{body}\n"
+    "<i>Создан: {created_at}</i>"
+)
+
+T_REPORT_DESTINATION = Template("  {name}: {n}")
+
+NO_REVIEW_TEXT = Markup("<i>без текста</i>")
+
+
+def app_fields(a) -> dict:
+    """Поля заявки для шаблонов — из строки БД или данных FSM."""
+    return {
+        "destination": a["destination"],
+        "dates": a["dates"],
+        "adults": a["adults"],
+        "children": a["children"],
+        "budget": a["budget"],
+        "wishes": a["wishes"],
+        "contact": a["contact"],
+    }
+
+
+# ----------------------- КЛАВИАТУРЫ -----------------------
+
+
+@lru_cache(maxsize=None)
+def main_menu_kb(is_admin: bool = False) -> ReplyKeyboardMarkup:
+    kb = [
+        [
+            KeyboardButton(text="🏖 Подобрать тур"),
+            KeyboardButton(text="📋 Мои заявки"),
+        ],
+        [
+            KeyboardButton(text="⭐ Отзывы клиентов"),
+            KeyboardButton(text="ℹ️ О компании"),
+        ],
+        [
+            KeyboardButton(text="🆘 Связаться с менеджером"),
+        ],
+        [
+            KeyboardButton(text="🔁 Повторить заявку"),
+            KeyboardButton(text="❓ FAQ"),
+        ],
+    ]
+    if is_admin:
+        kb.append([KeyboardButton(text="🛠 Админ‑панель")])
+    return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+
+
+@lru_cache(maxsize=None)
+def admin_panel_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="🆕 Новые заявки", callback_data="adm:list:new"),
+                InlineKeyboardButton(text="⏳ В обработке", callback_data="adm:list:in_progress"),
+            ],
+            [
+                InlineKeyboardButton(text="✅ Одобренные", callback_data="adm:list:approved"),
+                InlineKeyboardButton(text="❌ Отклонённые", callback_data="adm:list:rejected"),
+            ],
+            [
+                InlineKeyboardButton(text="📊 Все заявки", callback_data="adm:list:all"),
+            ],
+            [
+                InlineKeyboardButton(text="🔎 Поиск по телефону", callback_data="adm:phone"),
+            ],
+            [
+                InlineKeyboardButton(text="📣 Рассылка", callback_data="bc:new"),
+            ],
+            [
+                InlineKeyboardButton(text="📈 Воронка заявок", callback_data="adm:funnel"),
+            ],
+            [
+                InlineKeyboardButton(text="🗓 Отчёт за период", callback_data="adm:report"),
+            ],
+            [
+                InlineKeyboardButton(
+                    text=f"🩺 Профиль за {PROFILE_DEFAULT_SECONDS} с", callback_data="adm:profile"
+                ),
+            ],
+            [
+                InlineKeyboardButton(text="⭐ Управление отзывами", callback_data="admrev:list"),
+            ],
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def funnel_period_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="24 ч", callback_data="adm:funnel:24"),
+                InlineKeyboardButton(text="7 дней", callback_data="adm:funnel:168"),
+                InlineKeyboardButton(text="30 дней", callback_data="adm:funnel:720"),
+            ],
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def report_period_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="24 ч", callback_data="adm:report:1"),
+                InlineKeyboardButton(text="7 дней", callback_data="adm:report:7"),
+                InlineKeyboardButton(text="30 дней", callback_data="adm:report:30"),
+                InlineKeyboardButton(text="Год", callback_data="adm:report:365"),
+            ],
+        ]
+    )
+
+
+BUDGET_ORDER_LABELS = {"new": "🆕 Сначала новые", "asc": "💰 Дешевле", "desc": "💰 Дороже"}
+
+
+@lru_cache(maxsize=None)
+def admin_list_filter_kb(kind: str, band: str, order: str) -> InlineKeyboardMarkup:
+    # текущий выбор отмечен точкой; вариантов немного — кэшируются все
+    def button(label: str, new_band: str, new_order: str, selected: bool) -> InlineKeyboardButton:
+        return InlineKeyboardButton(
+            text=f"• {label}" if selected else label,
+            callback_data=f"adm:list:{kind}:{new_band}:{new_order}",
+        )
+
+    bands = [button(label, code, order, code == band) for code, (label, _, _) in BUDGET_BANDS.items()]
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            bands[:3],
+            bands[3:],
+            [button(label, band, code, code == order) for code, label in BUDGET_ORDER_LABELS.items()],
+        ]
+    )
+
+
+def app_item_kb(app_id: int, selected: bool = False) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="🔍 Открыть заявку",
+                    callback_data=f"adm:open:{app_id}",
+                ),
+                InlineKeyboardButton(
+                    text="☑️ Выбрана" if selected else "☐ Выбрать",
+                    callback_data=f"adm:sel:{app_id}",
+                ),
+            ]
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def bulk_actions_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✅ Одобрить", callback_data="adm:bulk:approved"),
+                InlineKeyboardButton(text="❌ Отклонить", callback_data="adm:bulk:rejected"),
+                InlineKeyboardButton(text="🗄 Закрыть", callback_data="adm:bulk:closed"),
+            ],
+            [
+                InlineKeyboardButton(
+                    text=f"☑️ Все открытые по фильтру (до {BULK_MAX_APPLICATIONS})",
+                    callback_data="adm:selall",
+                ),
+            ],
+            [
+                InlineKeyboardButton(text="✖️ Снять выбор", callback_data="adm:selnone"),
+            ],
+        ]
+    )
+
+
+def app_manage_kb(app_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✅ Одобрить", callback_data=f"adm:approve:{app_id}"
+                ),
+                InlineKeyboardButton(
+                    text="❌ Отклонить", callback_data=f"adm:reject:{app_id}"
+                ),
+            ],
+        ]
+    )
+
+
+def app_taken_kb(app_id: int, label: str) -> InlineKeyboardMarkup:
+    # вместо кнопок действий — кто занимается заявкой; по нажатию карточка откроется
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=label, callback_data=f"adm:open:{app_id}")],
+        ]
+    )
+
+
+def destination_suggest_kb(dest_ids: List[int]) -> InlineKeyboardMarkup:
+    # подсказки зависят от введённого текста — без кэша
+    rows = []
+    for dest_id in dest_ids:
+        name, country = destinations.names[dest_id], destinations.countries[dest_id]
+        label = f"{name} ({country})" if country else name
+        rows.append([InlineKeyboardButton(text=label, callback_data=f"dest:pick:{dest_id}")])
+    rows.append([InlineKeyboardButton(text="✍️ Оставить как написано", callback_data="dest:keep")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@lru_cache(maxsize=None)
+def app_confirm_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="📨 Отправить заявку", callback_data="app:send"),
+            ],
+            [
+                InlineKeyboardButton(text="🔁 Заполнить заново", callback_data="app:restart"),
+            ],
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def user_after_status_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="🏖 Новая заявка", callback_data="user:newapp"),
+            ],
+            [
+                InlineKeyboardButton(text="🆘 Связаться с менеджером", callback_data="user:contact"),
+            ],
+        ]
+    )
+
+
+def repeat_confirm_kb(app_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="📨 Повторить эту заявку",
+                    callback_data=f"rep:send:{app_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="❌ Отмена",
+                    callback_data="rep:cancel",
+                )
+            ],
+        ]
+    )
+
+
+def review_prompt_kb(app_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="⭐ Оставить отзыв",
+                    callback_data=f"rev:start:{app_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="⏭ Пропустить",
+                    callback_data="rev:skip",
+                )
+            ],
+        ]
+    )
+
+
+def review_stars_kb(app_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text=f"{i} ⭐", callback_data=f"rev:rate:{app_id}:{i}")
+                for i in range(1, 6)
+            ]
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def form_reminder_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="🔄 Начать заново", callback_data="app:restart"),
+                InlineKeyboardButton(text="✖️ Отменить", callback_data="app:cancel"),
+            ],
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def review_text_options_kb(with_photos: bool = False) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✅ Опубликовать без текста" if with_photos else "✨ Только оценка (без текста)",
+                    callback_data="rev:notext",
+                )
+            ],
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def broadcast_confirm_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="📣 Разослать всем", callback_data="bc:go"),
+            ],
+            [
+                InlineKeyboardButton(text="❌ Отмена", callback_data="bc:cancel"),
+            ],
+        ]
+    )
+
+
+def broadcast_stop_kb(broadcast_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="⏹ Остановить", callback_data=f"bc:stop:{broadcast_id}"
+                ),
+            ],
+        ]
+    )
+
+
+def stars_row(n: int) -> str:
+    n = max(1, min(5, n))
+    return "⭐" * n + "☆" * (5 - n)
+
+
+def review_page_suffix(before_id: Optional[int]) -> str:
+    """Хвост callback_data карточки отзыва: страница списка, с которой её открыли (пусто — первая)."""
+    return "" if before_id is None else f":{before_id}"
+
+
+def admin_reviews_list_kb(
+    rows: List[sqlite3.Row], next_before: Optional[int] = None, before_id: Optional[int] = None
+) -> InlineKeyboardMarkup:
+    page = review_page_suffix(before_id)
+    lines: List[List[InlineKeyboardButton]] = []
+    row: List[InlineKeyboardButton] = []
+    for r in rows:
+        row.append(
+            InlineKeyboardButton(
+                text=f"#{r['id']} · {r['stars']}⭐",
+                callback_data=f"admrev:open:{r['id']}{page}",
+            )
+        )
+        if len(row) >= 3:
+            lines.append(row)
+            row = []
+    if row:
+        lines.append(row)
+    nav: List[InlineKeyboardButton] = []
+    if before_id is not None:
+        nav.append(InlineKeyboardButton(text="⏮ Сначала", callback_data="admrev:list"))
+    if next_before is not None:
+        nav.append(InlineKeyboardButton(text="Дальше ▶️", callback_data=f"admrev:list:{next_before}"))
+    if nav:
+        lines.append(nav)
+    lines.append(
+        [InlineKeyboardButton(text="⬅️ В админ‑панель", callback_data="admrev:panel")]
+    )
+    return InlineKeyboardMarkup(inline_keyboard=lines)
+
+
+def admin_review_manage_kb(
+    review_id: int, photos: int = 0, before_id: Optional[int] = None
+) -> InlineKeyboardMarkup:
+    # страницу списка (before_id) передаём во все кнопки карточки — к ней вернёт «К списку отзывов»
+    page = review_page_suffix(before_id)
+    star_row = [
+        InlineKeyboardButton(text=f"{i}⭐", callback_data=f"admrev:star:{review_id}:{i}{page}")
+        for i in range(1, 6)
+    ]
+    photo_row = [
+        InlineKeyboardButton(text=f"📷 Фото ({photos})", callback_data=f"admrev:photos:{review_id}"),
+        InlineKeyboardButton(text="🗑 Убрать фото", callback_data=f"admrev:delphotos:{review_id}{page}"),
+    ]
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✏️ Изменить текст",
+                    callback_data=f"admrev:edittext:{review_id}{page}",
+                )
+            ],
+            star_row[:3],
+            star_row[3:],
+            *([photo_row] if photos else []),
+            [
+                InlineKeyboardButton(
+                    text="🗑 Удалить",
+                    callback_data=f"admrev:delask:{review_id}{page}",
+                )
+            ],
+            [
+                InlineKeyboardButton(text="📋 К списку отзывов", callback_data=f"admrev:list{page}"),
+            ],
+            [
+                InlineKeyboardButton(text="⬅️ В админ‑панель", callback_data="admrev:panel"),
+            ],
+        ]
+    )
+
+
+def admin_review_back_kb(review_id: int, before_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    page = review_page_suffix(before_id)
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="↩️ Отмена", callback_data=f"admrev:open:{review_id}{page}")],
+        ]
+    )
+
+
+def admin_review_delete_confirm_kb(review_id: int, before_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    page = review_page_suffix(before_id)
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✅ Да, удалить",
+                    callback_data=f"admrev:delyes:{review_id}{page}",
+                ),
+                InlineKeyboardButton(
+                    text="↩️ Отмена",
+                    callback_data=f"admrev:open:{review_id}{page}",
+                ),
+            ],
+        ]
+    )
+
+
+def format_public_reviews_block(rows: List[sqlite3.Row]) -> str:
+    if not rows:
+        return (
+            "⭐️ <b>Отзывы клиентов</b>\n\n"
+            "Пока отзывов нет. После отправки заявки бот предложит оставить оценку."
+        )
+    head = "⭐️ <b>Отзывы клиентов Anex</b>\n━━━━━━━━━━━━━━━━━━━━\n\n"
+    reserve = 120
+    max_len = 4096
+    parts: List[str] = []
+    pos = 0
+    total = len(head)
+    while pos < len(rows) and total < max_len - reserve:
+        r = rows[pos]
+        block = T_PUBLIC_REVIEW.render(
+            review_id=r["id"],
+            stars=stars_row(int(r["stars"])),
+            photos=Markup(f"  📷 {r['photos']}") if r["photos"] else Markup(),
+            who=review_author(r),
+            body=r["body"] or NO_REVIEW_TEXT,
+        )
+        sep = "\n\n" if parts else ""
+        if total + len(sep) + len(block) > max_len - reserve:
+            break
+        parts.append(block)
+        total += len(sep) + len(block)
+        pos += 1
+    text = head + "\n\n".join(parts)
+    rest = len(rows) - pos
+    if rest > 0:
+        text += f"\n\n<i>… и ещё {rest} отзыв(ов) — сообщение ограничено длиной Telegram.</i>"
+    return text
+
+
+def review_author(r: sqlite3.Row) -> str:
+    return r["first_name"] or (f"@{r['username']}" if r["username"] else "Клиент")
+
+
+def format_admin_review_caption(r: sqlite3.Row) -> str:
+    return T_ADMIN_REVIEW_CAPTION.render(
+        review_id=r["id"],
+        application_id=r["application_id"],
+        who=review_author(r),
+        tg_id=r["tg_id"],
+        stars=stars_row(int(r["stars"])),
+        photos=r["photos"],
+        body=r["body"] or "—",
+        created_at=r["created_at"],
+    )
+
+
+class ReviewFeed:
+    """Лента «⭐ Отзывы клиентов»: текст и альбом фото, общие для всех зрителей.
+
+    Собирается из базы не чаще раза в ttl секунд; правки отзывов в этом процессе
+    сбрасывают её сразу (invalidate), в остальных — не позже чем через ttl.
+    Фото уходят по сохранённым file_id: Telegram не скачивает и не загружает их заново.
+    """
+
+    def __init__(self, storage: Storage, ttl: float):
+        self.storage = storage
+        self.ttl = ttl
+        self.text = ""
+        self.media: List[InputMediaPhoto] = []
+        self._built_at: Optional[float] = None
+
+    def invalidate(self) -> None:
+        self._built_at = None
+
+    async def get(self) -> Tuple[str, List[InputMediaPhoto]]:
+        now = time.monotonic()
+        if self._built_at is None or now - self._built_at >= self.ttl:
+            rows = await self.storage.aio.list_reviews_newest_first(limit=200)
+            self.text = format_public_reviews_block(rows)
+            photos = await self.storage.aio.latest_review_photos(REVIEW_FEED_PHOTOS, REVIEW_FEED_PHOTOS_PER_REVIEW)
+            self.media = [
+                InputMediaPhoto(media=p["file_id"], caption=f"#{p['review_id']} {stars_row(int(p['stars']))}")
+                for p in photos
+            ]
+            self._built_at = now
+        return self.text, self.media
+
+
+# ------------------------ ЭКСПОРТ -------------------------
+
+EXPORT_TABLES = ("applications", "users", "reviews")
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def export_table(storage: Storage, table: str, fmt: str, out_path: str, compress: bool = False) -> int:
+    """Потоково выгружает таблицу в CSV/JSONL. Возвращает число строк.
+
+    Читает кусками EXPORT_CHUNK_SIZE (Storage.export_chunks), поэтому память
+    не зависит от размера таблицы, а запись бота не блокируется.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"unknown table: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+
+    columns, chunks = storage.export_chunks(table, EXPORT_CHUNK_SIZE)
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(out_path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(columns)
+        for chunk in chunks:
+            if writer:
+                writer.writerows(chunk)
+            else:
+                f.writelines(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+                    for row in chunk
+                )
+            count += len(chunk)
+    return count
+
+
+# ------------------ ОГРАНИЧЕНИЕ СКОРОСТИ ------------------
+
+
+class RateLimiter:
+    """Token bucket: не больше rate отправок в секунду на весь процесс."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated: Optional[float] = None
+        self._lock = asyncio.Lock()
+        # сколько отправок сейчас ждут токена (для /stats)
+        self.waiting = 0
+
+    async def acquire(self) -> None:
+        self.waiting += 1
+        try:
+            await self._acquire()
+        finally:
+            self.waiting -= 1
+
+    async def _acquire(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    self._tokens = min(
+                        self.capacity, self._tokens + (now - self._updated) * self.rate
+                    )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ------------------------- SLA ----------------------------
+
+
+class SlaScheduler:
+    """Таймеры эскалации для заявок в статусе «new».
+
+    Куча (срок, id заявки, уровень) плюс словарь актуального срока по заявке:
+    смена статуса лишь убирает заявку из словаря, а устаревшая запись кучи
+    выбрасывается, когда до неё дойдёт очередь. База не опрашивается —
+    задача спит до ближайшего срока.
+    """
+
+    def __init__(self, thresholds_minutes: Tuple[int, ...]):
+        self.thresholds = [m * 60 for m in sorted(thresholds_minutes)]
+        self.heap: List[Tuple[float, int, int]] = []
+        self.due: Dict[int, Tuple[float, int]] = {}
+        self.created: Dict[int, float] = {}
+        self.running = False
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, app_id: int, created_ts: float, level: int) -> None:
+        if level >= len(self.thresholds):
+            self.cancel(app_id)
+            return
+        at = created_ts + self.thresholds[level]
+        self.due[app_id] = (at, level)
+        self.created[app_id] = created_ts
+        heapq.heappush(self.heap, (at, app_id, level))
+        if self.heap[0][1] == app_id:
+            self._wakeup.set()
+
+    def cancel(self, app_id: int) -> None:
+        self.due.pop(app_id, None)
+        self.created.pop(app_id, None)
+
+    def on_application(self, app_id: int, status: str) -> None:
+        # до запуска таймеров события не нужны: при старте всё читается из базы
+        if not self.running:
+            return
+        if status == "new":
+            self.schedule(app_id, time.time(), 0)
+        else:
+            self.cancel(app_id)
+
+    async def run(
+        self,
+        pending: List[sqlite3.Row],
+        escalate: Callable[[int, int, float], Coroutine[Any, Any, bool]],
+    ) -> None:
+        """escalate(id, уровень, created_ts) -> True, если заявка всё ещё ждёт ответа."""
+        self.running = True
+        for r in pending:
+            self.schedule(r["id"], r["created_ts"], r["sla_level"])
+        try:
+            while True:
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    at, app_id, level = heapq.heappop(self.heap)
+                    if self.due.get(app_id) != (at, level):
+                        continue
+                    created_ts = self.created[app_id]
+                    self.cancel(app_id)
+                    try:
+                        still_new = await escalate(app_id, level, created_ts)
+                    except Exception:
+                        logger.exception("SLA escalation failed for application %s", app_id)
+                        still_new = False
+                    if still_new and app_id not in self.due:
+                        self.schedule(app_id, created_ts, level + 1)
+                self._wakeup.clear()
+                timeout = self.heap[0][0] - time.time() if self.heap else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.running = False
+
+
+# ----------------- НЕЗАВЕРШЁННЫЕ АНКЕТЫ ------------------
+
+
+class TimerWheel:
+    """Хешированное колесо таймеров: слот на каждые tick секунд, в слоте — множество ключей.
+
+    Добавление, перенос и удаление — O(1); сдвиг колеса трогает только
+    сработавшие ключи. Сроки не должны быть дальше span секунд вперёд.
+    """
+
+    def __init__(self, tick: float, span: float):
+        self.tick = tick
+        self.slots: List[set] = [set() for _ in range(int(span // tick) + 2)]
+        self.slot_of: Dict[Any, int] = {}
+        self.cursor = int(time.time() // tick)
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    def add(self, key: Any, at: float) -> None:
+        self.remove(key)
+        t = max(-int(-at // self.tick), self.cursor + 1)
+        slot = t % len(self.slots)
+        self.slots[slot].add(key)
+        self.slot_of[key] = slot
+
+    def remove(self, key: Any) -> None:
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].discard(key)
+
+    def advance(self, now: float) -> List[Any]:
+        due: List[Any] = []
+        target = int(now // self.tick)
+        while self.cursor < target:
+            self.cursor += 1
+            slot = self.cursor % len(self.slots)
+            keys = self.slots[slot]
+            if keys:
+                self.slots[slot] = set()
+                for key in keys:
+                    del self.slot_of[key]
+                due.extend(keys)
+        return due
+
+
+class FormInactivity:
+    """Последняя активность пользователей, застрявших в анкете.
+
+    Ключ — (chat_id, user_id): кортеж хешируется быстрее StorageKey.
+    touch() вызывается после каждого шага, forget() — когда анкета
+    закрыта. due() отдаёт (ключ, этап, "remind" | "expire") для тех, кто
+    молчит дольше remind_after / expire_after секунд.
+    """
+
+    def __init__(self, remind_after: float, expire_after: float, tick: float):
+        self.remind_after = remind_after
+        self.expire_after = expire_after
+        self.wheel = TimerWheel(tick, max(remind_after, expire_after))
+        # ключ FSM -> (время последнего шага, этап, напоминание уже было)
+        self.sessions: Dict[Tuple[int, int], Tuple[float, str, bool]] = {}
+
+    def touch(self, key: Tuple[int, int], stage: str) -> None:
+        now = time.time()
+        self.sessions[key] = (now, stage, False)
+        self.wheel.add(key, now + self.remind_after)
+
+    def forget(self, key: Tuple[int, int]) -> None:
+        if self.sessions.pop(key, None) is not None:
+            self.wheel.remove(key)
+
+    def due(self, now: Optional[float] = None) -> List[Tuple[Tuple[int, int], str, str]]:
+        out = []
+        for key in self.wheel.advance(time.time() if now is None else now):
+            last, stage, reminded = self.sessions[key]
+            if not reminded and self.remind_after < self.expire_after:
+                self.sessions[key] = (last, stage, True)
+                self.wheel.add(key, last + self.expire_after)
+                out.append((key, stage, "remind"))
+            else:
+                del self.sessions[key]
+                out.append((key, stage, "expire"))
+        return out
+
+
+# ----------------------- АНАЛИТИКА ------------------------
+
+# шаги анкеты в порядке прохождения: start — вход в анкету, sent — заявка отправлена
+FUNNEL_STEPS = (
+    ("start", "Начали анкету"),
+    ("destination", "Направление"),
+    ("dates", "Даты"),
+    ("adults", "Взрослые"),
+    ("children", "Дети"),
+    ("budget", "Бюджет"),
+    ("wishes", "Пожелания"),
+    ("contact", "Контакт"),
+    ("sent", "Отправили заявку"),
+)
+# ошибки ввода на шагах
+FUNNEL_REJECTS = (
+    ("reject:adults", "взрослые"),
+    ("reject:children", "дети"),
+    ("reject:contact", "телефон"),
+)
+
+
+class FunnelCounters:
+    """Счётчики воронки в памяти: (номер корзины, событие) -> количество.
+
+    hit() — единственное, что делает обработчик; в базу счётчики уходят
+    пачкой из фоновой задачи.
+    """
+
+    def __init__(self, bucket_seconds: int):
+        self.bucket_seconds = bucket_seconds
+        self.counts: Counter = Counter()
+
+    def hit(self, event: str) -> None:
+        self.counts[(int(time.time()) // self.bucket_seconds, event)] += 1
+
+    def drain(self) -> Counter:
+        counts, self.counts = self.counts, Counter()
+        return counts
+
+    def rows(self, counts: Counter) -> List[Tuple[str, str, int]]:
+        return [
+            (
+                datetime.utcfromtimestamp(bucket * self.bucket_seconds).isoformat(timespec="seconds"),
+                event,
+                n,
+            )
+            for (bucket, event), n in counts.items()
+        ]
+
+
+# ----------------------- МОНИТОРИНГ -----------------------
+
+
+class LoopMonitor:
+    """Задержка цикла событий, обработчики в работе и сторож блокировок.
+
+    Корутина run() просыпается каждые interval секунд и записывает, насколько
+    проснулась позже срока. Поток‑сторож следит за её пульсом: если цикл не
+    отвечает дольше block_threshold, в лог пишется стек потока цикла — то
+    место, где его держит синхронный вызов.
+    """
+
+    def __init__(self, interval: float, block_threshold: float):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        # задержки за последнюю минуту
+        self.lags: deque = deque(maxlen=max(1, int(60 / interval)))
+        self.max_lag = 0.0
+        self.blocks = 0
+        self.handlers_in_flight = 0
+        self.handlers_peak = 0
+        self.handled = 0
+        # хэндлеры, отменённые по сроку: имя -> сколько раз
+        self.timeouts: Counter = Counter()
+        self.started_at = time.time()
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+
+    def handler_started(self) -> None:
+        self.handlers_in_flight += 1
+        self.handlers_peak = max(self.handlers_peak, self.handlers_in_flight)
+
+    def handler_finished(self) -> None:
+        self.handlers_in_flight -= 1
+        self.handled += 1
+
+    def handler_timed_out(self, name: str) -> None:
+        self.timeouts[name] += 1
+
+    def lag_percentiles(self) -> Tuple[float, float, float]:
+        """p50, p99 и максимум задержки за последнюю минуту, в секундах."""
+        lags = sorted(self.lags)
+        if not lags:
+            return 0.0, 0.0, 0.0
+        return lags[len(lags) // 2], lags[min(len(lags) - 1, int(len(lags) * 0.99))], lags[-1]
+
+    async def run(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                started = time.monotonic()
+                self._beat = started
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.monotonic() - started - self.interval)
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+        finally:
+            self._stop.set()
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.block_threshold or reported == beat:
+                continue
+            # один отчёт на одну остановку цикла
+            reported = beat
+            self.blocks += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(нет кадра)"
+            logger.warning("Event loop blocked for %.0f ms, loop thread stack:\n%s", stalled * 1000, stack)
+
+
+# ------------------------ РАНТАЙМ -------------------------
+
+
+def json_codec() -> Tuple[Callable[..., Any], Callable[..., str]]:
+    if PERF_RUNTIME:
+        try:
+            import orjson
+        except ImportError:
+            logger.warning("BOT_PERF_RUNTIME: orjson is not installed, using json")
+        else:
+            return orjson.loads, lambda obj: orjson.dumps(obj).decode()
+    return json.loads, json.dumps
+
+
+def run_async(coro: Coroutine) -> Any:
+    # aiogram сам ставит политику uvloop, если тот установлен, поэтому цикл
+    # выбирается явно: без BOT_PERF_RUNTIME — всегда стандартный asyncio
+    loop_factory = asyncio.SelectorEventLoop
+    if PERF_RUNTIME:
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("BOT_PERF_RUNTIME: uvloop is not installed, using asyncio loop")
+        else:
+            loop_factory = uvloop.new_event_loop
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        return runner.run(coro)
+
+
+class BotSession(AiohttpSession):
+    """Сессия Bot API с настраиваемым пулом соединений.
+
+    Ограничивает число одновременных запросов семафором (getUpdates в нём
+    не участвует), подставляет таймаут по методу и считает, сколько
+    запросов ушло по уже открытому соединению, а сколько открыли новое.
+    HTTP‑сессию создаёт сама через публичный API aiohttp — внутренние поля
+    AiohttpSession (коннектор, _session) не используются.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = HTTP_POOL_SIZE,
+        max_concurrency: int = HTTP_MAX_CONCURRENCY,
+        keepalive: float = HTTP_KEEPALIVE_SECONDS,
+        dns_cache: int = HTTP_DNS_CACHE_SECONDS,
+        method_timeouts: Optional[Dict[str, float]] = None,
+        **kwargs: Any,
+    ):
+        kwargs.setdefault("timeout", HTTP_TIMEOUT_SECONDS)
+        super().__init__(**kwargs)
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.dns_cache = dns_cache
+        self.http: Optional[aiohttp.ClientSession] = None
+        self.method_timeouts = dict(HTTP_METHOD_TIMEOUTS if method_timeouts is None else method_timeouts)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # запросы в полёте и ожидающие места в семафоре (без getUpdates)
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "pool_waits": 0,
+            "semaphore_waits": 0,
+            "timeouts": 0,
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        stats = self.stats
+
+        def counter(key: str):
+            async def on_event(session, ctx, params) -> None:
+                stats[key] += 1
+            return on_event
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(counter("requests"))
+        trace.on_connection_create_end.append(counter("connections_created"))
+        trace.on_connection_reuseconn.append(counter("connections_reused"))
+        trace.on_connection_queued_start.append(counter("pool_waits"))
+        return trace
+
+    async def create_session(self) -> aiohttp.ClientSession:
+        if self.http is None or self.http.closed:
+            self.http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    ssl=ssl.create_default_context(cafile=certifi.where()),
+                    limit=self.pool_size,
+                    keepalive_timeout=self.keepalive,
+                    ttl_dns_cache=self.dns_cache,
+                    use_dns_cache=True,
+                ),
+                headers={"User-Agent": f"aiogram/{aiogram.__version__}"},
+                trace_configs=[self._trace_config()],
+            )
+        return self.http
+
+    async def close(self) -> None:
+        if self.http is not None and not self.http.closed:
+            await self.http.close()
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        name = method.__api_method__
+        if timeout is None:
+            timeout = self.method_timeouts.get(name, self.timeout)
+        if name == "getUpdates":
+            return await super().make_request(bot, method, timeout)
+        if self.semaphore.locked():
+            self.stats["semaphore_waits"] += 1
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            return await super().make_request(bot, method, timeout)
+        except TelegramNetworkError as e:
+            if "timeout" in e.message.lower():
+                self.stats["timeouts"] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def reuse_ratio(self) -> float:
+        total = self.stats["connections_created"] + self.stats["connections_reused"]
+        return self.stats["connections_reused"] / total if total else 0.0
+
+
+def make_session() -> BotSession:
+    json_loads, json_dumps = json_codec()
+    kwargs = {"json_loads": json_loads, "json_dumps": json_dumps}
+    if BOT_API_URL:
+        kwargs["api"] = TelegramAPIServer.from_base(BOT_API_URL)
+    return BotSession(**kwargs)
+
+
+# ---------------------- ИНИЦИАЛИЗАЦИЯ ---------------------
+
+bot = Bot(
+    token=BOT_TOKEN,
+    session=make_session(),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+)
+dp = Dispatcher(storage=MemoryStorage())
+router = Router()
+admin_router = Router()
+
+send_limiter = RateLimiter(SEND_RATE_PER_SECOND)
+
+funnel = FunnelCounters(FUNNEL_BUCKET_SECONDS)
+
+monitor = LoopMonitor(LOOP_LAG_INTERVAL_SECONDS, LOOP_BLOCK_THRESHOLD_SECONDS)
+
+forms = FormInactivity(
+    FORM_REMIND_AFTER_HOURS * 3600, FORM_EXPIRE_AFTER_HOURS * 3600, FORM_TIMER_TICK_SECONDS
+)
+
+sla = SlaScheduler(SLA_ESCALATION_MINUTES)
+db.application_listeners.append(sla.on_application)
+
+destinations = DestinationIndex()
+db.add_destinations(
+    [(name, country, "|".join(aliases), "bundled") for name, country, aliases in BUNDLED_DESTINATIONS]
+)
+destinations.load(db.list_destinations())
+
+review_feed = ReviewFeed(db, REVIEW_FEED_TTL_SECONDS)
+
+
+def is_admin(tg_id: int) -> bool:
+    return tg_id in ADMINS
+
+
+# ------------------------- ХЭНДЛЕРЫ -----------------------
+
+# состояния, по которым следим за бездействием; остальные этапы задаются флагом form_stage —
+# хэндлер с флагом возвращает True, когда этап действительно начат (отказ ничего не меняет)
+TRACKED_FORM_STATES = {s.state for s in AppForm.__all_states__} | {ReviewForm.waiting_text.state}
+
+
+@dp.update.outer_middleware()
+async def count_handlers(handler, event, data):
+    monitor.handler_started()
+    try:
+        return await handler(event, data)
+    finally:
+        monitor.handler_finished()
+
+
+@router.message.middleware()
+@router.callback_query.middleware()
+async def track_form_activity(handler, event, data):
+    result = await handler(event, data)
+    state: Optional[FSMContext] = data.get("state")
+    if state is not None:
+        current = await state.get_state()
+        flagged = get_flag(data, "form_stage")
+        key = (state.key.chat_id, state.key.user_id)
+        if current in TRACKED_FORM_STATES:
+            forms.touch(key, current)
+        elif flagged:
+            if result is True:
+                forms.touch(key, flagged)
+        else:
+            forms.forget(key)
+    return result
+
+
+@router.message.middleware()
+@router.callback_query.middleware()
+@admin_router.message.middleware()
+@admin_router.callback_query.middleware()
+async def enforce_deadline(handler, event, data):
+    name = data["handler"].callback.__name__
+    deadline = HANDLER_DEADLINES.get(name, HANDLER_DEADLINE_SECONDS)
+    if deadline is None:
+        return await handler(event, data)
+    try:
+        async with asyncio.timeout(deadline) as limit:
+            return await handler(event, data)
+    except TimeoutError:
+        # таймаут внутри хэндлера (например, запроса к Bot API) — не наш срок
+        if not limit.expired():
+            raise
+    monitor.handler_timed_out(name)
+    logger.warning("Handler %s cancelled after %.1f s deadline", name, deadline)
+    # FSM‑состояние не трогаем: повтор того же сообщения попадёт в тот же шаг. Хэндлеры,
+    # которые пишут в базу, отдают в run_followup саму запись или всё после неё — его срок
+    # не обрывает, так что «попробуйте ещё раз» приходит только до записи
+    try:
+        async with asyncio.timeout(HANDLER_TIMEOUT_NOTICE_SECONDS):
+            if isinstance(event, CallbackQuery):
+                await event.answer(TEXT_HANDLER_TIMEOUT, show_alert=True)
+            else:
+                await event.answer(TEXT_HANDLER_TIMEOUT)
+    except Exception:
+        pass
+    return None
+
+
+# уведомления после записи в базу: отдельные задачи вне срока хэндлера
+# (ссылки держим, чтобы задачи не собрал GC)
+followup_tasks: Set[asyncio.Task] = set()
+
+
+def followup_done(task: asyncio.Task) -> None:
+    followup_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Follow-up task failed", exc_info=task.exception())
+
+
+def run_followup(coro: Coroutine) -> None:
+    task = asyncio.create_task(coro)
+    followup_tasks.add(task)
+    task.add_done_callback(followup_done)
+
+
+@router.message(CommandStart())
+async def cmd_start(message: Message, state: FSMContext):
+    await state.clear()
+    user_id = await db.aio.get_or_create_user(
+        message.from_user.id, message.from_user.username, message.from_user.first_name
+    )
+    _ = user_id
+    kb = main_menu_kb(is_admin=is_admin(message.from_user.id))
+    await message.answer(TEXT_WELCOME, reply_markup=kb)
+
+
+# ---------- Пользовательское меню: заявка ----------
+
+
+@router.message(StateFilter(None), F.text == "🏖 Подобрать тур")
+async def start_app_form(message: Message, state: FSMContext):
+    funnel.hit("start")
+    await state.clear()
+    await state.set_state(AppForm.destination)
+    await message.answer(TEXT_STEP_DESTINATION)
+
+
+@router.message(AppForm.destination)
+async def app_destination(message: Message, state: FSMContext):
+    text = message.text.strip()
+    dest_id = destinations.exact(text)
+    if dest_id is not None:
+        # «турция », «Turkey» → «Турция»
+        await choose_destination(message, state, destinations.names[dest_id], dest_id)
+        return
+    dest_id = destinations.match(text)
+    if dest_id is not None:
+        # «Турция, Анталия» — текст клиента оставляем, направление запоминаем
+        await choose_destination(message, state, text, dest_id)
+        return
+    options = destinations.suggest(text)
+    if not options:
+        await choose_destination(message, state, text, None)
+        return
+    funnel.hit("destination:suggest")
+    await state.update_data(dest_text=text)
+    await message.answer(T_DEST_SUGGEST.render(text=text), reply_markup=destination_suggest_kb(options))
+
+
+async def choose_destination(
+    message: Message, state: FSMContext, destination: str, dest_id: Optional[int]
+) -> None:
+    await state.update_data(destination=destination, destination_id=dest_id)
+    await state.set_state(AppForm.dates)
+    funnel.hit("destination")
+    await message.answer(TEXT_STEP_DATES)
+
+
+@router.callback_query(AppForm.destination, F.data.startswith("dest:"))
+async def app_destination_choice(callback: CallbackQuery, state: FSMContext):
+    if callback.data == "dest:keep":
+        text = (await state.get_data()).get("dest_text")
+        dest_id = None
+    else:
+        dest_id = int(callback.data.split(":")[2])
+        text = destinations.names.get(dest_id)
+    if not text:
+        await callback.answer()
+        return
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await choose_destination(callback.message, state, text, dest_id)
+    await callback.answer()
+
+
+@router.message(AppForm.dates)
+async def app_dates(message: Message, state: FSMContext):
+    await state.update_data(dates=message.text.strip())
+    await state.set_state(AppForm.adults)
+    funnel.hit("dates")
+    await message.answer(TEXT_STEP_ADULTS)
+
+
+@router.message(AppForm.adults)
+async def app_adults(message: Message, state: FSMContext):
+    text = message.text.strip()
+    if not text.isdigit() or int(text) <= 0:
+        funnel.hit("reject:adults")
+        await message.answer("Пожалуйста, введите положительное число.")
+        return
+    await state.update_data(adults=int(text))
+    await state.set_state(AppForm.children)
+    funnel.hit("adults")
+    await message.answer(TEXT_STEP_CHILDREN)
+
+
+@router.message(AppForm.children)
+async def app_children(message: Message, state: FSMContext):
+    text = message.text.strip()
+    if not text.isdigit() or int(text) < 0:
+        funnel.hit("reject:children")
+        await message.answer("Пожалуйста, введите 0 или положительное число.")
+        return
+    await state.update_data(children=int(text))
+    await state.set_state(AppForm.budget)
+    funnel.hit("children")
+    await message.answer(TEXT_STEP_BUDGET)
+
+
+@router.message(AppForm.budget)
+async def app_budget(message: Message, state: FSMContext):
+    await state.update_data(budget=message.text.strip())
+    await state.set_state(AppForm.wishes)
+    funnel.hit("budget")
+    await message.answer(TEXT_STEP_WISHES)
+
+
+@router.message(AppForm.wishes)
+async def app_wishes(message: Message, state: FSMContext):
+    await state.update_data(wishes=message.text.strip())
+    await state.set_state(AppForm.contact)
+    funnel.hit("wishes")
+    default_contact = (
+        f"@{message.from_user.username}" if message.from_user.username else ""
+    )
+    await message.answer(T_STEP_CONTACT.render(default_contact=default_contact))
+
+
+@router.message(AppForm.contact)
+async def app_contact(message: Message, state: FSMContext):
+    contact = message.text.strip()
+
+    # Допускаем только номера РФ: +7XXXXXXXXXX или 8XXXXXXXXXX (ровно 11 цифр).
+    if normalize_phone(contact) is None:
+        funnel.hit("reject:contact")
+        await message.answer(
+            "Пожалуйста, укажите корректный номер телефона РФ.\n"
+            "Пример: <b>+79991234567</b> или <b>89991234567</b>."
+        )
+        return
+    await state.update_data(contact=contact)
+
+    data = await state.get_data()
+    required_keys = ["destination", "dates", "adults", "children", "budget", "wishes", "contact"]
+    if not all(k in data for k in required_keys):
+        await message.answer(
+            "Произошла ошибка при сохранении заявки. "
+            "Пожалуйста, начните оформление заново."
+        )
+        await state.clear()
+        await start_app_form(message, state)
+        return
+
+    await state.set_state(AppForm.confirm)
+    funnel.hit("contact")
+    await message.answer(T_APP_CONFIRM.render(**app_fields(data)), reply_markup=app_confirm_kb())
+
+
+@router.callback_query(F.data == "app:restart")
+async def app_restart(callback: CallbackQuery, state: FSMContext):
+    funnel.hit("restart")
+    await state.clear()
+    await state.set_state(AppForm.destination)
+    await callback.message.answer("Начнём заново.\n\n" + TEXT_STEP_DESTINATION)
+    await callback.answer()
+
+
+@router.callback_query(F.data == "app:cancel")
+async def app_cancel(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await callback.message.answer(
+        "Анкета отменена. Вернуться к подбору можно в любой момент.",
+        reply_markup=main_menu_kb(is_admin=is_admin(callback.from_user.id)),
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "app:send")
+async def app_send(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    required_keys = ["destination", "dates", "adults", "children", "budget", "wishes", "contact"]
+    if not all(k in data for k in required_keys):
+        await callback.message.answer(
+            "Произошла ошибка при сохранении заявки. "
+            "Пожалуйста, начните оформление заново через «🏖 Подобрать тур»."
+        )
+        await state.clear()
+        await callback.answer()
+        return
+
+    await state.clear()
+    # запись и всё после неё — вне срока хэндлера: срок не оборвёт записанную заявку
+    # и не предложит отправить её ещё раз
+    run_followup(submit_application(callback, data))
+
+
+async def submit_application(callback: CallbackQuery, data: Dict[str, Any]) -> None:
+    user_row = await db.aio.get_user_by_tg(callback.from_user.id)
+    if not user_row:
+        await db.aio.get_or_create_user(
+            callback.from_user.id, callback.from_user.username, callback.from_user.first_name
+        )
+        user_row = await db.aio.get_user_by_tg(callback.from_user.id)
+
+    app_id = await db.aio.create_application(user_row, data)
+    funnel.hit("sent")
+
+    try:
+        await callback.message.answer(
+            T_APP_SENT.render(app_id=app_id),
+            reply_markup=main_menu_kb(is_admin=is_admin(callback.from_user.id)),
+        )
+        await callback.message.answer(
+            "Хотите оставить короткий отзыв о сервисе?",
+            reply_markup=review_prompt_kb(app_id),
+        )
+        await callback.answer("Заявка отправлена")
+    except Exception:
+        pass
+
+    summary = T_ADMIN_NEW_APP.render(
+        app_id=app_id,
+        username=callback.from_user.username or "без_username",
+        tg_id=callback.from_user.id,
+        returning=await returning_client_note(app_id, data["contact"]),
+        **app_fields(data),
+    )
+    await notify_admins_new_app(app_id, summary)
+
+
+async def notify_admins_new_app(app_id: int, summary: str) -> None:
+    # id сообщений сохраняем, чтобы потом показать всем, кто взял заявку
+    sent: List[Tuple[int, int]] = []
+    for admin_id in ADMINS:
+        try:
+            msg = await bot.send_message(
+                admin_id,
+                summary,
+                reply_markup=app_manage_kb(app_id),
+            )
+            sent.append((admin_id, msg.message_id))
+        except Exception:
+            pass
+    if sent:
+        await db.aio.add_admin_notifications(app_id, sent)
+
+
+async def returning_client_note(app_id: int, contact: Optional[str]) -> Markup:
+    phone = normalize_phone(contact)
+    if phone is None:
+        return Markup()
+    previous = await db.aio.count_applications_by_phone(phone, before_id=app_id)
+    if not previous:
+        return Markup()
+    return Markup(T_RETURNING_CLIENT.render(count=previous))
+
+
+# ---------- Мои заявки ----------
+
+
+def human_status(code: str) -> str:
+    return {
+        "new": "🆕 Новая",
+        "in_progress": "⏳ В обработке",
+        "approved": "✅ Одобрена",
+        "rejected": "❌ Отклонённая",
+        "closed": "🗄 Закрыта",
+    }.get(code, code)
+
+
+@router.message(StateFilter(None), F.text == "📋 Мои заявки")
+async def my_apps(message: Message):
+    user = await db.aio.get_user_by_tg(message.from_user.id)
+    if not user:
+        await message.answer("Профиль не найден. Нажмите /start.")
+        return
+    apps = await db.aio.get_user_applications(user["id"], limit=20)
+    if not apps:
+        await message.answer(
+            "У вас пока нет заявок.\n"
+            "Нажмите «🏖 Подобрать тур», чтобы отправить первую."
+        )
+        return
+    lines = ["📋 <b>Ваши заявки:</b>\n"]
+    for a in apps:
+        lines.append(
+            T_MY_APPS_LINE.render(
+                app_id=a["id"],
+                status=human_status(a["status"]),
+                destination=a["destination"],
+                dates=a["dates"],
+                updated_at=a["updated_at"],
+            )
+        )
+    await message.answer("\n".join(lines))
+
+
+# ---------- Повторить последнюю заявку ----------
+
+
+@router.message(StateFilter(None), F.text == "🔁 Повторить заявку")
+async def repeat_last_app(message: Message):
+    user = await db.aio.get_user_by_tg(message.from_user.id)
+    if not user:
+        await message.answer("Профиль не найден. Нажмите /start.")
+        return
+    apps = await db.aio.get_user_applications(user["id"], limit=1)
+    if not apps:
+        await message.answer(
+            "У вас ещё нет заявок, чтобы их повторять.\n"
+            "Сначала отправьте первую через «🏖 Подобрать тур»."
+        )
+        return
+
+    a = apps[0]
+    text = T_REPEAT_LAST.render(app_id=a["id"], status=human_status(a["status"]), **app_fields(a))
+    await message.answer(text, reply_markup=repeat_confirm_kb(a["id"]))
+
+
+@router.callback_query(F.data.startswith("rep:send:"))
+async def repeat_send(callback: CallbackQuery, state: FSMContext):
+    app_id = int(callback.data.split(":")[2])
+    a = await db.aio.get_application(app_id)
+    if not a:
+        await callback.answer("Не удалось найти исходную заявку.", show_alert=True)
+        return
+
+    user = await db.aio.get_user_by_tg(a["tg_id"])
+    if not user:
+        await callback.answer("Профиль пользователя не найден.", show_alert=True)
+        return
+
+    # повторное нажатие (в том числе после «попробуйте ещё раз») не создаёт вторую копию:
+    # исходные заявки, которые уже повторены, помним в данных FSM
+    repeated = (await state.get_data()).get("repeated", {})
+    if str(app_id) in repeated:
+        new_app_id = repeated[str(app_id)]
+        await callback.answer(
+            f"Заявка №{app_id} уже повторена" + (f": №{new_app_id}." if new_app_id else "."),
+            show_alert=True,
+        )
+        return
+    await state.update_data(repeated=dict(repeated, **{str(app_id): None}))
+    run_followup(submit_repeat(callback, state, a, user))
+
+
+async def submit_repeat(callback: CallbackQuery, state: FSMContext, a: Any, user: Any) -> None:
+    app_id = a["id"]
+    data = app_fields(a)
+    try:
+        new_app_id = await db.aio.create_application(user, dict(data, destination_id=a["destination_id"]))
+    except Exception:
+        # заявка не записана — повтор снова разрешён
+        repeated = (await state.get_data()).get("repeated", {})
+        await state.update_data(repeated={k: v for k, v in repeated.items() if k != str(app_id)})
+        raise
+    repeated = (await state.get_data()).get("repeated", {})
+    await state.update_data(repeated=dict(repeated, **{str(app_id): new_app_id}))
+
+    try:
+        await callback.message.answer(
+            T_REPEAT_SENT.render(app_id=new_app_id, source_id=app_id),
+            reply_markup=main_menu_kb(is_admin=is_admin(callback.from_user.id)),
+        )
+        await callback.message.answer(
+            "Хотите оставить короткий отзыв о сервисе?",
+            reply_markup=review_prompt_kb(new_app_id),
+        )
+        await callback.answer("Заявка повторена")
+    except Exception:
+        pass
+
+    summary = T_ADMIN_REPEAT_APP.render(
+        app_id=new_app_id,
+        source_id=app_id,
+        username=user["username"] or "без_username",
+        tg_id=user["tg_id"],
+        returning=await returning_client_note(new_app_id, data["contact"]),
+        **data,
+    )
+    await notify_admins_new_app(new_app_id, summary)
+
+
+@router.callback_query(F.data == "rep:cancel")
+async def repeat_cancel(callback: CallbackQuery):
+    await callback.message.answer("Повтор заявки отменён.")
+    await callback.answer()
+
+
+# ---------- Отзывы (пользователь) ----------
+
+
+@router.callback_query(F.data == "rev:skip")
+async def rev_skip(callback: CallbackQuery):
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await callback.answer("Без проблем")
+
+
+@router.callback_query(F.data.startswith("rev:start:"), flags={"form_stage": "review:stars"})
+async def rev_start(callback: CallbackQuery, state: FSMContext):
+    app_id = int(callback.data.split(":")[2])
+    if await db.aio.review_for_application_exists(app_id):
+        await callback.answer("По этой заявке отзыв уже оставлен.", show_alert=True)
+        return
+    owner = await db.aio.get_application_tg_id(app_id)
+    if owner is None or owner != callback.from_user.id:
+        await callback.answer("Можно оставить отзыв только по своей заявке.", show_alert=True)
+        return
+    await state.clear()
+    # для напоминания, если оценку так и не поставят
+    await state.update_data(rev_app_id=app_id)
+    await callback.message.answer(
+        "Выберите оценку от 1 до 5:",
+        reply_markup=review_stars_kb(app_id),
+    )
+    await callback.answer()
+    return True
+
+
+@router.callback_query(F.data.startswith("rev:rate:"))
+async def rev_rate(callback: CallbackQuery, state: FSMContext):
+    parts = callback.data.split(":")
+    app_id = int(parts[2])
+    stars = int(parts[3])
+    if stars < 1 or stars > 5:
+        await callback.answer()
+        return
+    if await db.aio.review_for_application_exists(app_id):
+        await callback.answer("По этой заявке отзыв уже есть.", show_alert=True)
+        return
+    owner = await db.aio.get_application_tg_id(app_id)
+    if owner is None or owner != callback.from_user.id:
+        await callback.answer("Это не ваша заявка.", show_alert=True)
+        return
+    await state.set_state(ReviewForm.waiting_text)
+    await state.update_data(rev_app_id=app_id, rev_stars=stars)
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await callback.message.answer(
+        f"Оценка: {stars_row(stars)}\n\n"
+        "Напишите текст отзыва одним сообщением — можно приложить фото "
+        f"(до {REVIEW_MAX_PHOTOS}) — или нажмите кнопку ниже, если достаточно только оценки.",
+        reply_markup=review_text_options_kb(),
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "rev:notext")
+async def rev_notext(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    app_id = data.get("rev_app_id")
+    stars = data.get("rev_stars")
+    if app_id is None or stars is None:
+        await callback.answer("Сначала выберите оценку звёздами.", show_alert=True)
+        return
+    if await db.aio.review_for_application_exists(app_id):
+        await state.clear()
+        await callback.answer("Отзыв уже сохранён.", show_alert=True)
+        return
+    owner = await db.aio.get_application_tg_id(app_id)
+    if owner is None or owner != callback.from_user.id:
+        await state.clear()
+        await callback.answer("Ошибка доступа.", show_alert=True)
+        return
+    try:
+        await db.aio.create_review(
+            app_id,
+            callback.from_user.id,
+            callback.from_user.username,
+            callback.from_user.first_name,
+            int(stars),
+            data.get("rev_caption"),
+            data.get("rev_photos", []),
+        )
+    except db.IntegrityError:
+        await state.clear()
+        await callback.answer("Отзыв уже был сохранён.", show_alert=True)
+        return
+    await state.clear()
+    review_feed.invalidate()
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await callback.answer("Спасибо!")
+    await callback.message.answer("✅ Спасибо за отзыв! Он появится в разделе «⭐ Отзывы клиентов».")
+
+
+@router.message(ReviewForm.waiting_text, F.photo)
+async def rev_photo(message: Message, state: FSMContext):
+    # фото копятся в данных FSM до текста или «Опубликовать»; альбом приходит
+    # отдельными сообщениями с общим media_group_id — отвечаем на него один раз
+    data = await state.get_data()
+    if data.get("rev_app_id") is None or data.get("rev_stars") is None:
+        await state.clear()
+        await message.answer("Сессия отзыва сброшена. Начните с кнопки под заявкой.")
+        return
+    photos = data.get("rev_photos", [])
+    album = message.media_group_id
+    first = album is None or album != data.get("rev_album")
+    if len(photos) < REVIEW_MAX_PHOTOS:
+        # самый большой размер; храним только file_id — байты остаются у Telegram
+        photos = photos + [message.photo[-1].file_id]
+    caption = data.get("rev_caption") or (message.caption or "").strip()[:2000] or None
+    await state.update_data(rev_photos=photos, rev_album=album, rev_caption=caption)
+    if first:
+        await message.answer(
+            "📷 Фото добавлено. Допишите текст отзыва одним сообщением или опубликуйте как есть.",
+            reply_markup=review_text_options_kb(with_photos=True),
+        )
+
+
+@router.message(ReviewForm.waiting_text)
+async def rev_text(message: Message, state: FSMContext):
+    data = await state.get_data()
+    app_id = data.get("rev_app_id")
+    stars = data.get("rev_stars")
+    if app_id is None or stars is None:
+        await state.clear()
+        await message.answer("Сессия отзыва сброшена. Начните с кнопки под заявкой.")
+        return
+    if await db.aio.review_for_application_exists(app_id):
+        await state.clear()
+        await message.answer("По этой заявке отзыв уже оставлен.")
+        return
+    owner = await db.aio.get_application_tg_id(app_id)
+    if owner is None or owner != message.from_user.id:
+        await state.clear()
+        await message.answer("Ошибка доступа.")
+        return
+    body = (message.text or "").strip()
+    if not body:
+        await message.answer("Введите текст отзыва или нажмите «Только оценка».")
+        return
+    if data.get("rev_caption"):
+        body = f"{data['rev_caption']}\n\n{body}"
+    if len(body) > 2000:
+        body = body[:2000]
+    try:
+        await db.aio.create_review(
+            app_id,
+            message.from_user.id,
+            message.from_user.username,
+            message.from_user.first_name,
+            int(stars),
+            body,
+            data.get("rev_photos", []),
+        )
+    except db.IntegrityError:
+        await state.clear()
+        await message.answer("По этой заявке отзыв уже сохранён.")
+        return
+    await state.clear()
+    review_feed.invalidate()
+    await message.answer(
+        "✅ Спасибо за отзыв! Он появится в разделе «⭐ Отзывы клиентов»."
+    )
+
+
+# ---------- Инфо, FAQ и поддержка ----------
+
+
+@router.message(StateFilter(None), F.text == "⭐ Отзывы клиентов")
+async def show_public_reviews(message: Message):
+    text, media = await review_feed.get()
+    await message.answer(text)
+    if not media:
+        return
+    try:
+        if len(media) == 1:
+            await message.answer_photo(media[0].media, caption=media[0].caption)
+        else:
+            await message.answer_media_group(media)
+    except TelegramBadRequest as e:
+        # file_id мог стать недействительным — лента текстом всё равно ушла
+        logger.warning("Review photos not sent: %s", e.message)
+
+
+@router.message(StateFilter(None), F.text == "ℹ️ О компании")
+async def about(message: Message):
+    await message.answer(TEXT_ABOUT)
+
+
+@router.message(StateFilter(None), F.text == "❓ FAQ")
+async def faq(message: Message):
+    await message.answer(TEXT_FAQ)
+
+
+@router.message(StateFilter(None), F.text == "🆘 Связаться с менеджером")
+async def contact_manager_start(message: Message, state: FSMContext):
+    await state.clear()
+    await state.set_state(SupportForm.message)
+    await message.answer(
+        "🆘 <b>Связь с менеджером</b>\n\n"
+        "Опишите свой вопрос одним сообщением. Мы передадим его менеджеру.",
+    )
 
 
-def format_admin_review_caption(r: sqlite3.Row) -> str:
-    who = r["first_name"] or (f"@{r['username']}" if r["username"] else "Клиент")
-    who_e = html.escape(str(who))
-    body_raw = r["body"]
-    body_e = html.escape(str(body_raw)) if body_raw else "—"
-    return (
-        f"📝 <b>Отзыв №{r['id']}</b>\n"
-        f"Заявка: №{r['application_id']}\n"
-        f"Клиент: {who_e} (tg {r['tg_id']})\n"
-        f"Оценка: {stars_row(int(r['stars']))}\n"
-        f"Текст:\n{body_e}\n"
-        f"<i>Создан: {r['created_at']}</i>"
+@router.message(SupportForm.message)
+async def contact_manager_send(message: Message, state: FSMContext):
+    text = T_SUPPORT_TO_ADMIN.render(
+        username=message.from_user.username or "без_username",
+        tg_id=message.from_user.id,
+        text=message.text or "",
     )
+    await state.clear()
+    # отправка админам не прерывается сроком хэндлера: иначе повтор продублирует сообщение
+    run_followup(forward_to_managers(message, text))
 
 
-# ---------------------- ИНИЦИАЛИЗАЦИЯ ---------------------
-
-bot = Bot(
-    token=BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-)
-dp = Dispatcher(storage=MemoryStorage())
-router = Router()
-admin_router = Router()
+async def forward_to_managers(message: Message, text: str) -> None:
+    sent = False
+    for admin_id in ADMINS:
+        try:
+            await bot.send_message(admin_id, text)
+            sent = True
+        except Exception:
+            pass
 
+    if sent:
+        await message.answer(
+            "Ваше сообщение передано менеджеру. "
+            "Мы ответим вам в этом чате."
+        )
+    else:
+        await message.answer(
+            "Не удалось передать сообщение менеджеру. Попробуйте позже."
+        )
 
-def is_admin(tg_id: int) -> bool:
-    return tg_id in ADMINS
 
+# Дополнительные колбэки от кнопок после статуса
 
-# ------------------------- ХЭНДЛЕРЫ -----------------------
 
+@router.callback_query(F.data == "user:newapp")
+async def user_newapp(callback: CallbackQuery, state: FSMContext):
+    await start_app_form(callback.message, state)
+    await callback.answer()
 
-@router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
-    await state.clear()
-    user_id = db.get_or_create_user(
-        message.from_user.id, message.from_user.username, message.from_user.first_name
-    )
-    _ = user_id
-    kb = main_menu_kb(is_admin=is_admin(message.from_user.id))
-    await message.answer(
-        "👋 <b>Добро пожаловать в тур‑бот Anex!</b>\n\n"
-        "Здесь вы можете оформить заявку на подбор тура, посмотреть статус своих заявок "
-        "и связаться с менеджером.",
-        reply_markup=kb,
-    )
 
+@router.callback_query(F.data == "user:contact")
+async def user_contact(callback: CallbackQuery, state: FSMContext):
+    await contact_manager_start(callback.message, state)
+    await callback.answer()
 
-# ---------- Пользовательское меню: заявка ----------
 
+# ---------- Админ‑панель ----------
 
-@router.message(StateFilter(None), F.text == "🏖 Подобрать тур")
-async def start_app_form(message: Message, state: FSMContext):
-    await state.clear()
-    await state.set_state(AppForm.destination)
-    await message.answer(
-        "✈️ <b>Шаг 1 из 7.</b>\n\n"
-        "В какую страну или город вы хотите поехать?"
-    )
 
+@admin_router.message(StateFilter(None), F.text == "🛠 Админ‑панель")
+async def admin_panel(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет доступа к админ‑панели.")
+        return
+    await message.answer(TEXT_ADMIN_PANEL, reply_markup=admin_panel_kb())
 
-@router.message(AppForm.destination)
-async def app_destination(message: Message, state: FSMContext):
-    await state.update_data(destination=message.text.strip())
-    await state.set_state(AppForm.dates)
-    await message.answer(
-        "📅 <b>Шаг 2 из 7.</b>\n\n"
-        "Когда планируете поездку? Укажите примерные даты или период."
-    )
 
+async def filtered_applications(kind: str, band: str, order: str, limit: int) -> Tuple[str, List[Any]]:
+    """Заголовок и заявки списка админки: вид (new, approved, … или all), бюджет и порядок."""
+    if kind == "new":
+        statuses = ["new"]
+        title = "🆕 <b>Новые заявки</b>"
+    elif kind == "in_progress":
+        statuses = ["in_progress"]
+        title = "⏳ <b>Заявки в обработке</b>"
+    elif kind == "approved":
+        statuses = ["approved"]
+        title = "✅ <b>Одобренные заявки</b>"
+    elif kind == "rejected":
+        statuses = ["rejected"]
+        title = "❌ <b>Отклонённые заявки</b>"
+    elif kind == "closed":
+        statuses = ["closed"]
+        title = "🗄 <b>Закрытые заявки</b>"
+    else:
+        statuses = ["new", "in_progress", *CLOSED_STATUSES]
+        title = "📊 <b>Все заявки</b>"
 
-@router.message(AppForm.dates)
-async def app_dates(message: Message, state: FSMContext):
-    await state.update_data(dates=message.text.strip())
-    await state.set_state(AppForm.adults)
-    await message.answer(
-        "👥 <b>Шаг 3 из 7.</b>\n\n"
-        "Сколько взрослых едет? (введите число)"
-    )
+    if band == "any" and order == "new":
+        return title, await db.aio.get_applications_by_status(statuses, limit=limit)
+    # по бюджету — только заявки, где сумму удалось разобрать
+    _, min_rub, max_rub = BUDGET_BANDS[band]
+    title += f"\nБюджет: {BUDGET_BANDS[band][0]}, {BUDGET_ORDER_LABELS[order]}"
+    return title, await db.aio.get_applications_by_budget(statuses, min_rub, max_rub, order, limit=limit)
 
 
-@router.message(AppForm.adults)
-async def app_adults(message: Message, state: FSMContext):
-    text = message.text.strip()
-    if not text.isdigit() or int(text) <= 0:
-        await message.answer("Пожалуйста, введите положительное число.")
+@admin_router.callback_query(F.data.startswith("adm:list:"))
+async def admin_list(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
         return
-    await state.update_data(adults=int(text))
-    await state.set_state(AppForm.children)
-    await message.answer(
-        "👨‍👩‍👧 <b>Шаг 4 из 7.</b>\n\n"
-        "Сколько детей едет? Если без детей — введите 0."
-    )
 
+    parts = callback.data.split(":")
+    kind = parts[2]
+    band = parts[3] if len(parts) > 3 and parts[3] in BUDGET_BANDS else "any"
+    order = parts[4] if len(parts) > 4 and parts[4] in BUDGET_ORDER_LABELS else "new"
+    title, apps = await filtered_applications(kind, band, order, limit=20)
+    filters = admin_list_filter_kb(kind, band, order)
 
-@router.message(AppForm.children)
-async def app_children(message: Message, state: FSMContext):
-    text = message.text.strip()
-    if not text.isdigit() or int(text) < 0:
-        await message.answer("Пожалуйста, введите 0 или положительное число.")
+    if not apps:
+        await callback.message.answer(f"{title}\n\nЗаявок в этой категории нет.", reply_markup=filters)
+        await callback.answer()
         return
-    await state.update_data(children=int(text))
-    await state.set_state(AppForm.budget)
-    await message.answer(
-        "💵 <b>Шаг 5 из 7.</b>\n\n"
-        "Какой ориентировочный бюджет на тур? Можно указать валюту, например:\n"
-        "<i>до 1500$ на двоих</i> или <i>до 120 000 ₽</i>."
-    )
 
+    await callback.message.answer(title, reply_markup=filters)
+    items = {}
+    for a in apps:
+        sent = await callback.message.answer(format_app_short(a), reply_markup=app_item_kb(a["id"]))
+        items[a["id"]] = sent.message_id
+    bar = await callback.message.answer(bulk_bar_text(0), reply_markup=bulk_actions_kb())
 
-@router.message(AppForm.budget)
-async def app_budget(message: Message, state: FSMContext):
-    await state.update_data(budget=message.text.strip())
-    await state.set_state(AppForm.wishes)
-    await message.answer(
-        "🏨 <b>Шаг 6 из 7.</b>\n\n"
-        "Ваши пожелания к отелю и туру:\n"
-        "• звёздность отеля\n"
-        "• тип питания\n"
-        "• важные моменты (первая линия, тихий район и т.д.)\n\n"
-        "Если особых пожеланий нет — напишите «без пожеланий»."
+    # выбор для массовых действий живёт в данных FSM админа и сбрасывается новым списком
+    await state.update_data(
+        bulk_filter=[kind, band, order], bulk_selected=[], bulk_items=items, bulk_bar=bar.message_id
     )
+    await callback.answer()
 
 
-@router.message(AppForm.wishes)
-async def app_wishes(message: Message, state: FSMContext):
-    await state.update_data(wishes=message.text.strip())
-    await state.set_state(AppForm.contact)
-    default_contact = (
-        f"@{message.from_user.username}" if message.from_user.username else ""
-    )
-    await message.answer(
-        "📞 <b>Шаг 7 из 7.</b>\n\n"
-        "Оставьте, пожалуйста, контакт для связи: только номер телефона.\n"
-        "Только номер РФ: +7XXXXXXXXXX или 8XXXXXXXXXX.\n"
-        f"По умолчанию можем использовать: <b>{default_contact}</b> (если это номер телефона — просто отправьте его)."
+# ---------- Массовые действия ----------
+
+
+def bulk_bar_text(selected: int) -> str:
+    return (
+        f"🧺 <b>Массовые действия</b>\n\nВыбрано заявок: {selected}.\n"
+        "Отметьте заявки кнопкой «☐ Выбрать» или выберите все открытые по фильтру."
     )
 
 
-@router.message(AppForm.contact)
-async def app_contact(message: Message, state: FSMContext):
-    contact = message.text.strip()
-    normalized = re.sub(r"[^\d+]", "", contact)
-    normalized = normalized.replace("+", "", 1) if normalized.startswith("+") else normalized
+async def edit_markup(chat_id: int, message_id: int, kb: Optional[InlineKeyboardMarkup]) -> None:
+    """Правка кнопок в общем бюджете send_limiter — массовые действия правят сотни сообщений."""
+    await send_limiter.acquire()
+    try:
+        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=kb)
+    except Exception:
+        pass
 
-    # Допускаем только номера РФ: +7XXXXXXXXXX или 8XXXXXXXXXX (ровно 11 цифр).
-    if not re.fullmatch(r"(7|8)\d{10}", normalized):
-        await message.answer(
-            "Пожалуйста, укажите корректный номер телефона РФ.\n"
-            "Пример: <b>+79991234567</b> или <b>89991234567</b>."
-        )
-        return
-    await state.update_data(contact=contact)
 
+async def refresh_bulk_selection(chat_id: int, data: dict, selected: List[int], changed: List[int]) -> None:
+    """Обновляет счётчик выбора и кнопки у показанных заявок, чья отметка изменилась."""
+    chosen = set(selected)
+    items = data.get("bulk_items", {})
+    edits = [
+        edit_markup(chat_id, items[app_id], app_item_kb(app_id, app_id in chosen))
+        for app_id in changed
+        if app_id in items
+    ]
+    await asyncio.gather(*edits)
+    if data.get("bulk_bar"):
+        try:
+            await bot.edit_message_text(
+                bulk_bar_text(len(selected)),
+                chat_id=chat_id,
+                message_id=data["bulk_bar"],
+                reply_markup=bulk_actions_kb(),
+            )
+        except Exception:
+            pass
+
+
+@admin_router.callback_query(F.data.startswith("adm:sel:"))
+async def admin_bulk_toggle(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    app_id = int(callback.data.split(":")[2])
     data = await state.get_data()
-    required_keys = ["destination", "dates", "adults", "children", "budget", "wishes", "contact"]
-    if not all(k in data for k in required_keys):
-        await message.answer(
-            "Произошла ошибка при сохранении заявки. "
-            "Пожалуйста, начните оформление заново."
-        )
-        await state.clear()
-        await start_app_form(message, state)
+    selected = list(data.get("bulk_selected", []))
+    if app_id in selected:
+        selected.remove(app_id)
+    elif len(selected) >= BULK_MAX_APPLICATIONS:
+        await callback.answer(f"Можно выбрать не больше {BULK_MAX_APPLICATIONS} заявок.", show_alert=True)
         return
+    else:
+        selected.append(app_id)
+    await state.update_data(bulk_selected=selected)
+    # карточка могла прийти не из текущего списка (поиск по телефону) — правим её саму
+    try:
+        await callback.message.edit_reply_markup(reply_markup=app_item_kb(app_id, app_id in selected))
+    except Exception:
+        pass
+    await refresh_bulk_selection(callback.message.chat.id, data, selected, [])
+    await callback.answer()
 
-    text = (
-        "📝 <b>Проверьте заявку:</b>\n\n"
-        f"<b>Направление:</b> {data['destination']}\n"
-        f"<b>Даты:</b> {data['dates']}\n"
-        f"<b>Взрослых:</b> {data['adults']}\n"
-        f"<b>Детей:</b> {data['children']}\n"
-        f"<b>Бюджет:</b> {data['budget']}\n"
-        f"<b>Пожелания:</b> {data['wishes']}\n"
-        f"<b>Контакт:</b> {data['contact']}\n\n"
-        "Если всё верно — отправьте заявку менеджеру."
-    )
-    await state.set_state(AppForm.confirm)
-    await message.answer(text, reply_markup=app_confirm_kb())
+
+@admin_router.callback_query(F.data == "adm:selall")
+async def admin_bulk_select_all(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    data = await state.get_data()
+    if not data.get("bulk_filter"):
+        await callback.answer("Откройте список заявок заново.", show_alert=True)
+        return
+    _, apps = await filtered_applications(*data["bulk_filter"], limit=BULK_MAX_APPLICATIONS)
+    me = callback.from_user.id
+    selected = [
+        a["id"] for a in apps if a["status"] not in CLOSED_STATUSES and a["claimed_by"] in (None, me)
+    ]
+    before = set(data.get("bulk_selected", []))
+    await state.update_data(bulk_selected=selected)
+    changed = [app_id for app_id in data.get("bulk_items", {}) if (app_id in before) != (app_id in selected)]
+    await refresh_bulk_selection(callback.message.chat.id, data, selected, changed)
+    await callback.answer(f"Выбрано заявок: {len(selected)}")
 
 
-@router.callback_query(F.data == "app:restart")
-async def app_restart(callback: CallbackQuery, state: FSMContext):
-    await state.clear()
-    await state.set_state(AppForm.destination)
-    await callback.message.answer(
-        "Начнём заново.\n\n"
-        "✈️ <b>Шаг 1 из 7.</b>\n"
-        "В какую страну или город вы хотите поехать?"
-    )
+@admin_router.callback_query(F.data == "adm:selnone")
+async def admin_bulk_select_none(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    data = await state.get_data()
+    await state.update_data(bulk_selected=[])
+    await refresh_bulk_selection(callback.message.chat.id, data, [], data.get("bulk_selected", []))
     await callback.answer()
 
 
-@router.callback_query(F.data == "app:send")
-async def app_send(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    required_keys = ["destination", "dates", "adults", "children", "budget", "wishes", "contact"]
-    if not all(k in data for k in required_keys):
-        await callback.message.answer(
-            "Произошла ошибка при сохранении заявки. "
-            "Пожалуйста, начните оформление заново через «🏖 Подобрать тур»."
-        )
-        await state.clear()
+@admin_router.callback_query(F.data.startswith("adm:bulk:"))
+async def admin_bulk_start(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    status = callback.data.split(":")[2]
+    if status not in CLOSED_STATUSES:
         await callback.answer()
         return
+    selected = (await state.get_data()).get("bulk_selected", [])
+    if not selected:
+        await callback.answer("Сначала отметьте заявки.", show_alert=True)
+        return
+
+    await state.set_state(BulkForm.comment)
+    await state.update_data(bulk_status=status)
+    if status == "rejected":
+        prompt = "Укажите причину — её получат все клиенты."
+    else:
+        prompt = "Введите комментарий для клиентов (один для всех). Если без комментария — отправьте «-»."
+    await callback.message.answer(f"{human_status(status)}: заявок — {len(selected)}.\n\n{prompt}")
+    await callback.answer()
+
 
+@admin_router.message(BulkForm.comment)
+async def admin_bulk_finish(message: Message, state: FSMContext):
+    data = await state.get_data()
     await state.clear()
+    status = data["bulk_status"]
+    selected = data.get("bulk_selected", [])
+    comment = (message.text or "").strip()
+    if comment == "-":
+        comment = ""
+    if status == "rejected" and not comment:
+        comment = "Заявка отклонена без указания причины."
 
-    user_row = db.get_user_by_tg(callback.from_user.id)
-    if not user_row:
-        db.get_or_create_user(
-            callback.from_user.id, callback.from_user.username, callback.from_user.first_name
+    me = message.from_user
+    apps, notifications = await db.aio.bulk_update_status(selected, status, me.id, admin_name(me), comment)
+    label = f"{human_status(status)}: {admin_name(me)}"
+    run_followup(
+        notify_bulk_closed(
+            message.chat.id,
+            status,
+            comment,
+            apps,
+            len(selected) - len(apps),
+            notifications,
+            data.get("bulk_items", {}),
+            label,
         )
-        user_row = db.get_user_by_tg(callback.from_user.id)
+    )
 
-    app_id = db.create_application(user_row, data)
 
-    await callback.message.answer(
-        f"✅ <b>Заявка №{app_id} отправлена менеджеру.</b>\n\n"
-        "Мы свяжемся с вами в ближайшее время.",
-        reply_markup=main_menu_kb(is_admin=is_admin(callback.from_user.id)),
-    )
-    await callback.message.answer(
-        "Хотите оставить короткий отзыв о сервисе?",
-        reply_markup=review_prompt_kb(app_id),
-    )
-    await callback.answer("Заявка отправлена")
-
-    summary = (
-        f"📩 <b>Новая заявка №{app_id}</b>\n"
-        f"От: @{callback.from_user.username or 'без_username'} (ID {callback.from_user.id})\n\n"
-        f"Направление: {data['destination']}\n"
-        f"Даты: {data['dates']}\n"
-        f"Взрослых: {data['adults']}, детей: {data['children']}\n"
-        f"Бюджет: {data['budget']}\n"
-        f"Пожелания: {data['wishes']}\n"
-        f"Контакт: {data['contact']}"
+def client_status_text(a: Any, status: str, comment: str) -> str:
+    if status == "rejected":
+        return T_REJECTED.render(app_id=a["id"], comment=comment)
+    if status == "approved":
+        template = T_APPROVED_WITH_COMMENT if comment else T_APPROVED
+    else:
+        template = T_CLOSED_WITH_COMMENT if comment else T_CLOSED
+    return template.render(app_id=a["id"], destination=a["destination"], dates=a["dates"], comment=comment)
+
+
+async def notify_bulk_closed(
+    chat_id: int,
+    status: str,
+    comment: str,
+    apps: List[Any],
+    skipped: int,
+    notifications: List[Any],
+    items: Dict[int, int],
+    label: str,
+) -> None:
+    """Отчёт админу, уведомления клиентам и правка кнопок у админов после массового действия.
+    Всё идёт параллельно через send_limiter; итог доставки — правкой сообщения-отчёта."""
+    try:
+        report = await bot.send_message(
+            chat_id,
+            f"{human_status(status)}: обновлено заявок — {len(apps)}"
+            + (f", пропущено {skipped} (уже закрыты или в работе у другого администратора)" if skipped else "")
+            + ".\nОтправляю уведомления клиентам…",
+        )
+    except Exception:
+        report = None
+    kb = user_after_status_kb()
+    outcomes = await asyncio.gather(
+        *(deliver_message(a["tg_id"], client_status_text(a, status, comment), reply_markup=kb) for a in apps)
     )
-    for admin_id in ADMINS:
+    counts = Counter(result for result, _ in outcomes)
+    if report is not None:
         try:
-            await bot.send_message(
-                admin_id,
-                summary,
-                reply_markup=app_manage_kb(app_id),
+            await bot.edit_message_text(
+                f"{human_status(status)}: обновлено заявок — {len(apps)}.\n"
+                f"Клиентам доставлено: {counts['sent']}, заблокировали бота: {counts['blocked']}, "
+                f"ошибок: {counts['failed']}.",
+                chat_id=chat_id,
+                message_id=report.message_id,
             )
         except Exception:
             pass
+    # кнопки у админов — после отчёта: их правок вдвое больше, чем заявок
+    await asyncio.gather(
+        *(
+            edit_markup(n["admin_tg_id"], n["message_id"], app_taken_kb(n["application_id"], label))
+            for n in notifications
+        ),
+        *(edit_markup(chat_id, items[a["id"]], app_taken_kb(a["id"], label)) for a in apps if a["id"] in items),
+    )
 
 
-# ---------- Мои заявки ----------
-
-
-def human_status(code: str) -> str:
-    return {
-        "new": "🆕 Новая",
-        "in_progress": "⏳ В обработке",
-        "approved": "✅ Одобрена",
-        "rejected": "❌ Отклонённая",
-    }.get(code, code)
+def format_app_short(a: sqlite3.Row) -> str:
+    return T_APP_SHORT.render(
+        app_id=a["id"],
+        status=human_status(a["status"]),
+        username=a["username"] or "без_username",
+        tg_id=a["tg_id"],
+        destination=a["destination"],
+        dates=a["dates"],
+        budget=a["budget"],
+        created_at=a["created_at"],
+    )
 
 
-@router.message(StateFilter(None), F.text == "📋 Мои заявки")
-async def my_apps(message: Message):
-    user = db.get_user_by_tg(message.from_user.id)
-    if not user:
-        await message.answer("Профиль не найден. Нажмите /start.")
+async def flush_funnel() -> None:
+    counts = funnel.drain()
+    if not counts:
         return
-    apps = db.get_user_applications(user["id"], limit=20)
-    if not apps:
-        await message.answer(
-            "У вас пока нет заявок.\n"
-            "Нажмите «🏖 Подобрать тур», чтобы отправить первую."
-        )
+    try:
+        await db.aio.add_funnel_counts(funnel.rows(counts))
+    except Exception:
+        # не потерять счётчики: вернём их к следующему сбросу
+        funnel.counts.update(counts)
+        raise
+
+
+def format_funnel_report(totals: Dict[str, int], hours: int) -> str:
+    period = f"{hours} ч" if hours < 48 else f"{hours // 24} дней"
+    lines = [f"📈 <b>Воронка заявок за {period}</b>\n"]
+    started = totals.get("start", 0)
+    prev = started
+    for event, title in FUNNEL_STEPS:
+        n = totals.get(event, 0)
+        line = f"{title}: <b>{n}</b>"
+        if event != "start" and started:
+            line += f" ({n * 100 // started}%"
+            if prev:
+                line += f", −{(prev - n) * 100 // prev}% к пред. шагу"
+            line += ")"
+        lines.append(line)
+        prev = n
+    rejects = ", ".join(f"{title} {totals.get(event, 0)}" for event, title in FUNNEL_REJECTS)
+    lines.append(f"\nОшибки ввода: {rejects}")
+    lines.append(f"Начали заново: {totals.get('restart', 0)}")
+    if WORKERS:
+        lines.append(f"\nСчётчики других рабочих процессов — с задержкой до {FUNNEL_FLUSH_SECONDS} с.")
+    return "\n".join(lines)
+
+
+@admin_router.callback_query(F.data.startswith("adm:funnel"))
+async def admin_funnel(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    parts = callback.data.split(":")
+    hours = int(parts[2]) if len(parts) > 2 else 24
+    # сбрасываем несохранённые счётчики этого процесса; другие рабочие процессы
+    # сбрасывают свои раз в FUNNEL_FLUSH_SECONDS — отчёт об этом предупреждает
+    await flush_funnel()
+    since = (datetime.utcnow() - timedelta(hours=hours)).isoformat(timespec="seconds")
+    text = format_funnel_report(await db.aio.funnel_totals(since), hours)
+    if len(parts) > 2:
+        # переключение периода — правим тот же отчёт
+        try:
+            await callback.message.edit_text(text, reply_markup=funnel_period_kb())
+        except Exception:
+            pass
+    else:
+        await callback.message.answer(text, reply_markup=funnel_period_kb())
+    await callback.answer()
+
+
+def format_period_report(
+    by_status: Dict[str, int], new_users: int, active_users: int, days: int, top: List[Any] = ()
+) -> str:
+    period = "24 ч" if days == 1 else ("год" if days == 365 else f"{days} дней")
+    total = sum(by_status.values())
+    lines = [f"🗓 <b>Отчёт за {period}</b>\n", f"Новых заявок: <b>{total}</b>"]
+    for status in ("new", "in_progress", *CLOSED_STATUSES):
+        lines.append(f"  {human_status(status)}: {by_status.get(status, 0)}")
+    closed = by_status.get("approved", 0) + by_status.get("rejected", 0)
+    if closed:
+        lines.append(f"Одобрено из закрытых: {by_status.get('approved', 0) * 100 // closed}%")
+    lines.append(f"\nНовых пользователей: <b>{new_users}</b>")
+    lines.append(f"Активных пользователей: <b>{active_users}</b>")
+    if top:
+        lines.append("\nПопулярные направления:")
+        lines.extend(T_REPORT_DESTINATION.render(name=r["name"], n=r["n"]) for r in top)
+    return "\n".join(lines)
+
+
+@admin_router.callback_query(F.data.startswith("adm:report"))
+async def admin_report(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
         return
-    lines = ["📋 <b>Ваши заявки:</b>\n"]
-    for a in apps:
-        lines.append(
-            f"• №{a['id']} — {human_status(a['status'])}\n"
-            f"  Направление: {a['destination']}\n"
-            f"  Даты: {a['dates']}\n"
-            f"  Обновлено: {a['updated_at']}\n"
-        )
-    await message.answer("\n".join(lines))
+    parts = callback.data.split(":")
+    days = int(parts[2]) if len(parts) > 2 else 7
+    now = int(time.time())
+    since = now - days * 86400
+    text = format_period_report(
+        await db.aio.count_applications_created(since, now + 1),
+        await db.aio.count_users_created_since(since),
+        await db.aio.count_users_active_since(since),
+        days,
+        await db.aio.top_destinations(since, now + 1, DEST_SUGGESTIONS),
+    )
+    if len(parts) > 2:
+        # переключение периода — правим тот же отчёт
+        await edit_in_place(callback.message, text, report_period_kb())
+    else:
+        await callback.message.answer(text, reply_markup=report_period_kb())
+    await callback.answer()
 
 
-# ---------- Повторить последнюю заявку ----------
+@admin_router.callback_query(F.data == "adm:phone")
+async def admin_phone_search_start(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    await state.set_state(PhoneSearchForm.phone)
+    await callback.message.answer(
+        "🔎 <b>Поиск заявок по телефону</b>\n\n"
+        "Отправьте номер клиента в любом формате, например <b>+7 999 123-45-67</b>."
+    )
+    await callback.answer()
 
 
-@router.message(StateFilter(None), F.text == "🔁 Повторить заявку")
-async def repeat_last_app(message: Message):
-    user = db.get_user_by_tg(message.from_user.id)
-    if not user:
-        await message.answer("Профиль не найден. Нажмите /start.")
+@admin_router.message(PhoneSearchForm.phone)
+async def admin_phone_search(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        await state.clear()
         return
-    apps = db.get_user_applications(user["id"], limit=1)
-    if not apps:
+    phone = normalize_phone(message.text)
+    if phone is None:
         await message.answer(
-            "У вас ещё нет заявок, чтобы их повторять.\n"
-            "Сначала отправьте первую через «🏖 Подобрать тур»."
+            "Не похоже на номер телефона РФ. Пример: <b>+79991234567</b> или <b>89991234567</b>."
         )
         return
+    await state.clear()
+    apps = await db.aio.get_applications_by_phone(phone, limit=20)
+    if not apps:
+        await message.answer(f"По номеру +{phone} заявок не найдено.")
+        return
+    await message.answer(f"🔎 <b>Заявки с номера +{phone}</b>")
+    for a in apps:
+        await message.answer(format_app_short(a), reply_markup=app_item_kb(a["id"]))
 
-    a = apps[0]
-    text = (
-        f"📎 <b>Последняя заявка №{a['id']}</b> ({human_status(a['status'])})\n\n"
-        f"<b>Направление:</b> {a['destination']}\n"
-        f"<b>Даты:</b> {a['dates']}\n"
-        f"<b>Взрослых:</b> {a['adults']}\n"
-        f"<b>Детей:</b> {a['children']}\n"
-        f"<b>Бюджет:</b> {a['budget']}\n"
-        f"<b>Пожелания:</b> {a['wishes']}\n"
-        f"<b>Контакт:</b> {a['contact']}\n\n"
-        "Отправить такую же заявку ещё раз?"
+
+def format_app_full(a: sqlite3.Row) -> str:
+    return T_APP_FULL.render(
+        app_id=a["id"],
+        status=human_status(a["status"]),
+        username=a["username"] or "без_username",
+        tg_id=a["tg_id"],
+        first_name=a["first_name"] or "-",
+        created_at=a["created_at"],
+        updated_at=a["updated_at"],
+        admin_comment=a["admin_comment"] or "—",
+        claimed=Markup(T_APP_CLAIMED.render(name=a["claimed_by_name"])) if a["claimed_by"] else Markup(),
+        **app_fields(a),
     )
-    await message.answer(text, reply_markup=repeat_confirm_kb(a["id"]))
 
 
-@router.callback_query(F.data.startswith("rep:send:"))
-async def repeat_send(callback: CallbackQuery):
+@admin_router.callback_query(F.data.startswith("adm:open:"))
+async def admin_open(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
     app_id = int(callback.data.split(":")[2])
-    a = db.get_application(app_id)
+    await try_claim(callback, app_id)
+    a = await db.aio.get_application(app_id)
     if not a:
-        await callback.answer("Не удалось найти исходную заявку.", show_alert=True)
+        await callback.message.answer("Заявка не найдена.")
+        await callback.answer()
         return
 
-    user = db.get_user_by_tg(a["tg_id"])
-    if not user:
-        await callback.answer("Профиль пользователя не найден.", show_alert=True)
-        return
+    # действия — только у того, кто взял заявку; остальным — просмотр
+    mine = a["status"] not in CLOSED_STATUSES and a["claimed_by"] in (None, callback.from_user.id)
+    text = format_app_full(a)
+    await callback.message.answer(text, reply_markup=app_manage_kb(app_id) if mine else None)
+    await callback.answer()
 
-    data = {
-        "destination": a["destination"],
-        "dates": a["dates"],
-        "adults": a["adults"],
-        "children": a["children"],
-        "budget": a["budget"],
-        "wishes": a["wishes"],
-        "contact": a["contact"],
-    }
-    new_app_id = db.create_application(user, data)
 
-    await callback.message.answer(
-        f"✅ Заявка №{new_app_id} отправлена повторно.\n"
-        f"(на основе заявки №{app_id})",
-        reply_markup=main_menu_kb(is_admin=is_admin(callback.from_user.id)),
-    )
-    await callback.message.answer(
-        "Хотите оставить короткий отзыв о сервисе?",
-        reply_markup=review_prompt_kb(new_app_id),
-    )
-    await callback.answer("Заявка повторена")
-
-    summary = (
-        f"📩 <b>Новая повторная заявка №{new_app_id}</b>\n"
-        f"(на основе заявки №{app_id})\n"
-        f"От: @{user['username'] or 'без_username'} (ID {user['tg_id']})\n\n"
-        f"Направление: {data['destination']}\n"
-        f"Даты: {data['dates']}\n"
-        f"Взрослых: {data['adults']}, детей: {data['children']}\n"
-        f"Бюджет: {data['budget']}\n"
-        f"Пожелания: {data['wishes']}\n"
-        f"Контакт: {data['contact']}"
-    )
-    for admin_id in ADMINS:
+def admin_name(user) -> str:
+    return user.first_name or (f"@{user.username}" if user.username else str(user.id))
+
+
+async def mark_admin_notifications(app_id: int, label: str, skip_admin: Optional[int] = None) -> None:
+    """Меняет кнопки под уведомлениями о заявке у остальных админов (только markup, без текста)."""
+    kb = app_taken_kb(app_id, label)
+    for n in await db.aio.list_admin_notifications(app_id):
+        if n["admin_tg_id"] == skip_admin:
+            continue
         try:
-            await bot.send_message(
-                admin_id,
-                summary,
-                reply_markup=app_manage_kb(new_app_id),
+            await bot.edit_message_reply_markup(
+                chat_id=n["admin_tg_id"], message_id=n["message_id"], reply_markup=kb
             )
         except Exception:
             pass
 
 
-@router.callback_query(F.data == "rep:cancel")
-async def repeat_cancel(callback: CallbackQuery):
-    await callback.message.answer("Повтор заявки отменён.")
-    await callback.answer()
+async def try_claim(callback: CallbackQuery, app_id: int) -> bool:
+    """Берёт новую заявку за нажавшим админом; при успехе показывает это остальным."""
+    me = callback.from_user
+    if not await db.aio.claim_application(app_id, me.id, admin_name(me)):
+        return False
+    await mark_admin_notifications(app_id, f"🔒 Взял(а) в работу: {admin_name(me)}", skip_admin=me.id)
+    return True
 
 
-# ---------- Отзывы (пользователь) ----------
+async def claimed_application(callback: CallbackQuery, app_id: int) -> Optional[sqlite3.Row]:
+    """Заявка, если с ней может работать нажавший админ; иначе объясняет почему и возвращает None."""
+    await try_claim(callback, app_id)
+    a = await db.aio.get_application(app_id)
+    if not a:
+        await callback.answer("Заявка не найдена.", show_alert=True)
+        return None
+    if a["status"] in CLOSED_STATUSES:
+        await callback.answer(f"Заявка уже закрыта: {human_status(a['status'])}.", show_alert=True)
+        return None
+    if a["claimed_by"] not in (None, callback.from_user.id):
+        await callback.answer(f"Заявку уже взял(а) в работу {a['claimed_by_name']}.", show_alert=True)
+        return None
+    return a
+
+
+async def close_application(message: Message, state: FSMContext, status: str, comment: str) -> None:
+    """Финальная смена статуса из ApproveForm/RejectForm по версии, прочитанной на старте."""
+    data = await state.get_data()
+    app_id = data["app_id"]
+    await state.clear()
+    ok = await db.aio.update_application_status(
+        app_id, status, message.from_user.id, comment, expected_version=data.get("app_version")
+    )
+    if not ok:
+        await message.answer(
+            f"⚠️ Заявку №{app_id} уже изменил другой администратор — статус не обновлён."
+        )
+        return
+    # статус записан: кнопки, подтверждение и клиент — вне срока хэндлера
+    run_followup(notify_closed(message, data, await db.aio.get_application(app_id), status, comment))
 
 
-@router.callback_query(F.data == "rev:skip")
-async def rev_skip(callback: CallbackQuery):
+async def notify_closed(message: Message, data: Dict[str, Any], a: Any, status: str, comment: str) -> None:
+    src_chat_id = data.get("src_chat_id")
+    src_msg_id = data.get("src_msg_id")
+    if src_chat_id and src_msg_id:
+        try:
+            await bot.edit_message_reply_markup(chat_id=src_chat_id, message_id=src_msg_id, reply_markup=None)
+        except Exception:
+            pass
+    label = f"{human_status(status)}: {admin_name(message.from_user)}"
+    await mark_admin_notifications(a["id"], label)
+    await db.aio.delete_admin_notifications(a["id"])
+
+    done = "одобренная" if status == "approved" else "отклонённая"
     try:
-        await callback.message.edit_reply_markup(reply_markup=None)
+        await message.answer(f"Заявка №{a['id']} отмечена как <b>{done}</b>.")
+    except Exception:
+        pass
+    try:
+        await bot.send_message(a["tg_id"], client_status_text(a, status, comment), reply_markup=user_after_status_kb())
     except Exception:
         pass
-    await callback.answer("Без проблем")
 
 
-@router.callback_query(F.data.startswith("rev:start:"))
-async def rev_start(callback: CallbackQuery, state: FSMContext):
-    app_id = int(callback.data.split(":")[2])
-    if db.review_for_application_exists(app_id):
-        await callback.answer("По этой заявке отзыв уже оставлен.", show_alert=True)
-        return
-    owner = db.get_application_tg_id(app_id)
-    if owner is None or owner != callback.from_user.id:
-        await callback.answer("Можно оставить отзыв только по своей заявке.", show_alert=True)
-        return
-    await state.clear()
-    await callback.message.answer(
-        "Выберите оценку от 1 до 5:",
-        reply_markup=review_stars_kb(app_id),
-    )
-    await callback.answer()
+# ---------- Экспорт ----------
 
+EXPORT_USAGE = (
+    "📤 <b>Экспорт данных</b>\n\n"
+    "<code>/export &lt;таблица&gt; [csv|jsonl] [gz]</code>\n"
+    "Таблицы: applications, users, reviews.\n"
+    "Пример: <code>/export applications jsonl gz</code>"
+)
 
-@router.callback_query(F.data.startswith("rev:rate:"))
-async def rev_rate(callback: CallbackQuery, state: FSMContext):
-    parts = callback.data.split(":")
-    app_id = int(parts[2])
-    stars = int(parts[3])
-    if stars < 1 or stars > 5:
-        await callback.answer()
-        return
-    if db.review_for_application_exists(app_id):
-        await callback.answer("По этой заявке отзыв уже есть.", show_alert=True)
-        return
-    owner = db.get_application_tg_id(app_id)
-    if owner is None or owner != callback.from_user.id:
-        await callback.answer("Это не ваша заявка.", show_alert=True)
-        return
-    await state.set_state(ReviewForm.waiting_text)
-    await state.update_data(rev_app_id=app_id, rev_stars=stars)
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-    await callback.message.answer(
-        f"Оценка: {stars_row(stars)}\n\n"
-        "Напишите текст отзыва одним сообщением или нажмите кнопку ниже, "
-        "если достаточно только оценки.",
-        reply_markup=review_text_options_kb(),
-    )
-    await callback.answer()
+# лимит Telegram на отправку документа ботом
+TG_DOCUMENT_LIMIT = 50 * 1024 * 1024
 
 
-@router.callback_query(F.data == "rev:notext")
-async def rev_notext(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    app_id = data.get("rev_app_id")
-    stars = data.get("rev_stars")
-    if app_id is None or stars is None:
-        await callback.answer("Сначала выберите оценку звёздами.", show_alert=True)
-        return
-    if db.review_for_application_exists(app_id):
-        await state.clear()
-        await callback.answer("Отзыв уже сохранён.", show_alert=True)
+@admin_router.message(Command("export"))
+async def admin_export(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
         return
-    owner = db.get_application_tg_id(app_id)
-    if owner is None or owner != callback.from_user.id:
-        await state.clear()
-        await callback.answer("Ошибка доступа.", show_alert=True)
+    args = (command.args or "").split()
+    if not args or args[0] not in EXPORT_TABLES:
+        await message.answer(EXPORT_USAGE)
         return
+    table = args[0]
+    fmt = next((a for a in args[1:] if a in EXPORT_FORMATS), "csv")
+    compress = "gz" in args[1:]
+
+    filename = f"{table}_{datetime.utcnow():%Y%m%d_%H%M%S}.{fmt}" + (".gz" if compress else "")
+    fd, path = tempfile.mkstemp(suffix="_" + filename)
+    os.close(fd)
     try:
-        db.create_review(
-            app_id,
-            callback.from_user.id,
-            callback.from_user.username,
-            callback.from_user.first_name,
-            int(stars),
-            None,
+        await message.answer(f"⏳ Готовлю выгрузку <b>{table}</b>…")
+        rows = await asyncio.to_thread(export_table, db, table, fmt, path, compress)
+        if os.path.getsize(path) > TG_DOCUMENT_LIMIT:
+            await message.answer(
+                "Файл больше 50 МБ — Telegram его не примет. "
+                "Попробуйте со сжатием (<code>gz</code>) или выгрузите через консоль: "
+                f"<code>python main.py export {table} --format {fmt} --gzip</code>"
+            )
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"📤 {table}: {rows} строк",
         )
-    except sqlite3.IntegrityError:
-        await state.clear()
-        await callback.answer("Отзыв уже был сохранён.", show_alert=True)
-        return
-    await state.clear()
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
-        pass
-    await callback.answer("Спасибо!")
-    await callback.message.answer("✅ Спасибо за отзыв! Он появится в разделе «⭐ Отзывы клиентов».")
+        logger.exception("Export of %s failed", table)
+        await message.answer("Не удалось выполнить выгрузку. Подробности в логах.")
+    finally:
+        os.remove(path)
 
 
-@router.message(ReviewForm.waiting_text)
-async def rev_text(message: Message, state: FSMContext):
-    data = await state.get_data()
-    app_id = data.get("rev_app_id")
-    stars = data.get("rev_stars")
-    if app_id is None or stars is None:
-        await state.clear()
-        await message.answer("Сессия отзыва сброшена. Начните с кнопки под заявкой.")
-        return
-    if db.review_for_application_exists(app_id):
-        await state.clear()
-        await message.answer("По этой заявке отзыв уже оставлен.")
-        return
-    owner = db.get_application_tg_id(app_id)
-    if owner is None or owner != message.from_user.id:
-        await state.clear()
-        await message.answer("Ошибка доступа.")
-        return
-    body = (message.text or "").strip()
-    if not body:
-        await message.answer("Введите текст отзыва или нажмите «Только оценка».")
-        return
-    if len(body) > 2000:
-        body = body[:2000]
+# ---------- Профилирование ----------
+
+# идущее профилирование этого процесса: id админа -> задача (не больше одной)
+profile_tasks: Dict[int, asyncio.Task] = {}
+
+
+async def collect_profile(seconds: int, top: int = PROFILE_TOP) -> str:
+    """cProfile цикла событий и прирост памяти по tracemalloc за окно в seconds секунд.
+
+    Пока профилирование не запущено, ни профайлер, ни tracemalloc не включены.
+    """
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    started = time.perf_counter()
     try:
-        db.create_review(
-            app_id,
-            message.from_user.id,
-            message.from_user.username,
-            message.from_user.first_name,
-            int(stars),
-            body,
-        )
-    except sqlite3.IntegrityError:
-        await state.clear()
-        await message.answer("По этой заявке отзыв уже сохранён.")
-        return
-    await state.clear()
-    await message.answer(
-        "✅ Спасибо за отзыв! Он появится в разделе «⭐ Отзывы клиентов»."
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+    elapsed = time.perf_counter() - started
+
+    out = io.StringIO()
+    out.write(
+        f"Profile of pid {os.getpid()} for {elapsed:.1f} s, "
+        f"{datetime.utcnow().isoformat(timespec='seconds')} UTC\n"
+        f"asyncio tasks: {len(asyncio.all_tasks())}\n\n"
     )
+    stats = pstats.Stats(profiler, stream=out).strip_dirs()
+    out.write(f"== cProfile: top {top} by cumulative time ==\n")
+    stats.sort_stats("cumulative").print_stats(top)
+    out.write(f"== cProfile: top {top} by own time ==\n")
+    stats.sort_stats("tottime").print_stats(top)
+
+    out.write(f"== tracemalloc: top {top} allocation growth by line ==\n")
+    for stat in after.compare_to(before, "lineno")[:top]:
+        out.write(f"{stat}\n")
+    out.write(f"\ntraced memory: current {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB\n")
+    return out.getvalue()
+
+
+async def run_profile(chat_id: int, seconds: int) -> None:
+    filename = f"profile_{datetime.utcnow():%Y%m%d_%H%M%S}.txt"
+    fd, path = tempfile.mkstemp(suffix="_" + filename)
+    os.close(fd)
+    try:
+        report = await collect_profile(seconds)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(report)
+        await bot.send_document(
+            chat_id,
+            FSInputFile(path, filename=filename),
+            caption=f"🩺 Профиль за {seconds} с (процесс {os.getpid()})",
+        )
+    except Exception:
+        logger.exception("Profiling failed")
+        try:
+            await bot.send_message(chat_id, "Не удалось снять профиль. Подробности в логах.")
+        except Exception:
+            pass
+    finally:
+        os.remove(path)
 
 
-# ---------- Инфо, FAQ и поддержка ----------
-
+def start_profile(chat_id: int, admin_id: int, seconds: int) -> str:
+    if any(not t.done() for t in profile_tasks.values()):
+        return "⏳ Профилирование уже идёт — дождитесь отчёта."
+    # отдельной задачей: в режиме воркеров апдейты админа не ждут окончания окна
+    task = asyncio.create_task(run_profile(chat_id, seconds))
+    profile_tasks[admin_id] = task
+    task.add_done_callback(lambda t: profile_tasks.pop(admin_id, None))
+    note = "\nПрофилируется процесс, который принял команду." if WORKERS > 0 else ""
+    return f"🩺 Профилирование запущено на {seconds} с. Отчёт придёт файлом.{note}"
 
-@router.message(StateFilter(None), F.text == "⭐ Отзывы клиентов")
-async def show_public_reviews(message: Message):
-    rows = db.list_reviews_newest_first(limit=200)
-    await message.answer(format_public_reviews_block(rows))
 
+@admin_router.message(Command("profile"))
+async def admin_profile_cmd(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        return
+    arg = (command.args or "").strip()
+    if arg and not arg.isdigit():
+        await message.answer(
+            f"<code>/profile [секунд]</code> — от 1 до {PROFILE_MAX_SECONDS}, "
+            f"по умолчанию {PROFILE_DEFAULT_SECONDS}."
+        )
+        return
+    seconds = min(max(int(arg or PROFILE_DEFAULT_SECONDS), 1), PROFILE_MAX_SECONDS)
+    await message.answer(start_profile(message.chat.id, message.from_user.id, seconds))
 
-@router.message(StateFilter(None), F.text == "ℹ️ О компании")
-async def about(message: Message):
-    await message.answer(
-        "🌍 <b>Anex Tour — подбор путешествий под ваши желания.</b>\n\n"
-        "Мы поможем подобрать тур по вашему бюджету, пожеланиям к отелю и датам.\n"
-        "Заполните заявку и дождитесь ответа менеджера."
-    )
 
+@admin_router.callback_query(F.data == "adm:profile")
+async def admin_profile_cb(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    text = start_profile(callback.message.chat.id, callback.from_user.id, PROFILE_DEFAULT_SECONDS)
+    await callback.message.answer(text)
+    await callback.answer()
 
-@router.message(StateFilter(None), F.text == "❓ FAQ")
-async def faq(message: Message):
-    text = (
-        "❓ <b>Частые вопросы</b>\n\n"
-        "<b>1. Как быстро отвечает менеджер?</b>\n"
-        "Обычно в течение 15–60 минут в рабочее время.\n\n"
-        "<b>2. Когда оплачивать тур?</b>\n"
-        "После согласования варианта и подтверждения брони.\n\n"
-        "<b>3. Нужна ли виза?</b>\n"
-        "Зависит от направления. Менеджер подскажет по вашей стране.\n\n"
-        "<b>4. Какие документы нужны?</b>\n"
-        "Паспорт (загран или внутренний — по направлению), иногда доп. документы для визы.\n\n"
-        "<b>5. Можно ли вернуть деньги?</b>\n"
-        "Условия зависят от тарифа и правил туроператора. Мы подскажем оптимальный вариант."
-    )
-    await message.answer(text)
 
+# ---------- Рассылка ----------
 
-@router.message(StateFilter(None), F.text == "🆘 Связаться с менеджером")
-async def contact_manager_start(message: Message, state: FSMContext):
-    await state.clear()
-    await state.set_state(SupportForm.message)
-    await message.answer(
-        "🆘 <b>Связь с менеджером</b>\n\n"
-        "Опишите свой вопрос одним сообщением. Мы передадим его менеджеру.",
-    )
+broadcast_tasks: Dict[int, asyncio.Task] = {}
 
 
-@router.message(SupportForm.message)
-async def contact_manager_send(message: Message, state: FSMContext):
+async def deliver_message(chat_id: int, text: str, **kwargs) -> Tuple[str, Optional[str]]:
+    """Отправка в общем бюджете send_limiter. Возвращает (sent|blocked|failed, ошибка)."""
+    for _ in range(3):
+        await send_limiter.acquire()
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+            return "sent", None
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramForbiddenError as e:
+            return "blocked", e.message
+        except Exception as e:
+            return "failed", str(e)[:200]
+    return "failed", "flood control"
+
+
+def format_broadcast_progress(b: sqlite3.Row, rate: float) -> str:
+    processed = b["sent"] + b["failed"] + b["blocked"]
+    title = {
+        "running": "⏳ идёт",
+        "done": "✅ завершена",
+        "cancelled": "⏹ остановлена",
+    }.get(b["status"], b["status"])
     text = (
-        f"📨 Сообщение от пользователя @{message.from_user.username or 'без_username'} "
-        f"(ID {message.from_user.id}):\n\n{message.text}"
+        f"📣 <b>Рассылка №{b['id']}</b> — {title}\n\n"
+        f"Обработано: {processed} из {b['total']}\n"
+        f"Доставлено: {b['sent']}\n"
+        f"Ошибок: {b['failed']}\n"
+        f"Заблокировали бота: {b['blocked']}"
     )
-    sent = False
-    for admin_id in ADMINS:
-        try:
-            await bot.send_message(admin_id, text)
-            sent = True
-        except Exception:
-            pass
+    if b["status"] == "running" and rate > 0:
+        left = max(b["total"] - processed, 0)
+        eta = int(left / rate)
+        text += f"\n\nСкорость: {rate:.1f} сообщ./с, осталось ≈ {eta // 60} мин {eta % 60} с"
+    return text
 
-    await state.clear()
 
-    if sent:
-        await message.answer(
-            "Ваше сообщение передано менеджеру. "
-            "Мы ответим вам в этом чате."
-        )
-    else:
-        await message.answer(
-            "Не удалось передать сообщение менеджеру. Попробуйте позже."
+async def report_broadcast_progress(b: sqlite3.Row, rate: float) -> None:
+    if not b["progress_chat_id"] or not b["progress_msg_id"]:
+        return
+    try:
+        await bot.edit_message_text(
+            format_broadcast_progress(b, rate),
+            chat_id=b["progress_chat_id"],
+            message_id=b["progress_msg_id"],
+            reply_markup=broadcast_stop_kb(b["id"]) if b["status"] == "running" else None,
         )
+    except Exception:
+        pass
 
 
-# Дополнительные колбэки от кнопок после статуса
+async def run_broadcast(broadcast_id: int) -> None:
+    loop = asyncio.get_running_loop()
+    b = await db.aio.get_broadcast(broadcast_id)
+    cursor = b["cursor_user_id"]
+    started = loop.time()
+    last_report = started
+    processed = 0
+    try:
+        while True:
+            # статус читаем из базы: так работает кнопка «Остановить»
+            b = await db.aio.get_broadcast(broadcast_id)
+            if b["status"] != "running":
+                break
+            rows = await db.aio.get_broadcast_recipients(broadcast_id, cursor, BROADCAST_BATCH_SIZE)
+            if not rows:
+                await db.aio.set_broadcast_status(broadcast_id, "done")
+                break
+            outcomes = await asyncio.gather(
+                *(deliver_message(r["tg_id"], b["text"]) for r in rows)
+            )
+            cursor = rows[-1]["id"]
+            await db.aio.record_broadcast_batch(
+                broadcast_id,
+                cursor,
+                [(r["id"], status, error) for r, (status, error) in zip(rows, outcomes)],
+            )
+            processed += len(rows)
+            now = loop.time()
+            if now - last_report >= BROADCAST_PROGRESS_SECONDS:
+                last_report = now
+                await report_broadcast_progress(
+                    await db.aio.get_broadcast(broadcast_id), processed / (now - started)
+                )
+    except Exception:
+        logger.exception("Broadcast %s crashed", broadcast_id)
+    finally:
+        broadcast_tasks.pop(broadcast_id, None)
+    await report_broadcast_progress(await db.aio.get_broadcast(broadcast_id), 0)
 
 
-@router.callback_query(F.data == "user:newapp")
-async def user_newapp(callback: CallbackQuery, state: FSMContext):
-    await start_app_form(callback.message, state)
-    await callback.answer()
+def start_broadcast_task(broadcast_id: int) -> None:
+    if broadcast_id not in broadcast_tasks:
+        broadcast_tasks[broadcast_id] = asyncio.create_task(run_broadcast(broadcast_id))
 
 
-@router.callback_query(F.data == "user:contact")
-async def user_contact(callback: CallbackQuery, state: FSMContext):
-    await contact_manager_start(callback.message, state)
+@admin_router.callback_query(F.data == "bc:new")
+async def broadcast_new(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    await state.set_state(BroadcastForm.text)
+    await callback.message.answer(
+        "📣 <b>Рассылка</b>\n\n"
+        "Отправьте текст сообщения для всех пользователей бота одним сообщением."
+    )
     await callback.answer()
 
 
-# ---------- Админ‑панель ----------
-
-
-@admin_router.message(StateFilter(None), F.text == "🛠 Админ‑панель")
-async def admin_panel(message: Message):
+@admin_router.message(BroadcastForm.text)
+async def broadcast_text(message: Message, state: FSMContext):
     if not is_admin(message.from_user.id):
-        await message.answer("У вас нет доступа к админ‑панели.")
+        await state.clear()
         return
-    await message.answer(
-        "🛠 <b>Админ‑панель Anex</b>\n\n"
-        "Выберите, какие заявки хотите посмотреть.",
-        reply_markup=admin_panel_kb(),
-    )
+    if not message.text:
+        await message.answer("Нужен текст сообщения.")
+        return
+    await state.update_data(bc_text=message.html_text)
+    await state.set_state(BroadcastForm.confirm)
+    await message.answer("Так сообщение увидят пользователи:")
+    await message.answer(message.html_text, reply_markup=broadcast_confirm_kb())
 
 
-@admin_router.callback_query(F.data.startswith("adm:list:"))
-async def admin_list(callback: CallbackQuery):
+@admin_router.callback_query(BroadcastForm.confirm, F.data == "bc:go")
+async def broadcast_go(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа.", show_alert=True)
         return
+    data = await state.get_data()
+    await state.clear()
+    broadcast_id = await db.aio.create_broadcast(callback.from_user.id, data["bc_text"])
+    b = await db.aio.get_broadcast(broadcast_id)
+    progress = await callback.message.answer(
+        format_broadcast_progress(b, 0), reply_markup=broadcast_stop_kb(broadcast_id)
+    )
+    await db.aio.set_broadcast_progress_message(broadcast_id, progress.chat.id, progress.message_id)
+    start_broadcast_task(broadcast_id)
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await callback.answer("Рассылка запущена")
 
-    kind = callback.data.split(":")[2]
-    if kind == "new":
-        statuses = ["new"]
-        title = "🆕 <b>Новые заявки</b>"
-    elif kind == "in_progress":
-        statuses = ["in_progress"]
-        title = "⏳ <b>Заявки в обработке</b>"
-    elif kind == "approved":
-        statuses = ["approved"]
-        title = "✅ <b>Одобренные заявки</b>"
-    elif kind == "rejected":
-        statuses = ["rejected"]
-        title = "❌ <b>Отклонённые заявки</b>"
-    else:
-        statuses = ["new", "in_progress", "approved", "rejected"]
-        title = "📊 <b>Все заявки</b>"
 
-    apps = db.get_applications_by_status(statuses, limit=20)
+@admin_router.callback_query(F.data == "bc:cancel")
+async def broadcast_cancel(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await callback.answer("Рассылка отменена")
+
 
-    if not apps:
-        await callback.message.answer(f"{title}\n\nЗаявок в этой категории нет.")
-        await callback.answer()
+@admin_router.callback_query(F.data.startswith("bc:stop:"))
+async def broadcast_stop(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
         return
+    broadcast_id = int(callback.data.split(":")[2])
+    b = await db.aio.get_broadcast(broadcast_id)
+    if b and b["status"] == "running":
+        await db.aio.set_broadcast_status(broadcast_id, "cancelled")
+    await callback.answer("Останавливаю…")
 
-    await callback.message.answer(title)
-    for a in apps:
-        text = (
-            f"№{a['id']} — {human_status(a['status'])}\n"
-            f"Клиент: @{a['username'] or 'без_username'} (ID {a['tg_id']})\n"
-            f"Направление: {a['destination']}\n"
-            f"Даты: {a['dates']}\n"
-            f"Создана: {a['created_at']}"
-        )
-        await callback.message.answer(text, reply_markup=app_item_kb(a["id"]))
 
-    await callback.answer()
+# ---------- Состояние процесса ----------
 
 
-def format_app_full(a: sqlite3.Row) -> str:
+def format_stats() -> str:
+    p50, p99, worst = monitor.lag_percentiles()
+    session = bot.session
+    uptime = int(time.time() - monitor.started_at)
+    top = monitor.timeouts.most_common(3)
+    timed_out = " (" + ", ".join(f"{name}: {n}" for name, n in top) + ")" if top else ""
     return (
-        f"📝 <b>Заявка №{a['id']}</b> — {human_status(a['status'])}\n\n"
-        f"<b>Клиент:</b> @{a['username'] or 'без_username'} (ID {a['tg_id']})\n"
-        f"<b>Имя:</b> {a['first_name'] or '-'}\n"
-        f"<b>Создана:</b> {a['created_at']}\n"
-        f"<b>Обновлена:</b> {a['updated_at']}\n\n"
-        f"<b>Направление:</b> {a['destination']}\n"
-        f"<b>Даты:</b> {a['dates']}\n"
-        f"<b>Взрослых:</b> {a['adults']}\n"
-        f"<b>Детей:</b> {a['children']}\n"
-        f"<b>Бюджет:</b> {a['budget']}\n"
-        f"<b>Пожелания:</b> {a['wishes']}\n"
-        f"<b>Контакт:</b> {a['contact']}\n\n"
-        f"<b>Комментарий менеджера:</b> {a['admin_comment'] or '—'}"
+        f"📟 <b>Состояние процесса {os.getpid()}</b>\n"
+        f"Работает: {uptime // 3600} ч {uptime % 3600 // 60} мин\n\n"
+        "<b>Цикл событий</b> (за минуту)\n"
+        f"Задержка: p50 {p50 * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс, макс {worst * 1000:.1f} мс\n"
+        f"Худшая с запуска: {monitor.max_lag * 1000:.0f} мс\n"
+        f"Блокировок дольше {monitor.block_threshold * 1000:.0f} мс: {monitor.blocks}\n\n"
+        "<b>Обработчики</b>\n"
+        f"В работе: {monitor.handlers_in_flight} (пик {monitor.handlers_peak})\n"
+        f"Обработано апдейтов: {monitor.handled}\n"
+        f"Прервано по сроку: {sum(monitor.timeouts.values())}{timed_out}\n"
+        f"Задач asyncio: {len(asyncio.all_tasks())}\n\n"
+        "<b>Исходящие запросы</b>\n"
+        f"В полёте: {session.in_flight}, ждут слота: {session.waiting}\n"
+        f"Ждут лимита рассылки: {send_limiter.waiting}\n"
+        f"Всего запросов: {session.stats['requests']}, "
+        f"повторное использование соединений: {session.reuse_ratio() * 100:.0f}%\n\n"
+        "<b>Фоновые очереди</b>\n"
+        f"Таймеров SLA: {len(sla.due)}\n"
+        f"Открытых анкет: {len(forms.sessions)}\n"
+        f"Рассылок в работе: {sum(not t.done() for t in broadcast_tasks.values())}"
     )
 
 
-@admin_router.callback_query(F.data.startswith("adm:open:"))
-async def admin_open(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer("Нет доступа.", show_alert=True)
-        return
-    app_id = int(callback.data.split(":")[2])
-    a = db.get_application(app_id)
-    if not a:
-        await callback.message.answer("Заявка не найдена.")
-        await callback.answer()
+@admin_router.message(Command("stats"))
+async def admin_stats(message: Message):
+    if not is_admin(message.from_user.id):
         return
-
-    if a["status"] == "new":
-        db.update_application_status(app_id, "in_progress", callback.from_user.id, a["admin_comment"] or "")
-        a = db.get_application(app_id)
-
-    text = format_app_full(a)
-    await callback.message.answer(text, reply_markup=app_manage_kb(app_id))
-    await callback.answer()
+    note = "\n\n<i>Режим воркеров: показан процесс, который принял команду.</i>" if WORKERS > 0 else ""
+    await message.answer(format_stats() + note)
 
 
 # ---------- Одобрение / отклонение заявки ----------
@@ -1352,15 +6056,14 @@ async def admin_approve_start(callback: CallbackQuery, state: FSMContext):
         return
 
     app_id = int(callback.data.split(":")[2])
-    a = db.get_application(app_id)
+    a = await claimed_application(callback, app_id)
     if not a:
-        await callback.message.answer("Заявка не найдена.")
-        await callback.answer()
         return
 
     await state.set_state(ApproveForm.comment)
     await state.update_data(
         app_id=app_id,
+        app_version=a["version"],
         src_chat_id=callback.message.chat.id,
         src_msg_id=callback.message.message_id,
     )
@@ -1375,41 +6078,11 @@ async def admin_approve_start(callback: CallbackQuery, state: FSMContext):
 
 @admin_router.message(ApproveForm.comment)
 async def admin_approve_finish(message: Message, state: FSMContext):
-    data = await state.get_data()
-    app_id = data["app_id"]
-    src_chat_id = data.get("src_chat_id")
-    src_msg_id = data.get("src_msg_id")
-
     comment = message.text.strip()
     if comment == "-":
         comment = ""
 
-    db.update_application_status(app_id, "approved", message.from_user.id, comment)
-    a = db.get_application(app_id)
-
-    await state.clear()
-
-    if src_chat_id and src_msg_id:
-        try:
-            await bot.edit_reply_markup(chat_id=src_chat_id, message_id=src_msg_id, reply_markup=None)
-        except Exception:
-            pass
-
-    await message.answer(f"Заявка №{app_id} отмечена как <b>одобренная</b>.")
-
-    try:
-        text = (
-            f"✅ <b>Ваша заявка №{app_id} одобрена менеджером.</b>\n\n"
-            f"Направление: {a['destination']}\n"
-            f"Даты: {a['dates']}\n\n"
-        )
-        if comment:
-            text += f"Комментарий менеджера:\n{comment}"
-        else:
-            text += "С вами свяжутся для уточнения деталей."
-        await bot.send_message(a["tg_id"], text, reply_markup=user_after_status_kb())
-    except Exception:
-        pass
+    await close_application(message, state, "approved", comment)
 
 
 @admin_router.callback_query(F.data.startswith("adm:reject:"))
@@ -1419,15 +6092,14 @@ async def admin_reject_start(callback: CallbackQuery, state: FSMContext):
         return
 
     app_id = int(callback.data.split(":")[2])
-    a = db.get_application(app_id)
+    a = await claimed_application(callback, app_id)
     if not a:
-        await callback.message.answer("Заявка не найдена.")
-        await callback.answer()
         return
 
     await state.set_state(RejectForm.comment)
     await state.update_data(
         app_id=app_id,
+        app_version=a["version"],
         src_chat_id=callback.message.chat.id,
         src_msg_id=callback.message.message_id,
     )
@@ -1441,39 +6113,53 @@ async def admin_reject_start(callback: CallbackQuery, state: FSMContext):
 
 @admin_router.message(RejectForm.comment)
 async def admin_reject_finish(message: Message, state: FSMContext):
-    data = await state.get_data()
-    app_id = data["app_id"]
-    src_chat_id = data.get("src_chat_id")
-    src_msg_id = data.get("src_msg_id")
-
     comment = message.text.strip()
     if not comment:
         comment = "Заявка отклонена без указания причины."
 
-    db.update_application_status(app_id, "rejected", message.from_user.id, comment)
-    a = db.get_application(app_id)
+    await close_application(message, state, "rejected", comment)
 
-    await state.clear()
 
-    if src_chat_id and src_msg_id:
-        try:
-            await bot.edit_reply_markup(chat_id=src_chat_id, message_id=src_msg_id, reply_markup=None)
-        except Exception:
-            pass
+# ---------- Админ: отзывы ----------
+# Менеджер отзывов живёт в одном сообщении: переходы правят его текст и кнопки.
+
+ADMIN_REVIEWS_PAGE = 25
 
-    await message.answer(f"Заявка №{app_id} отмечена как <b>отклонённая</b>.")
 
+async def edit_in_place(message: Message, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+    """Правит сообщение бота; если текст и кнопки те же — запрос не отправляется."""
+    if message.html_text == text and message.reply_markup == reply_markup:
+        return
     try:
-        text = (
-            f"❌ <b>Ваша заявка №{app_id} отклонена.</b>\n\n"
-            f"Причина:\n{comment}"
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" in e.message:
+            return
+        # сообщение слишком старое или удалено — показываем заново
+        await message.answer(text, reply_markup=reply_markup)
+
+
+async def admin_reviews_page(before_id: Optional[int] = None, note: str = "") -> Tuple[str, InlineKeyboardMarkup]:
+    rows = await db.aio.list_reviews_newest_first(limit=ADMIN_REVIEWS_PAGE + 1, before_id=before_id)
+    if not rows and before_id is not None:
+        # дальше отзывов нет (например, удалили последний) — первая страница
+        return await admin_reviews_page(None, note)
+    more = len(rows) > ADMIN_REVIEWS_PAGE
+    rows = rows[:ADMIN_REVIEWS_PAGE]
+    if not rows and before_id is None:
+        return (
+            note + "⭐ <b>Отзывы</b>\n\nПока нет ни одного отзыва.",
+            admin_reviews_list_kb([]),
         )
-        await bot.send_message(a["tg_id"], text, reply_markup=user_after_status_kb())
-    except Exception:
-        pass
-
-
-# ---------- Админ: отзывы ----------
+    text = note + "⭐ <b>Управление отзывами</b>\n\nВыберите отзыв:"
+    if rows:
+        text += f" №{rows[0]['id']}–{rows[-1]['id']}"
+    kb = admin_reviews_list_kb(
+        rows,
+        next_before=rows[-1]["id"] if more else None,
+        before_id=before_id,
+    )
+    return text, kb
 
 
 @admin_router.callback_query(F.data == "admrev:panel")
@@ -1482,37 +6168,20 @@ async def admrev_panel(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Нет доступа.", show_alert=True)
         return
     await state.clear()
-    await callback.message.answer(
-        "🛠 <b>Админ‑панель Anex</b>\n\n"
-        "Выберите, какие заявки хотите посмотреть.",
-        reply_markup=admin_panel_kb(),
-    )
+    await edit_in_place(callback.message, TEXT_ADMIN_PANEL, admin_panel_kb())
     await callback.answer()
 
 
-@admin_router.callback_query(F.data == "admrev:list")
+@admin_router.callback_query(F.data.startswith("admrev:list"))
 async def admrev_list(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа.", show_alert=True)
         return
     await state.clear()
-    rows = db.list_reviews_newest_first(limit=25)
-    back = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="⬅️ В админ‑панель", callback_data="admrev:panel")]
-        ]
-    )
-    if not rows:
-        await callback.message.answer(
-            "⭐ <b>Отзывы</b>\n\nПока нет ни одного отзыва.",
-            reply_markup=back,
-        )
-        await callback.answer()
-        return
-    await callback.message.answer(
-        "⭐ <b>Управление отзывами</b>\n\nВыберите отзыв (последние 25):",
-        reply_markup=admin_reviews_list_kb(rows),
-    )
+    parts = callback.data.split(":")
+    before_id = int(parts[2]) if len(parts) > 2 else None
+    text, kb = await admin_reviews_page(before_id)
+    await edit_in_place(callback.message, text, kb)
     await callback.answer()
 
 
@@ -1522,15 +6191,17 @@ async def admrev_open(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Нет доступа.", show_alert=True)
         return
     await state.clear()
-    review_id = int(callback.data.split(":")[2])
-    r = db.get_review(review_id)
+    parts = callback.data.split(":")
+    review_id = int(parts[2])
+    before_id = int(parts[3]) if len(parts) > 3 else None
+    r = await db.aio.get_review(review_id)
     if not r:
-        await callback.message.answer("Отзыв не найден.")
-        await callback.answer()
+        await callback.answer("Отзыв не найден.", show_alert=True)
         return
-    await callback.message.answer(
+    await edit_in_place(
+        callback.message,
         format_admin_review_caption(r),
-        reply_markup=admin_review_manage_kb(review_id),
+        admin_review_manage_kb(review_id, r["photos"], before_id),
     )
     await callback.answer()
 
@@ -1543,20 +6214,70 @@ async def admrev_star(callback: CallbackQuery, state: FSMContext):
     parts = callback.data.split(":")
     review_id = int(parts[2])
     stars = int(parts[3])
+    before_id = int(parts[4]) if len(parts) > 4 else None
     if stars < 1 or stars > 5:
         await callback.answer()
         return
-    r = db.get_review(review_id)
+    r = await db.aio.get_review(review_id)
     if not r:
         await callback.answer("Отзыв удалён.", show_alert=True)
         return
-    db.update_review_stars(review_id, stars)
-    r = db.get_review(review_id)
-    await callback.message.answer(
-        f"Оценка обновлена.\n\n{format_admin_review_caption(r)}",
-        reply_markup=admin_review_manage_kb(review_id),
+    if r["stars"] == stars:
+        await callback.answer("Оценка уже такая")
+        return
+    await db.aio.update_review_stars(review_id, stars)
+    review_feed.invalidate()
+    r = await db.aio.get_review(review_id)
+    await edit_in_place(
+        callback.message,
+        format_admin_review_caption(r),
+        admin_review_manage_kb(review_id, r["photos"], before_id),
+    )
+    await callback.answer("Оценка обновлена")
+
+
+@admin_router.callback_query(F.data.startswith("admrev:photos:"))
+async def admrev_photos(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    review_id = int(callback.data.split(":")[2])
+    photos = await db.aio.list_review_photos(review_id)
+    if not photos:
+        await callback.answer("У отзыва нет фото.", show_alert=True)
+        return
+    # альбом — отдельным сообщением; карточка отзыва остаётся на месте
+    try:
+        if len(photos) == 1:
+            await callback.message.answer_photo(photos[0], caption=f"Отзыв №{review_id}")
+        else:
+            await callback.message.answer_media_group(
+                [InputMediaPhoto(media=file_id, caption=f"Отзыв №{review_id}") for file_id in photos]
+            )
+    except TelegramBadRequest as e:
+        await callback.answer(f"Telegram не принял фото: {e.message}", show_alert=True)
+        return
+    await callback.answer()
+
+
+@admin_router.callback_query(F.data.startswith("admrev:delphotos:"))
+async def admrev_del_photos(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
+        return
+    parts = callback.data.split(":")
+    review_id = int(parts[2])
+    before_id = int(parts[3]) if len(parts) > 3 else None
+    await db.aio.delete_review_photos(review_id)
+    review_feed.invalidate()
+    r = await db.aio.get_review(review_id)
+    if not r:
+        await callback.answer("Отзыв удалён.", show_alert=True)
+        return
+    await edit_in_place(
+        callback.message, format_admin_review_caption(r), admin_review_manage_kb(review_id, before_id=before_id)
     )
-    await callback.answer("Сохранено")
+    await callback.answer("Фото убраны")
 
 
 @admin_router.callback_query(F.data.startswith("admrev:edittext:"))
@@ -1564,16 +6285,23 @@ async def admrev_edittext(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа.", show_alert=True)
         return
-    review_id = int(callback.data.split(":")[2])
-    r = db.get_review(review_id)
+    parts = callback.data.split(":")
+    review_id = int(parts[2])
+    before_id = int(parts[3]) if len(parts) > 3 else None
+    r = await db.aio.get_review(review_id)
     if not r:
         await callback.answer("Отзыв не найден.", show_alert=True)
         return
     await state.set_state(AdminReviewForm.waiting_body)
-    await state.update_data(adm_rev_id=review_id)
-    await callback.message.answer(
+    # после ввода текста правим это же сообщение обратно в карточку отзыва
+    await state.update_data(
+        adm_rev_id=review_id, adm_rev_msg_id=callback.message.message_id, adm_rev_before=before_id
+    )
+    await edit_in_place(
+        callback.message,
         f"Отзыв №{review_id}. Отправьте новый текст одним сообщением.\n"
-        "Чтобы убрать текст отзыва, отправьте «-»."
+        "Чтобы убрать текст отзыва, отправьте «-».",
+        admin_review_back_kb(review_id, before_id),
     )
     await callback.answer()
 
@@ -1588,22 +6316,25 @@ async def admrev_edittext_save(message: Message, state: FSMContext):
     if not review_id:
         await state.clear()
         return
-    r = db.get_review(review_id)
+    await state.clear()
+    r = await db.aio.get_review(review_id)
     if not r:
-        await state.clear()
         await message.answer("Отзыв не найден.")
         return
     raw = (message.text or "").strip()
-    if raw == "-":
-        db.update_review_body(review_id, None)
-    else:
-        db.update_review_body(review_id, raw[:2000])
-    await state.clear()
-    r = db.get_review(review_id)
-    await message.answer(
-        "Текст обновлён.\n\n" + format_admin_review_caption(r),
-        reply_markup=admin_review_manage_kb(review_id),
-    )
+    body = None if raw == "-" else raw[:2000]
+    if body != r["body"]:
+        await db.aio.update_review_body(review_id, body)
+        review_feed.invalidate()
+        r = await db.aio.get_review(review_id)
+    text = format_admin_review_caption(r)
+    kb = admin_review_manage_kb(review_id, r["photos"], data.get("adm_rev_before"))
+    try:
+        await bot.edit_message_text(
+            text, chat_id=message.chat.id, message_id=data["adm_rev_msg_id"], reply_markup=kb
+        )
+    except (KeyError, TelegramBadRequest):
+        await message.answer(text, reply_markup=kb)
 
 
 @admin_router.callback_query(F.data.startswith("admrev:delask:"))
@@ -1611,14 +6342,17 @@ async def admrev_del_prompt(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа.", show_alert=True)
         return
-    review_id = int(callback.data.split(":")[2])
-    r = db.get_review(review_id)
+    parts = callback.data.split(":")
+    review_id = int(parts[2])
+    before_id = int(parts[3]) if len(parts) > 3 else None
+    r = await db.aio.get_review(review_id)
     if not r:
         await callback.answer("Отзыв не найден.", show_alert=True)
         return
-    await callback.message.answer(
+    await edit_in_place(
+        callback.message,
         f"Удалить отзыв №{review_id}?",
-        reply_markup=admin_review_delete_confirm_kb(review_id),
+        admin_review_delete_confirm_kb(review_id, before_id),
     )
     await callback.answer()
 
@@ -1628,36 +6362,479 @@ async def admrev_del_yes(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет доступа.", show_alert=True)
         return
-    review_id = int(callback.data.split(":")[2])
-    db.delete_review(review_id)
+    parts = callback.data.split(":")
+    review_id = int(parts[2])
+    before_id = int(parts[3]) if len(parts) > 3 else None
+    await db.aio.delete_review(review_id)
+    review_feed.invalidate()
     await state.clear()
-    await callback.message.answer(f"Отзыв №{review_id} удалён.")
-    rows = db.list_reviews_newest_first(limit=25)
-    back = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="⬅️ В админ‑панель", callback_data="admrev:panel")]
-        ]
-    )
+    # возвращаемся на страницу списка, с которой открыли отзыв
+    text, kb = await admin_reviews_page(before_id, note=f"🗑 Отзыв №{review_id} удалён.\n\n")
+    await edit_in_place(callback.message, text, kb)
+    await callback.answer("Удалено")
+
+
+# ------------------ ФОНОВЫЕ ЗАДАЧИ ------------------------
+
+
+async def archive_loop():
+    # Горячая таблица должна содержать только актуальную работу:
+    # закрытые заявки старше ARCHIVE_AFTER_DAYS уезжают в архив пачками.
+    while True:
+        try:
+            moved = 0
+            while True:
+                n = await db.aio.archive_closed_batch(ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+                moved += n
+                if n < ARCHIVE_BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+            if moved:
+                logger.info("Archived %s closed applications", moved)
+        except Exception:
+            logger.exception("Archive job failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+async def funnel_flush_loop():
+    try:
+        while True:
+            await asyncio.sleep(FUNNEL_FLUSH_SECONDS)
+            try:
+                await flush_funnel()
+            except Exception:
+                logger.exception("Funnel flush failed")
+    finally:
+        await flush_funnel()
+
+
+async def learn_destinations() -> int:
+    """Разбирает заявки без destination_id: знакомые тексты получают направление,
+    частые незнакомые становятся новыми направлениями. Возвращает число новых."""
+    rows = await db.aio.unmatched_destinations()
     if not rows:
-        await callback.message.answer("⭐ Отзывов больше нет.", reply_markup=back)
+        return 0
+    mapping: Dict[str, int] = {}
+    # нормализованный ключ → варианты написания и сколько раз каждый встретился
+    unknown: Dict[str, Counter] = defaultdict(Counter)
+    for r in rows:
+        text = r["destination"]
+        dest_id = destinations.match(text) if text else None
+        if dest_id is not None:
+            mapping[text] = dest_id
+        elif normalize_destination(text):
+            unknown[normalize_destination(text)][text.strip()] += r["n"]
+    learned = [
+        (spellings.most_common(1)[0][0], None, "", "history")
+        for spellings in unknown.values()
+        if sum(spellings.values()) >= DEST_HISTORY_MIN_USES
+    ]
+    if learned:
+        await db.aio.add_destinations(learned)
+        destinations.load(await db.aio.list_destinations())
+        for spellings in unknown.values():
+            for text in spellings:
+                dest_id = destinations.exact(text)
+                if dest_id is not None:
+                    mapping[text] = dest_id
+    await db.aio.set_destination_ids(mapping, max(r["last_id"] for r in rows))
+    return len(learned)
+
+
+async def destinations_loop(learn: bool):
+    # первый процесс заодно разбирает накопившиеся заявки; перечитывают справочник все
+    while True:
+        try:
+            if learn:
+                learned = await learn_destinations()
+                if learned:
+                    logger.info("Learned %s destinations from applications", learned)
+            destinations.load(await db.aio.list_destinations())
+        except Exception:
+            logger.exception("Destinations reload failed")
+        await asyncio.sleep(DEST_RELOAD_SECONDS)
+
+
+def form_state(chat_id: int, user_id: int) -> FSMContext:
+    return FSMContext(storage=dp.storage, key=StorageKey(bot_id=bot.id, chat_id=chat_id, user_id=user_id))
+
+
+async def send_form_reminder(chat_id: int, user_id: int, stage: str) -> None:
+    state = form_state(chat_id, user_id)
+    if stage == "review:stars":
+        app_id = (await state.get_data()).get("rev_app_id")
+        if app_id is None or await db.aio.review_for_application_exists(app_id):
+            return
+        await deliver_message(chat_id, TEXT_REVIEW_STARS_REMINDER, reply_markup=review_stars_kb(app_id))
+    elif stage == ReviewForm.waiting_text.state:
+        await deliver_message(chat_id, TEXT_REVIEW_TEXT_REMINDER, reply_markup=review_text_options_kb())
     else:
-        await callback.message.answer(
-            "⭐ <b>Управление отзывами</b>",
-            reply_markup=admin_reviews_list_kb(rows),
-        )
-    await callback.answer("Удалено")
+        await deliver_message(chat_id, TEXT_FORM_REMINDER, reply_markup=form_reminder_kb())
+
+
+async def form_inactivity_loop():
+    # одно колесо таймеров на процесс вместо задачи на каждую открытую анкету
+    while True:
+        await asyncio.sleep(FORM_TIMER_TICK_SECONDS)
+        for key, stage, action in forms.due():
+            # пока шли предыдущие отправки, пользователь мог вернуться к анкете
+            entry = forms.sessions.get(key)
+            try:
+                if action == "remind" and entry and entry[2]:
+                    await send_form_reminder(*key, stage)
+                elif action == "expire" and entry is None:
+                    # за время отправок пользователь мог перейти в неотслеживаемое состояние
+                    # (например, SupportForm) — его не трогаем
+                    state = form_state(*key)
+                    current = await state.get_state()
+                    if current is None or current in TRACKED_FORM_STATES:
+                        await state.clear()
+            except Exception:
+                logger.exception("Form reminder failed for %s", key[0])
+
+
+def format_age(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+
+
+async def escalate_application(app_id: int, level: int, created_ts: float) -> bool:
+    # статус мог поменять админ в другом процессе — проверяем по базе
+    a = await db.aio.get_application(app_id)
+    if not a or a["status"] != "new":
+        return False
+    await db.aio.set_application_sla_level(app_id, level + 1)
+    text = T_SLA_ESCALATION.render(
+        app_id=app_id,
+        age=format_age(time.time() - created_ts),
+        username=a["username"] or "без_username",
+        tg_id=a["tg_id"],
+        destination=a["destination"],
+        dates=a["dates"],
+    )
+    for admin_id in ADMINS:
+        await deliver_message(admin_id, text, reply_markup=app_item_kb(app_id))
+    logger.info("Application %s escalated (level %s)", app_id, level + 1)
+    return True
+
+
+async def start_background_jobs(index: int = 0, workers: int = 1) -> List[asyncio.Task]:
+    # таймеры SLA есть в каждом процессе — для заявок его пользователей
+    tasks = [
+        asyncio.create_task(sla.run(await db.aio.list_sla_pending(workers, index), escalate_application)),
+        asyncio.create_task(funnel_flush_loop()),
+        asyncio.create_task(form_inactivity_loop()),
+        asyncio.create_task(monitor.run()),
+        asyncio.create_task(destinations_loop(learn=index == 0)),
+    ]
+    if index == 0:
+        tasks.append(asyncio.create_task(archive_loop()))
+        for b in await db.aio.list_running_broadcasts():
+            start_broadcast_task(b["id"])
+    return tasks
+
+
+# ------------------ РАБОЧИЕ ПРОЦЕССЫ ----------------------
+#
+# Режим BOT_WORKERS=N: процесс‑приёмник забирает апдейты getUpdates и, не разбирая их
+# в модели aiogram, раскладывает по N рабочим процессам по from_user.id. Все апдейты
+# одного пользователя попадают в один процесс, поэтому его FSM‑состояние (MemoryStorage)
+# и порядок обработки сохраняются, а разбор апдейтов, HTML и SQLite идут на N ядрах.
+
+
+def update_owner_id(raw: dict) -> int:
+    for key, value in raw.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        if "from" in value:
+            return int(value["from"]["id"])
+        if "chat" in value:
+            return int(value["chat"]["id"])
+    return 0
+
+
+def setup_dispatcher() -> None:
+    if router.parent_router is None:
+        dp.include_router(router)
+        dp.include_router(admin_router)
+
+
+async def worker_main(index: int, updates: "multiprocessing.Queue") -> None:
+    setup_dispatcher()
+    loop = asyncio.get_running_loop()
+    # последний апдейт каждого пользователя: следующий ждёт его завершения
+    tails: Dict[int, asyncio.Task] = {}
+
+    async def handle(raw: dict, prev: Optional[asyncio.Task]) -> None:
+        if prev is not None:
+            await asyncio.wait([prev])
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception:
+            logger.exception("Worker %s failed to handle update %s", index, raw.get("update_id"))
+
+    def release(uid: int, task: asyncio.Task) -> None:
+        if tails.get(uid) is task:
+            del tails[uid]
+
+    background = await start_background_jobs(index, WORKERS)
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            batch = [raw]
+            # забираем всё, что уже накопилось, без лишних переходов в поток
+            while raw is not None:
+                try:
+                    raw = updates.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(raw)
+            for raw in batch:
+                if raw is None:
+                    break
+                uid = update_owner_id(raw)
+                task = asyncio.create_task(handle(raw, tails.get(uid)))
+                tails[uid] = task
+                task.add_done_callback(lambda t, uid=uid: release(uid, t))
+            if batch[-1] is None:
+                break
+        if tails:
+            await asyncio.wait(list(tails.values()))
+        if followup_tasks:
+            await asyncio.wait(followup_tasks)
+    finally:
+        for task in background:
+            task.cancel()
+        # фоновые задачи на отмене ещё пишут в базу (сброс воронки) — ждём их
+        await asyncio.gather(*background, return_exceptions=True)
+        await bot.session.close()
+        db.close()
+
+
+def worker_entry(index: int, updates: "multiprocessing.Queue") -> None:
+    logging.basicConfig(level=logging.INFO)
+    run_async(worker_main(index, updates))
+
+
+async def run_front(workers: int, lease: "PollerLease", stop: asyncio.Event) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    # рабочие процессы живут, пока аренда у этого экземпляра: у резерва их нет
+    while await wait_for_lease(lease, stop):
+        queues = [ctx.Queue() for _ in range(workers)]
+        procs = [
+            ctx.Process(target=worker_entry, args=(i, queues[i]), name=f"tour-bot-worker-{i}")
+            for i in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+        logger.info("Started %s worker processes", workers)
+
+        def dispatch(batch: List[dict]) -> None:
+            for raw in batch:
+                queues[update_owner_id(raw) % workers].put(raw)
+
+        try:
+            await poll_with_lease(lease, stop, dispatch)
+        finally:
+            await lease.release()
+            for q in queues:
+                q.put(None)
+            await asyncio.to_thread(lambda: [proc.join(timeout=10) for proc in procs])
+    await bot.session.close()
+
+
+# ------------------- АРЕНДА ОПРОСА -----------------------
+#
+# Горячий резерв: несколько экземпляров бота на одной базе, getUpdates опрашивает только
+# держатель аренды, остальные ждут. Перед обработкой пачки держатель одной записью продлевает
+# аренду и сохраняет последний update_id пачки; не прошла запись — аренду уже забрал резерв,
+# и пачка остаётся ему. Новый держатель продолжает со следующего за сохранённым update_id,
+# поэтому апдейт не обрабатывается дважды. Апдейты, принятые упавшим держателем и не
+# обработанные до падения, теряются — как и при падении единственного процесса.
+
+
+class PollerLease:
+    def __init__(self, storage: Storage, name: str, ttl: float):
+        self.storage = storage
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.held = False
+        # последний принятый update_id
+        self.offset = 0
+
+    async def acquire(self) -> bool:
+        try:
+            self.held = await self.storage.aio.acquire_lease(self.name, self.holder, self.ttl)
+            if self.held:
+                self.offset = await self.storage.aio.get_update_offset(self.name)
+        except Exception:
+            logger.exception("Failed to acquire polling lease %s", self.name)
+            self.held = False
+        return self.held
+
+    async def commit(self, update_id: int) -> bool:
+        """Продлевает аренду и сохраняет update_id; False — аренда потеряна."""
+        try:
+            self.held = await self.storage.aio.commit_update_offset(self.name, self.holder, update_id, self.ttl)
+        except Exception:
+            # без базы не знаем, чья аренда, — уступаем её
+            logger.exception("Failed to renew polling lease %s", self.name)
+            self.held = False
+        if self.held:
+            self.offset = max(self.offset, update_id)
+        return self.held
+
+    async def release(self) -> None:
+        if self.held:
+            self.held = False
+            try:
+                await self.storage.aio.release_lease(self.name, self.holder)
+            except Exception:
+                logger.exception("Failed to release polling lease %s", self.name)
+
+
+def stop_event() -> asyncio.Event:
+    """SIGTERM/SIGINT: опрос завершается, аренда сразу переходит к резерву."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+async def wait_for_lease(lease: PollerLease, stop: asyncio.Event) -> bool:
+    """Резерв: раз в LEASE_RETRY_SECONDS пробует взять аренду; False — процесс останавливают."""
+    standby = False
+    while not stop.is_set():
+        if await lease.acquire():
+            logger.info("Polling lease %s taken by %s, resuming after update %s", lease.name, lease.holder, lease.offset)
+            return True
+        if not standby:
+            logger.info("Standby: polling lease %s is held by another instance", lease.name)
+            standby = True
+        try:
+            await asyncio.wait_for(stop.wait(), LEASE_RETRY_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+    return False
+
+
+async def fetch_updates(session: aiohttp.ClientSession, url: str, payload: dict) -> Optional[List[dict]]:
+    try:
+        async with session.post(url, json=payload, timeout=POLLING_TIMEOUT + POLLING_SLACK) as resp:
+            data = await resp.json(loads=bot.session.json_loads)
+    except Exception as e:
+        logger.error("Failed to fetch updates - %s: %s", type(e).__name__, e)
+        return None
+    if not data.get("ok"):
+        logger.error("getUpdates error: %s", data.get("description"))
+        return None
+    return data["result"]
+
+
+async def poll_with_lease(lease: PollerLease, stop: asyncio.Event, dispatch: Callable[[List[dict]], None]) -> None:
+    """getUpdates, пока аренда у этого процесса; dispatch получает ещё не принятые апдейты."""
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    payload = {
+        "timeout": POLLING_TIMEOUT,
+        "allowed_updates": dp.resolve_used_update_types(),
+    }
+    session = await bot.session.create_session()
+    stopping = asyncio.ensure_future(stop.wait())
+    try:
+        while True:
+            if lease.offset:
+                payload["offset"] = lease.offset + 1
+            request = asyncio.ensure_future(fetch_updates(session, url, payload))
+            await asyncio.wait([request, stopping], return_when=asyncio.FIRST_COMPLETED)
+            if stopping.done():
+                request.cancel()
+                return
+            updates = request.result()
+            batch = [raw for raw in updates or () if raw["update_id"] > lease.offset]
+            # сначала запись в базу, потом обработка; пустой опрос тоже продлевает аренду
+            if not await lease.commit(batch[-1]["update_id"] if batch else lease.offset):
+                logger.warning("Polling lease %s lost, %s updates left to the new holder", lease.name, len(batch))
+                return
+            if batch:
+                dispatch(batch)
+            elif updates is None:
+                await asyncio.sleep(1)
+    finally:
+        stopping.cancel()
 
 
 # ------------------ ЗАПУСК БОТА ---------------------------
 
 
 async def main():
+    logging.basicConfig(level=logging.INFO)
     if BOT_TOKEN == "ВАШ_ТОКЕН_БОТА_ОТ_BOTFATHER":
         print("⚠️ Укажи реальный BOT_TOKEN в переменной окружения BOT_TOKEN.")
-    dp.include_router(router)
-    dp.include_router(admin_router)
-    await dp.start_polling(bot)
+    setup_dispatcher()
+    stop = stop_event()
+    lease = PollerLease(db, f"poller:{bot.id}", LEASE_TTL_SECONDS)
+    if WORKERS > 0:
+        await run_front(WORKERS, lease, stop)
+        return
+    handling: Set[asyncio.Task] = set()
+
+    async def handle(raw: dict) -> None:
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception:
+            logger.exception("Failed to handle update %s", raw.get("update_id"))
+
+    def dispatch(batch: List[dict]) -> None:
+        for raw in batch:
+            task = asyncio.create_task(handle(raw))
+            handling.add(task)
+            task.add_done_callback(handling.discard)
+
+    try:
+        while await wait_for_lease(lease, stop):
+            # SLA, архив и рассылки — только у держателя аренды, иначе резерв их продублирует
+            background = await start_background_jobs()
+            try:
+                await poll_with_lease(lease, stop, dispatch)
+            finally:
+                await lease.release()
+                for task in background:
+                    task.cancel()
+                await asyncio.gather(*background, return_exceptions=True)
+        if handling:
+            await asyncio.wait(handling)
+        if followup_tasks:
+            await asyncio.wait(followup_tasks)
+    finally:
+        await bot.session.close()
+        logger.info("Bot API session: %s, reuse %.0f%%", bot.session.stats, bot.session.reuse_ratio() * 100)
+        db.close()
+
+
+def cli(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="main.py", description="Тур‑бот Anex")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="выгрузка таблицы в CSV/JSONL")
+    exp.add_argument("table", choices=EXPORT_TABLES)
+    exp.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    exp.add_argument("--gzip", action="store_true", help="сжать gzip")
+    exp.add_argument("-o", "--output", help="путь к файлу (по умолчанию <таблица>.<формат>)")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        out = args.output or f"{args.table}.{args.format}" + (".gz" if args.gzip else "")
+        rows = export_table(db, args.table, args.format, out, args.gzip)
+        print(f"{args.table}: {rows} rows -> {out}")
+    return 0
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
+    run_async(main())